@@ -1,6 +1,8 @@
 from flask import Flask
 from flask_cors import CORS
 
+from backend import db, metrics, profiling
+from backend.cli import register_commands
 from backend.config import Config
 from backend.models import init_db
 from backend.routes.auth import auth_bp
@@ -14,12 +16,18 @@ def create_app():
 
     CORS(app, supports_credentials=True)
 
+    db.init_app(app)
+    metrics.init_app(app)
+
     with app.app_context():
         init_db()
 
     app.register_blueprint(auth_bp, url_prefix="/api/auth")
     app.register_blueprint(admin_bp, url_prefix="/api/admin")
     app.register_blueprint(user_bp, url_prefix="/api/user")
+    profiling.init_app(app)
+
+    register_commands(app)
 
     return app
 
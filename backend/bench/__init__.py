@@ -0,0 +1,32 @@
+"""
+Stand-alone benchmarks and stress checks.
+
+Run them as modules from the repo root, e.g.
+
+    python -m backend.bench.allocation_stress --users 2000 --spots 500
+
+Each script points DB_PATH at a throwaway SQLite file before importing
+the backend, so the real parking.db is never touched. Scripts that need
+Redis accept --fake-redis to run against an in-process fakeredis server.
+"""
+import os
+import tempfile
+
+
+def use_scratch_db(path=None):
+    """Point Config.DB_PATH at a scratch database. Call before importing backend."""
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="parkflow-bench-"), "bench.db")
+    os.environ["DB_PATH"] = path
+    return path
+
+
+def use_fake_redis():
+    """Make backend.cache talk to fakeredis. Call before importing backend."""
+    import fakeredis
+    import redis
+
+    server = fakeredis.FakeServer()
+    redis.Redis.from_url = classmethod(
+        lambda cls, *args, **kwargs: fakeredis.FakeRedis(server=server)
+    )
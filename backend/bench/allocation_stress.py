@@ -0,0 +1,121 @@
+"""
+Concurrency stress test for models.allocate_spot.
+
+Many threads (each with its own connection, like separate workers) race
+to reserve spots in the same lot. Afterwards the script checks that no
+spot was handed out twice, that no user holds two active reservations and
+that spot status agrees with the reservations table. Exits non-zero on
+any violation and prints allocations/sec.
+"""
+import argparse
+import sys
+import threading
+import time
+
+from backend.bench import use_scratch_db
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--spots", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--db", default=None, help="scratch database path")
+    args = parser.parse_args(argv)
+
+    use_scratch_db(args.db)
+
+    from backend.db import get_db
+    from backend.models import init_db, allocate_spot, ReservationError
+
+    init_db()
+    db = get_db()
+    c = db.cursor()
+    c.execute("""
+        INSERT INTO parking_lots (prime_location_name, price_per_hour, number_of_spots)
+        VALUES ('stress', 10, ?)
+    """, (args.spots,))
+    lot_id = c.lastrowid
+    c.executemany(
+        "INSERT INTO parking_spots (lot_id, spot_number, status) VALUES (?, ?, 'A')",
+        [(lot_id, i) for i in range(1, args.spots + 1)],
+    )
+    c.executemany(
+        "INSERT INTO users (username, password_hash, role) VALUES (?, 'x', 'user')",
+        [(f"stress{i}",) for i in range(args.users)],
+    )
+    c.execute("SELECT id FROM users WHERE role = 'user'")
+    user_ids = [r[0] for r in c.fetchall()]
+    db.commit()
+
+    next_user = iter(user_ids)
+    lock = threading.Lock()
+    granted = []
+    refused = []
+
+    def worker():
+        while True:
+            with lock:
+                user_id = next(next_user, None)
+            if user_id is None:
+                return
+            try:
+                res = allocate_spot(user_id, lot_id, "2024-01-01T00:00:00")
+                granted.append(res["spot_id"])
+            except ReservationError:
+                refused.append(user_id)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    c.execute("""
+        SELECT spot_id, COUNT(*) FROM reservations
+        WHERE status = 'active'
+        GROUP BY spot_id HAVING COUNT(*) > 1
+    """)
+    double_booked = c.fetchall()
+
+    c.execute("""
+        SELECT user_id FROM reservations
+        WHERE status = 'active'
+        GROUP BY user_id HAVING COUNT(*) > 1
+    """)
+    double_users = c.fetchall()
+
+    c.execute("""
+        SELECT COUNT(*) FROM parking_spots ps
+        WHERE ps.lot_id = ?
+          AND (ps.status = 'O') != EXISTS (
+              SELECT 1 FROM reservations r
+              WHERE r.spot_id = ps.id AND r.status = 'active')
+    """, (lot_id,))
+    mismatched = c.fetchone()[0]
+
+    expected = min(args.users, args.spots)
+    attempts = len(granted) + len(refused)
+
+    print(f"threads={args.threads} users={args.users} spots={args.spots}")
+    print(f"granted={len(granted)} refused={len(refused)} expected_granted={expected}")
+    print(f"elapsed={elapsed:.3f}s  attempts/sec={attempts / elapsed:,.0f}  "
+          f"allocations/sec={len(granted) / elapsed:,.0f}")
+
+    ok = (
+        not double_booked
+        and not double_users
+        and mismatched == 0
+        and len(granted) == expected
+        and len(set(granted)) == len(granted)
+    )
+    print("OK: zero double-bookings" if ok else
+          f"FAIL: double_booked={double_booked} double_users={double_users} "
+          f"status_mismatch={mismatched}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
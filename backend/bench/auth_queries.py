@@ -0,0 +1,61 @@
+"""
+Per-request SQL statement counts for an authenticated, cached endpoint.
+
+Logs a user in and requests GET /api/user/parking-lots --requests times,
+first with the session-user cache disabled (USER_CACHE_TTL=0), then
+enabled, and prints the average X-DB-Queries per request for each.
+Runs each configuration in a fresh interpreter so Config is re-read.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from backend.bench import use_fake_redis, use_scratch_db
+
+
+def _measure(requests):
+    use_scratch_db()
+    use_fake_redis()
+
+    from backend.app import app
+
+    client = app.test_client()
+    client.post("/api/auth/register", json={"username": "bench", "password": "benchpass"})
+    client.post("/api/auth/login", json={"username": "bench", "password": "benchpass"})
+
+    counts = []
+    for _ in range(requests):
+        response = client.get("/api/user/parking-lots")
+        counts.append(int(response.headers["X-DB-Queries"]))
+    # Skip the first (cold) request; it fills both caches.
+    warm = counts[1:] or counts
+    return {"first": counts[0], "warm_avg": sum(warm) / len(warm)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(_measure(args.requests)))
+        return 0
+
+    print(f"{'user cache':>12} {'first req':>10} {'warm avg':>10}")
+    for label, ttl in (("off", "0"), ("on", "60")):
+        env = dict(os.environ, USER_CACHE_TTL=ttl, DB_COUNT_QUERIES="1")
+        out = subprocess.run(
+            [sys.executable, "-m", "backend.bench.auth_queries",
+             "--child", "--requests", str(args.requests)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print(f"{label:>12} {result['first']:>10} {result['warm_avg']:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Microbenchmark of the cached lot-listing hit path.
+
+Compares, for a lot list of --lots entries:
+  before  cache_get (json.loads) + jsonify re-encode  (pre-response-cache path)
+  after   json_response returning the stored bytes as-is
+for both the near (in-process) tier and the Redis tier, and times the
+object-level codecs that are installed. Prints microseconds per hit.
+"""
+import argparse
+import sys
+import time
+
+from backend.bench import use_fake_redis, use_scratch_db
+
+
+def _per_call_us(fn, n):
+    fn()
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lots", type=int, default=200)
+    parser.add_argument("--n", type=int, default=5000)
+    parser.add_argument("--fake-redis", action="store_true")
+    args = parser.parse_args(argv)
+
+    use_scratch_db()
+    if args.fake_redis:
+        use_fake_redis()
+
+    from flask import Flask, jsonify
+
+    from backend import cache
+
+    lots = [{
+        "id": i,
+        "prime_location_name": f"Lot {i}",
+        "address": f"{i} Example Road",
+        "pin_code": "600001",
+        "price_per_hour": 20.0,
+        "total_spots": 500,
+        "occupied_spots": i % 500,
+        "available_spots": 500 - i % 500,
+    } for i in range(args.lots)]
+
+    app = Flask(__name__)
+    with app.test_request_context("/api/user/parking-lots"):
+        cache.cache_set("bench:object", lots, ttl=300)
+        cache.json_response("bench:body", lambda: {"lots": lots}, ttl=300)
+
+        def before():
+            return jsonify({"lots": cache.cache_get("bench:object")})
+
+        def after():
+            return cache.json_response("bench:body", lambda: {"lots": lots}, ttl=300)
+
+        results = []
+        for tier in ("near", "redis"):
+            if tier == "redis":
+                # Disable the near tier so every hit goes to Redis.
+                cache._near.max_bytes = 0
+                cache._near.clear()
+            results.append((tier, "before", _per_call_us(before, args.n)))
+            results.append((tier, "after", _per_call_us(after, args.n)))
+
+    print(f"payload: {args.lots} lots, {len(cache._json_body({'lots': lots})):,} bytes")
+    print(f"{'tier':>6} {'path':>7} {'us/hit':>10}")
+    for tier, label, us in results:
+        print(f"{tier:>6} {label:>7} {us:>10.1f}")
+
+    print("\nobject codecs (encode + decode):")
+    for name in cache._CODECS:
+        try:
+            codec = cache._load_codec(name)
+        except ImportError:
+            print(f"{name:>8}  not installed")
+            continue
+        us = _per_call_us(lambda: codec.loads(codec.dumps(lots)), args.n // 5 or 1)
+        print(f"{name:>8} {us:>10.1f} us")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+Benchmark reminder fan-out throughput against worker concurrency.
+
+Seeds --users users with an email address, starts a local SMTP sink that
+takes --smtp-latency ms to accept each message (a stand-in for a remote
+relay), then runs daily_user_reminder end to end on an in-process Celery
+worker (thread pool and prefetch of the notifications profile, in-memory
+broker) for every concurrency in --workers. Every run must deliver one
+message per user.
+
+Messages per second and the speedup are taken over the send window, from
+the first message reaching the sink to the last one accepted, so they
+measure send concurrency alone. Planning, broker and chord bookkeeping
+around it are reported separately as overhead.
+
+    python -m backend.bench.email_fanout --users 2000 --workers 1,2,4,8
+"""
+import argparse
+import os
+import socketserver
+import sys
+import threading
+import time
+
+from backend.bench import use_fake_redis, use_scratch_db
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: greet, EHLO, MAIL, RCPT, DATA, QUIT."""
+
+    # Replies are small writes; don't let Nagle hold them back.
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 sink ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line[:4].upper()
+            if verb in (b"EHLO", b"HELO"):
+                self.reply("250 sink")
+            elif verb == b"DATA":
+                self.server.started()
+                self.reply("354 go ahead")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                time.sleep(self.server.latency)
+                self.server.accepted()
+                self.reply("250 queued")
+            elif verb == b"QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency):
+        super().__init__(("127.0.0.1", 0), _SinkHandler)
+        self.latency = latency
+        self.received = 0
+        self.lock = threading.Lock()
+        self.reset_window()
+
+    def reset_window(self):
+        self.first_at = self.last_at = None
+
+    def started(self):
+        with self.lock:
+            if self.first_at is None:
+                self.first_at = time.perf_counter()
+
+    def accepted(self):
+        with self.lock:
+            self.received += 1
+            self.last_at = time.perf_counter()
+
+
+def seed(db, users):
+    db.execute("""
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+        INSERT INTO users (username, password_hash, role, email)
+        SELECT 'bench' || n, 'x', 'user', 'bench' || n || '@example.com' FROM seq;
+    """, (users,))
+    db.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--workers", default="1,2,4,8",
+                        help="comma-separated worker concurrencies to run")
+    parser.add_argument("--chunk-size", type=int, default=50)
+    parser.add_argument("--smtp-latency", type=float, default=5.0,
+                        help="ms the sink spends accepting each message")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="EMAIL_GLOBAL_RATE_LIMIT (messages/s, uses fakeredis)")
+    parser.add_argument("--db", default=None, help="scratch database path")
+    args = parser.parse_args(argv)
+
+    sink = SmtpSink(args.smtp_latency / 1000.0)
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+
+    use_scratch_db(args.db)
+    use_fake_redis()
+    os.environ.update({
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(sink.server_address[1]),
+        "SMTP_USER": "",
+        "SMTP_STARTTLS": "0",
+        "EMAIL_CHUNK_SIZE": str(args.chunk_size),
+        "EMAIL_GLOBAL_RATE_LIMIT": str(args.rate_limit),
+    })
+
+    from celery.contrib.testing.worker import start_worker
+
+    from backend.celery_app import celery
+    from backend.config import Config
+    from backend.db import get_db
+    from backend.models import init_db
+    from backend.tasks.reminders import daily_user_reminder
+
+    celery.conf.update(
+        broker_url="memory://",
+        result_backend="cache+memory://",
+        broker_transport_options={"polling_interval": 0.01},
+        # cache+memory has no native chords: poll for the chord's end
+        # often, so the run's total isn't padded by a 1s retry.
+        result_chord_retry_interval=0.01,
+        task_always_eager=False,
+        # as a notifications worker runs (see Config.CELERY_WORKER_PROFILES)
+        worker_prefetch_multiplier=Config.CELERY_WORKER_PROFILES["notifications"]["prefetch"],
+    )
+
+    init_db()
+    seed(get_db(), args.users)
+
+    print(f"{args.users} messages, chunks of {args.chunk_size}, "
+          f"{args.smtp_latency:g} ms per message at the relay")
+    print(f"{'workers':>8} {'total s':>9} {'send s':>9} {'overhead':>9} "
+          f"{'msg/s':>9} {'speedup':>8}")
+
+    failures = 0
+    baseline = None
+    for concurrency in (int(n) for n in args.workers.split(",")):
+        received_before = sink.received
+        sink.reset_window()
+        with start_worker(celery, pool="threads", concurrency=concurrency,
+                          perform_ping_check=False, shutdown_timeout=30):
+            started = time.perf_counter()
+            plan = daily_user_reminder.delay().get(timeout=600, interval=0.01)
+            summary = celery.AsyncResult(plan["summary_id"]).get(timeout=600, interval=0.01)
+            elapsed = time.perf_counter() - started
+
+        delivered = sink.received - received_before
+        if summary["sent"] != args.users or delivered != args.users:
+            print(f"  !! concurrency {concurrency}: summary {summary}, "
+                  f"sink received {delivered}")
+            failures += 1
+
+        window = (sink.last_at - sink.first_at) if sink.first_at and sink.last_at else elapsed
+        rate = args.users / window
+        baseline = baseline or rate
+        print(f"{concurrency:>8} {elapsed:>9.2f} {window:>9.2f} {elapsed - window:>9.2f} "
+              f"{rate:>9.0f} {rate / baseline:>7.1f}x")
+
+    sink.shutdown()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
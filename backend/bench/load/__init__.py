@@ -0,0 +1,36 @@
+"""
+End-to-end load benchmark.
+
+    python -m backend.bench.load.run --scale small --concurrency 16 --duration 30 \
+        --out before.json
+    python -m backend.bench.load.run --scale small --concurrency 16 --duration 30 \
+        --out after.json
+    python -m backend.bench.load.compare before.json after.json
+
+run seeds a scratch database (seed.py; reused when the file already holds
+the same scale), starts the app on a local port in its own process
+(serve.py, fakeredis unless --real-redis) and drives it over HTTP with
+--concurrency virtual users. It writes per-endpoint p50/p95/p99 latency
+and throughput to --out. compare diffs two such files.
+
+Everything runs offline; nothing touches backend/parking.db.
+"""
+
+# Seed sizes. "large" is the 500 lots x 2,000 spots / 100k users target.
+SCALES = {
+    "small": {"lots": 20, "spots_per_lot": 100, "users": 2000, "reservations": 20000},
+    "medium": {"lots": 100, "spots_per_lot": 500, "users": 20000, "reservations": 200000},
+    "large": {"lots": 500, "spots_per_lot": 2000, "users": 100000, "reservations": 1000000},
+}
+
+# Password of every seeded user (and of the default admin created by init_db).
+PASSWORD = "benchpass"
+ADMIN = ("admin", "admin123")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
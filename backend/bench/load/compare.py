@@ -0,0 +1,88 @@
+"""
+Diff two load runs written by run.py:
+
+    python -m backend.bench.load.compare before.json after.json --fail-over 10
+
+Prints p50/p95/p99 and throughput per endpoint with the relative change.
+With --fail-over PCT, exits 1 if any endpoint's p95 or p99 got more than
+PCT percent slower, or its throughput dropped by more than PCT percent.
+Endpoints with fewer than --min-requests samples in either run are shown
+but not judged.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "rps")
+JUDGED = ("p95_ms", "p99_ms", "rps")
+
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return None
+    return (after - before) / before * 100
+
+
+def _cell(before, after):
+    if before is None or after is None:
+        return f"{'-':>22}"
+    pct = change(before, after)
+    pct = f"{pct:+.0f}%" if pct is not None else ""
+    return f"{before:>8.1f} {after:>8.1f} {pct:>5}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--fail-over", type=float, help="regression threshold in percent")
+    parser.add_argument("--min-requests", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    for name, run in (("before", before), ("after", after)):
+        meta = run["meta"]
+        print(f"{name}: {meta['started_at']} rev {meta['git_revision']} scale {meta['scale']} "
+              f"users {meta['concurrency']}+{meta['admins']} for {meta['duration_s']}s")
+    for key in ("scale", "concurrency", "admins", "duration_s", "seed", "revalidate"):
+        if before["meta"].get(key) != after["meta"].get(key):
+            print(f"warning: {key} differs ({before['meta'].get(key)} vs {after['meta'].get(key)})")
+    print()
+
+    print(f"{'endpoint':<42} " + " ".join(f"{m:^22}" for m in METRICS))
+    regressions = []
+    endpoints = sorted(set(before["endpoints"]) | set(after["endpoints"]))
+    for label in endpoints + ["total"]:
+        if label == "total":
+            b, a = before["total"], after["total"]
+        else:
+            b, a = before["endpoints"].get(label, {}), after["endpoints"].get(label, {})
+        print(f"{label:<42} " + " ".join(_cell(b.get(m), a.get(m)) for m in METRICS))
+
+        if (args.fail_over is None or label == "total"
+                or min(b.get("requests", 0), a.get("requests", 0)) < args.min_requests):
+            continue
+        for metric in JUDGED:
+            pct = change(b.get(metric), a.get(metric))
+            if pct is None:
+                continue
+            worse = -pct if metric == "rps" else pct
+            if worse > args.fail_over:
+                regressions.append(f"{label} {metric}: {b[metric]:.1f} -> {a[metric]:.1f}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.fail_over:g}%:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,380 @@
+"""
+Drive a seeded app with concurrent virtual users and report latency
+percentiles and throughput per endpoint.
+
+    python -m backend.bench.load.run --scale small --concurrency 16 \
+        --admins 2 --duration 30 --out run.json
+
+Each user session logs in as its own seeded user and loops over a
+weighted mix: lot listing, reserve + release, current reservation,
+history (sometimes a second page), and re-login. Admin sessions cycle
+through the lot summary, the dashboard, and the lot and user lists.
+Like a browser, sessions revalidate GETs that carried an ETag with
+If-None-Match (a 304 reuses the stored body); --no-revalidate turns
+this off.
+Requests in the first --warmup seconds are not recorded. Choices come
+from a Random seeded per session, so two runs issue the same sequence
+of requests (timing aside).
+
+By default the database is seeded once into a file under the temp dir
+(reused while the scale matches), copied for each run, and served by
+serve.py on a local port with fakeredis. --url drives an already running
+server instead; it must serve a database from seed.py and
+--seed-description must point at that seed's .json.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from backend.bench.load import ADMIN, SCALES, percentile
+from backend.bench.load.seed import description_path
+
+USER_MIX = {
+    "lots": 35,
+    "reserve_release": 20,
+    "history": 20,
+    "current": 15,
+    "login": 10,
+}
+ADMIN_MIX = {
+    "admin_summary": 30,
+    "admin_dashboard": 30,
+    "admin_lots": 20,
+    "admin_users": 20,
+}
+
+
+class Recorder:
+    """Latency samples and failure counts for one session."""
+
+    def __init__(self, record_from):
+        self.record_from = record_from
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)    # 5xx, timeouts, refused connections
+        self.rejected = defaultdict(int)  # 4xx (e.g. lot full)
+
+    def record(self, label, ms, status):
+        if time.monotonic() < self.record_from:
+            return
+        if status is None or status >= 500:
+            self.errors[label] += 1
+            return
+        if status >= 400:
+            self.rejected[label] += 1
+        self.samples[label].append(ms)
+
+
+class Session:
+    """One virtual user: its own cookies, RNG and recorder."""
+
+    def __init__(self, base_url, recorder, rng, revalidate=True):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.rng = rng
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+        self.lot_ids = []
+        self.revalidate = revalidate
+        self.stored = {}  # path -> (etag, body) of GET responses
+
+    def call(self, label, method, path, body=None):
+        data = None if body is None else json.dumps(body).encode()
+        headers = {"Content-Type": "application/json"} if data else {}
+        stored = self.stored.get(path) if method == "GET" and self.revalidate else None
+        if stored:
+            headers["If-None-Match"] = stored[0]
+        req = Request(self.base_url + path, data=data, method=method, headers=headers)
+
+        started = time.perf_counter()
+        etag = None
+        try:
+            with self.opener.open(req, timeout=30) as resp:
+                status, payload = resp.status, resp.read()
+                etag = resp.headers.get("ETag")
+        except HTTPError as e:
+            status, payload = e.code, e.read()
+        except (URLError, OSError):
+            status, payload = None, b""
+        self.recorder.record(label, (time.perf_counter() - started) * 1000, status)
+
+        if status == 304 and stored:
+            payload = stored[1]
+        elif etag and self.revalidate and method == "GET":
+            self.stored[path] = (etag, payload)
+
+        if status is not None and (status < 300 or status == 304) and payload:
+            return json.loads(payload)
+        return None
+
+    # --- user operations -------------------------------------------------
+
+    def login(self, username, password):
+        self.credentials = (username, password)
+        return self.call("POST /api/auth/login", "POST", "/api/auth/login",
+                         {"username": username, "password": password})
+
+    def op_login(self):
+        self.login(*self.credentials)
+
+    def op_lots(self):
+        data = self.call("GET /api/user/parking-lots", "GET", "/api/user/parking-lots")
+        if data:
+            self.lot_ids = [lot["id"] for lot in data["lots"]]
+
+    def op_reserve_release(self):
+        if not self.lot_ids:
+            return self.op_lots()
+        reservation = self.call("POST /api/user/reservations", "POST",
+                                "/api/user/reservations",
+                                {"lot_id": self.rng.choice(self.lot_ids)})
+        if reservation:
+            self.call("PUT /api/user/reservations/<id>/release", "PUT",
+                      f"/api/user/reservations/{reservation['id']}/release")
+
+    def op_current(self):
+        self.call("GET /api/user/reservations/current", "GET",
+                  "/api/user/reservations/current")
+
+    def op_history(self):
+        label = "GET /api/user/reservations/history"
+        page = self.call(label, "GET", "/api/user/reservations/history?limit=20")
+        if page and page["next_cursor"] and self.rng.random() < 0.3:
+            self.call(label, "GET",
+                      f"/api/user/reservations/history?limit=20&cursor={quote(page['next_cursor'])}")
+
+    # --- admin operations ------------------------------------------------
+
+    def op_admin_summary(self):
+        self.call("GET /api/admin/parking-lots/summary", "GET",
+                  "/api/admin/parking-lots/summary")
+
+    def op_admin_dashboard(self):
+        self.call("GET /api/admin/dashboard-summary", "GET", "/api/admin/dashboard-summary")
+
+    def op_admin_lots(self):
+        self.call("GET /api/admin/parking-lots", "GET", "/api/admin/parking-lots")
+
+    def op_admin_users(self):
+        self.call("GET /api/admin/users", "GET", "/api/admin/users?limit=50")
+
+
+def run_session(session, mix, deadline):
+    ops = [getattr(session, f"op_{name}") for name in mix]
+    weights = list(mix.values())
+    while time.monotonic() < deadline:
+        session.rng.choices(ops, weights)[0]()
+
+
+def summarize(samples, errors, rejected, seconds):
+    samples = sorted(samples)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "rejected": rejected,
+        "rps": round(len(samples) / seconds, 2) if seconds else None,
+        "mean_ms": round(sum(samples) / len(samples), 3) if samples else None,
+        "p50_ms": _round(percentile(samples, 50)),
+        "p95_ms": _round(percentile(samples, 95)),
+        "p99_ms": _round(percentile(samples, 99)),
+        "max_ms": _round(samples[-1] if samples else None),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+def prepare_database(args, sizes):
+    """Seed (or reuse) the pristine database and return a fresh working copy."""
+    pristine = args.db or os.path.join(
+        tempfile.gettempdir(), f"parkflow-load-{args.scale}-s{args.seed}.db"
+    )
+    wanted = dict(sizes, seed=args.seed)
+    description = None
+    if os.path.exists(description_path(pristine)):
+        with open(description_path(pristine)) as f:
+            description = json.load(f)
+        if any(description.get(k) != v for k, v in wanted.items()):
+            description = None
+    if description is None and os.path.exists(pristine):
+        if args.db:
+            raise SystemExit(f"{pristine} holds different data; pick another --db")
+        os.remove(pristine)  # our own cache file from another --users etc.
+
+    if description is None:
+        print(f"seeding {pristine} ...", file=sys.stderr)
+        cmd = [sys.executable, "-m", "backend.bench.load.seed", "--db", pristine,
+               "--seed", str(args.seed)]
+        for name, value in sizes.items():
+            cmd += [f"--{name.replace('_', '-')}", str(value)]
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+        with open(description_path(pristine)) as f:
+            description = json.load(f)
+
+    work = os.path.join(tempfile.mkdtemp(prefix="parkflow-load-"), "run.db")
+    shutil.copyfile(pristine, work)
+    return work, description
+
+
+def start_server(db_path, real_redis):
+    cmd = [sys.executable, "-m", "backend.bench.load.serve", "--db", db_path, "--port", "0"]
+    if real_redis:
+        cmd.append("--real-redis")
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if not line.startswith("listening "):
+        proc.kill()
+        raise RuntimeError("server did not start")
+    return proc, f"http://127.0.0.1:{int(line.split()[1])}"
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(result):
+    print(f"{'endpoint':<42} {'req':>7} {'rps':>8} {'p50':>8} {'p95':>8} "
+          f"{'p99':>8} {'err':>5} {'4xx':>5}")
+    rows = list(result["endpoints"].items()) + [("total", result["total"])]
+    for label, s in rows:
+        def ms(v):
+            return f"{v:>8.1f}" if v is not None else f"{'-':>8}"
+        print(f"{label:<42} {s['requests']:>7} {s['rps'] or 0:>8.1f} {ms(s['p50_ms'])} "
+              f"{ms(s['p95_ms'])} {ms(s['p99_ms'])} {s['errors']:>5} {s['rejected']:>5}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--lots", type=int)
+    parser.add_argument("--spots-per-lot", type=int)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--reservations", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="pristine seeded database (default: under the temp dir)")
+    parser.add_argument("--concurrency", type=int, default=16, help="user sessions")
+    parser.add_argument("--admins", type=int, default=2, help="admin sessions")
+    parser.add_argument("--duration", type=float, default=30, help="seconds recorded")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds not recorded")
+    parser.add_argument("--url", help="drive this server instead of starting one")
+    parser.add_argument("--seed-description", help="seed .json of the --url server's data")
+    parser.add_argument("--real-redis", action="store_true",
+                        help="serve with Config.REDIS_URL instead of fakeredis")
+    parser.add_argument("--no-revalidate", action="store_true",
+                        help="don't send If-None-Match for GETs that had an ETag")
+    parser.add_argument("--out", default="load-results.json")
+    args = parser.parse_args(argv)
+
+    sizes = dict(SCALES[args.scale])
+    for name in sizes:
+        if getattr(args, name) is not None:
+            sizes[name] = getattr(args, name)
+
+    server = None
+    if args.url:
+        if not args.seed_description:
+            parser.error("--url needs --seed-description")
+        with open(args.seed_description) as f:
+            description = json.load(f)
+        base_url = args.url.rstrip("/")
+    else:
+        db_path, description = prepare_database(args, sizes)
+        server, base_url = start_server(db_path, args.real_redis)
+
+    free_first = int(description["free_users"][0][len("bench"):])
+    free_last = int(description["free_users"][1][len("bench"):])
+    if args.concurrency > free_last - free_first + 1:
+        parser.error(f"only {free_last - free_first + 1} seeded users are free to reserve")
+
+    record_from = time.monotonic() + args.warmup
+    deadline = record_from + args.duration
+    sessions = []
+    threads = []
+    try:
+        for i in range(args.concurrency + args.admins):
+            is_admin = i >= args.concurrency
+            session = Session(base_url, Recorder(record_from),
+                              random.Random(args.seed * 1000 + i), not args.no_revalidate)
+            if is_admin:
+                session.login(*ADMIN)
+            else:
+                session.login(f"bench{free_first + i}", description["password"])
+            mix = ADMIN_MIX if is_admin else USER_MIX
+            thread = threading.Thread(target=run_session, args=(session, mix, deadline))
+            sessions.append(session)
+            threads.append(thread)
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    seconds = args.duration
+    samples, errors, rejected = defaultdict(list), defaultdict(int), defaultdict(int)
+    for session in sessions:
+        for label, values in session.recorder.samples.items():
+            samples[label].extend(values)
+        for label, count in session.recorder.errors.items():
+            errors[label] += count
+        for label, count in session.recorder.rejected.items():
+            rejected[label] += count
+
+    labels = sorted(set(samples) | set(errors))
+    result = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "scale": args.scale,
+            "data": description,
+            "concurrency": args.concurrency,
+            "admins": args.admins,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "seed": args.seed,
+            "revalidate": not args.no_revalidate,
+            "redis": "external" if args.url else ("real" if args.real_redis else "fakeredis"),
+        },
+        "endpoints": {
+            label: summarize(samples[label], errors[label], rejected[label], seconds)
+            for label in labels
+        },
+        "total": summarize(
+            [ms for values in samples.values() for ms in values],
+            sum(errors.values()), sum(rejected.values()), seconds,
+        ),
+    }
+
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=1)
+    print_table(result)
+    print(f"\nwritten to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
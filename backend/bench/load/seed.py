@@ -0,0 +1,186 @@
+"""
+Deterministic synthetic data for benchmarks: lots, spots, users and
+historical reservations, generated with set-based SQL so the "large"
+scale (1M spots, 100k users, 1M reservations) seeds in about a
+minute.
+
+The same arguments always produce the same rows (apart from password
+salts, and dates, which are relative to today). Users are bench1..benchN,
+all with the password PASSWORD; the first `active` of them hold one
+active reservation each, the rest are free to reserve.
+
+    python -m backend.bench.load.seed --scale large --db /tmp/large.db
+
+Writes <db>.json next to the database describing what was seeded; run.py
+reuses a database whose description matches.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+from backend.bench import use_fake_redis, use_scratch_db
+from backend.bench.load import PASSWORD, SCALES
+
+
+def seed_database(lots, spots_per_lot, users, reservations, active=None,
+                  days=90, seed=0, spots_per_level=None):
+    """
+    Seed an empty database. Call after importing the backend. Returns a
+    description of the data (also what run.py needs to log users in).
+
+    active defaults to half the users, capped at half the spots.
+    """
+    from werkzeug.security import generate_password_hash
+
+    from backend.db import get_db
+    from backend.models import create_parking_lot
+
+    db = get_db()
+    c = db.cursor()
+    c.execute("SELECT COUNT(*) FROM parking_lots;")
+    if c.fetchone()[0]:
+        db.close()
+        raise RuntimeError("database already has parking lots; seed an empty one")
+    db.close()
+
+    if active is None:
+        active = min(users // 2, lots * spots_per_lot // 2)
+
+    for n in range(lots):
+        create_parking_lot(
+            f"Bench Lot {n + 1:04d}", f"{n + 1} Bench Road", f"{600001 + n % 100}",
+            20 + (n * 7 + seed) % 80, spots_per_lot, spots_per_level,
+        )
+
+    db = get_db()
+    c = db.cursor()
+    c.execute("SELECT MIN(id) FROM parking_lots;")
+    first_lot = c.fetchone()[0]
+    c.execute("SELECT MIN(id) FROM parking_spots;")
+    first_spot = c.fetchone()[0]
+
+    c.execute("""
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+        INSERT INTO users (username, password_hash, role, email)
+        SELECT 'bench' || n, ?, 'user', 'bench' || n || '@example.com' FROM seq;
+    """, (users, generate_password_hash(PASSWORD)))
+    c.execute("SELECT id FROM users WHERE username = 'bench1';")
+    first_user = c.fetchone()[0]
+
+    # History: reservation n belongs to a pseudo-random user and lot, starts
+    # on one of the last `days` days and lasts 1-6 hours. Lot k's spots
+    # are first_spot + k * spots_per_lot + 0..spots_per_lot-1.
+    start = (date.today() - timedelta(days=days)).isoformat()
+    c.execute("""
+        WITH RECURSIVE seq(n) AS (
+            SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < :reservations - 1
+        ),
+        picks AS (
+            SELECT n,
+                   (n * 7919 + :seed) % :users AS u,
+                   (n * 31 + :seed) % :lots AS k,
+                   (n * 17 + :seed) % :spots AS s,
+                   1 + n % 6 AS hours,
+                   strftime('%Y-%m-%dT%H:%M:%S', :start,
+                            '+' || ((n * 13 + :seed) % :days) || ' days',
+                            '+' || ((n * 7907 + :seed) % 86400) || ' seconds') AS parking_in
+            FROM seq
+        )
+        INSERT INTO reservations (user_id, lot_id, spot_id, parking_in, parking_out,
+                                  parking_cost, status)
+        SELECT :first_user + u, :first_lot + k, :first_spot + k * :spots + s,
+               parking_in,
+               strftime('%Y-%m-%dT%H:%M:%S', parking_in, '+' || hours || ' hours'),
+               hours * (20 + (k * 7 + :seed) % 80), 'completed'
+        FROM picks;
+    """, {
+        "reservations": reservations, "seed": seed, "users": users, "lots": lots,
+        "spots": spots_per_lot, "days": days, "start": start, "first_user": first_user,
+        "first_lot": first_lot, "first_spot": first_spot,
+    })
+
+    # Active: users 1..active each park in the next free spot, lot by lot
+    # round-robin, started within the last five hours.
+    c.execute("""
+        WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < ? - 1)
+        INSERT INTO reservations (user_id, lot_id, spot_id, parking_in, status)
+        SELECT ? + n, ? + n % ?, ? + (n % ?) * ? + n / ?,
+               strftime('%Y-%m-%dT%H:%M:%S', 'now', '-' || (n % 300) || ' minutes'),
+               'active'
+        FROM seq;
+    """, (active, first_user, first_lot, lots, first_spot, lots, spots_per_lot, lots))
+    c.execute("""
+        UPDATE parking_spots SET status = 'O'
+        WHERE id IN (SELECT spot_id FROM reservations WHERE status = 'active');
+    """)
+    db.commit()
+    c.execute("ANALYZE;")
+    db.close()
+
+    return {
+        "lots": lots,
+        "spots_per_lot": spots_per_lot,
+        "users": users,
+        "reservations": reservations,
+        "active": active,
+        "days": days,
+        "seed": seed,
+        "password": PASSWORD,
+        "free_users": [f"bench{active + 1}", f"bench{users}"],
+    }
+
+
+def description_path(db_path):
+    return db_path + ".json"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--db", required=True, help="database file to create")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--lots", type=int)
+    parser.add_argument("--spots-per-lot", type=int)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--reservations", type=int)
+    parser.add_argument("--active", type=int)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        parser.error(f"{args.db} exists; seed into a new file")
+
+    sizes = dict(SCALES[args.scale])
+    for name in sizes:
+        if getattr(args, name) is not None:
+            sizes[name] = getattr(args, name)
+
+    use_scratch_db(args.db)
+    use_fake_redis()
+    import backend.app  # noqa: F401  (runs init_db: schema + admin)
+    from backend.db import close_thread_db
+
+    started = time.perf_counter()
+    description = seed_database(**sizes, active=args.active, days=args.days, seed=args.seed)
+    description["seconds"] = round(time.perf_counter() - started, 1)
+
+    # Fold the WAL into the main file so run.py can copy just args.db.
+    close_thread_db()
+    conn = sqlite3.connect(args.db)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    conn.close()
+
+    with open(description_path(args.db), "w") as f:
+        json.dump(description, f, indent=1)
+    print(json.dumps(description))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
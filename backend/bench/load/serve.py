@@ -0,0 +1,46 @@
+"""
+Serve the app on a local port for the load driver:
+
+    python -m backend.bench.load.serve --db /tmp/bench.db --port 0
+
+Prints "listening <port>" once ready. Uses fakeredis unless --real-redis
+(then Config.REDIS_URL must be reachable). Runs in its own process so
+the driver's client threads don't share a GIL with the server.
+"""
+import argparse
+import sys
+
+from backend.bench import use_fake_redis, use_scratch_db
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--real-redis", action="store_true")
+    args = parser.parse_args(argv)
+
+    use_scratch_db(args.db)
+    if not args.real_redis:
+        use_fake_redis()
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    from backend.app import app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", args.port, app, threaded=True,
+                         request_handler=QuietHandler)
+    print(f"listening {server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
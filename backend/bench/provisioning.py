@@ -0,0 +1,67 @@
+"""
+Benchmark lot provisioning: the old per-row INSERT loop against the
+chunked recursive-CTE path in models.provision_spots.
+
+Reports lots/sec and spots/sec for lots of 1k, 10k and 100k spots
+(override with --sizes). Lots are laid out 500 spots per level.
+"""
+import argparse
+import sys
+import time
+
+from backend.bench import use_scratch_db
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--spots-per-level", type=int, default=500)
+    parser.add_argument("--db", default=None, help="scratch database path")
+    args = parser.parse_args(argv)
+
+    use_scratch_db(args.db)
+
+    from backend.db import get_db
+    from backend.models import init_db, provision_spots
+
+    init_db()
+    db = get_db()
+    c = db.cursor()
+
+    def new_lot(size):
+        c.execute("""
+            INSERT INTO parking_lots (prime_location_name, price_per_hour, number_of_spots)
+            VALUES ('bench', 10, ?)
+        """, (size,))
+        db.commit()
+        return c.lastrowid
+
+    def row_loop(size):
+        lot_id = new_lot(size)
+        for i in range(1, size + 1):
+            c.execute("""
+                INSERT INTO parking_spots (lot_id, spot_number, status)
+                VALUES (?, ?, 'A')
+            """, (lot_id, i))
+        db.commit()
+
+    def bulk(size):
+        lot_id = new_lot(size)
+        provision_spots(lot_id, 1, size, args.spots_per_level)
+
+    print(f"{'spots/lot':>10} {'method':>9} {'lots/sec':>10} {'spots/sec':>12}")
+    for size in args.sizes:
+        for label, fn in (("row-loop", row_loop), ("bulk", bulk)):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                fn(size)
+            elapsed = time.perf_counter() - start
+            print(f"{size:>10} {label:>9} {args.repeat / elapsed:>10.2f} "
+                  f"{args.repeat * size / elapsed:>12,.0f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,536 @@
+"""
+Query-plan regression suite for the SQL issued by routes/admin.py,
+routes/user.py, routes/auth.py, models.py and tasks/*.py.
+
+For every --sizes value (number of seeded reservations) a fresh
+interpreter seeds a scratch database, then drives every route through
+the Flask test client and calls the model/task functions directly (Celery
+runs eagerly, mail goes to a local SMTP sink). A trace callback records
+each statement and attributes it to the c.execute() call site that
+issued it. Every distinct statement is then
+  - explained with EXPLAIN QUERY PLAN; a full scan of a table that grows
+    with the data, or a temp B-tree, fails the run unless the call site
+    is listed in ALLOWED_PLANS;
+  - timed (median of --repeat runs, rolled back if it writes).
+
+Across sizes, a statement whose time grows more than --max-growth times
+from the smallest to the largest size fails unless listed in
+ALLOWED_GROWTH. --save writes the timings as a baseline; --baseline
+compares against one and fails on statements more than --max-slowdown
+times slower. Call sites found in the sources that the scenario never
+reached are listed (an error with --strict).
+
+    python -m backend.bench.query_plans --sizes 1000 10000 100000
+"""
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from backend.bench import use_fake_redis, use_scratch_db
+from backend.bench.load import PASSWORD
+from backend.bench.load.seed import seed_database
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SOURCES = [
+    "routes/admin.py",
+    "routes/user.py",
+    "routes/auth.py",
+    "models.py",
+    *sorted(
+        os.path.relpath(path, BACKEND_DIR)
+        for path in glob.glob(os.path.join(BACKEND_DIR, "tasks", "*.py"))
+    ),
+]
+
+# Tables with one row per lot/counter: scanning them is fine.
+SMALL_TABLES = {"parking_lots", "row_counts"}
+
+# Call sites whose plan is expected to contain a scan or temp B-tree.
+ALLOWED_PLANS = {
+    "models.py:init_db": "startup only; the seeded admin is the first row",
+    "routes/admin.py:list_parking_lots": "every lot, sorted by name",
+    "models.py:_select_lot_summary": "every lot (or a few by id), sorted by name",
+    "routes/user.py:export_csv":
+        "sorts the user's few pending/running exports (status IN two values)",
+    "tasks/reports.py:build_monthly_reports":
+        "groups one month (idx_reservations_month range) per user and lot",
+}
+
+# Call sites that legitimately take longer as the data grows.
+ALLOWED_GROWTH = {
+    "tasks/reports.py:build_monthly_reports": "aggregates a whole month",
+    "models.py:check_occupancy_counters": "recounts every lot",
+    "models.py:rebuild_occupancy_counters": "recounts every lot",
+    "models.py:get_lot_grid": "reads every occupied spot of the lot (grid rebuilds only)",
+    "tasks/reminders.py:iter_reminder_candidates":
+        "returns a full REMINDER_BATCH_SIZE batch only once there are that many users",
+}
+
+SKIPPED_VERBS = (
+    "BEGIN", "COMMIT", "END", "ROLLBACK", "SAVEPOINT", "RELEASE", "PRAGMA",
+    "CREATE", "DROP", "ALTER", "ANALYZE", "--",
+)
+
+LOTS = 20
+
+
+# ---------------------------------------------------------------------------
+# Call-site inventory (static)
+# ---------------------------------------------------------------------------
+
+def inventory():
+    """
+    {relpath: [(start, end, qualname, ordinal)]} for every .execute() /
+    .executemany() call in SOURCES. ordinal numbers the calls inside one
+    function, so site ids survive edits elsewhere in the file.
+    """
+    sites = {}
+    for rel in SOURCES:
+        with open(os.path.join(BACKEND_DIR, rel)) as f:
+            tree = ast.parse(f.read())
+        found = []
+
+        def visit(node, scope):
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    visit(child, scope + [child.name])
+                    continue
+                if (isinstance(child, ast.Call)
+                        and isinstance(child.func, ast.Attribute)
+                        and child.func.attr in ("execute", "executemany")
+                        and child.args  # not a Redis pipe.execute()
+                        and not _is_skipped_literal(child.args[0])
+                        and scope):
+                    found.append((child.lineno, child.end_lineno, ".".join(scope)))
+                visit(child, scope)
+
+        visit(tree, [])
+        found.sort()
+        counts = {}
+        entries = []
+        for start, end, qualname in found:
+            counts[qualname] = counts.get(qualname, 0) + 1
+            entries.append((start, end, qualname, counts[qualname]))
+        sites[rel] = entries
+    return sites
+
+
+def _is_skipped_literal(node):
+    return (isinstance(node, ast.Constant) and isinstance(node.value, str)
+            and node.value.lstrip().upper().startswith(SKIPPED_VERBS))
+
+
+def site_id(rel, qualname, ordinal):
+    return f"{rel}:{qualname}#{ordinal}"
+
+
+def function_of(site):
+    return site.split("#", 1)[0]
+
+
+# ---------------------------------------------------------------------------
+# Child: seed, run the scenario, explain and time
+# ---------------------------------------------------------------------------
+
+class Collector:
+    """sqlite3 trace callback that records statements per call site."""
+
+    def __init__(self, sites):
+        self.sites = {
+            os.path.join(BACKEND_DIR, rel): entries for rel, entries in sites.items()
+        }
+        self.enabled = False
+        self.statements = {}  # (site, normalized) -> expanded sql
+        self.lock = threading.Lock()
+
+    def __call__(self, statement):
+        if not self.enabled or statement.lstrip().upper().startswith(SKIPPED_VERBS):
+            return
+        site = self._call_site()
+        if site is None:
+            return
+        key = (site, normalize(statement))
+        with self.lock:
+            self.statements.setdefault(key, statement)
+
+    def _call_site(self):
+        frame = sys._getframe(2)
+        while frame is not None:
+            entries = self.sites.get(frame.f_code.co_filename)
+            if entries:
+                line = frame.f_lineno
+                for start, end, qualname, ordinal in entries:
+                    if start <= line <= end:
+                        rel = os.path.relpath(frame.f_code.co_filename, BACKEND_DIR)
+                        return site_id(rel, qualname, ordinal)
+            frame = frame.f_back
+        return None
+
+
+def normalize(sql):
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    return " ".join(sql.split())
+
+
+def seed(size):
+    users = max(50, size // 10)
+    spots = max(50, size // 200)
+    return seed_database(
+        lots=LOTS, spots_per_lot=spots, users=users, reservations=size,
+        active=min(users // 4, LOTS * spots // 2), days=60, spots_per_level=100,
+    )
+
+
+def scenario(app, seeded):
+    """Touch every route and every model/task function that issues SQL."""
+    from backend.models import (
+        check_occupancy_counters, get_dashboard_summary, get_lot_summary,
+        get_lot_version, get_lots_version, rebuild_occupancy_counters,
+    )
+    from backend.tasks.reminders import iter_reminder_candidates
+    from backend.tasks.reports import (
+        build_monthly_reports, iter_report_recipients, mark_reports_emailed, parse_month,
+    )
+
+    def ok(response, *codes):
+        codes = codes or (200,)
+        if response.status_code not in codes:
+            raise RuntimeError(
+                f"{response.request.method} {response.request.path}: "
+                f"{response.status_code} {response.get_data(as_text=True)[:200]}"
+            )
+        return response.get_json(silent=True)
+
+    anon = app.test_client()
+    ok(anon.post("/api/auth/register", json={"username": "qp_new", "password": PASSWORD}), 201)
+    ok(anon.post("/api/auth/login", json={"username": "qp_new", "password": PASSWORD}))
+    ok(anon.get("/api/auth/me"))
+    ok(anon.post("/api/auth/logout"))
+
+    user = app.test_client()
+    ok(user.post("/api/auth/login",
+                 json={"username": f"bench{seeded['users']}", "password": PASSWORD}))
+    ok(user.get("/api/user/parking-lots"))
+
+    def reserve_and_release():
+        reservation = ok(user.post("/api/user/reservations", json={"lot_id": 1}), 201)
+        ok(user.get("/api/user/reservations/current"))
+        ok(user.put(f"/api/user/reservations/{reservation['id']}/release"))
+
+    reserve_and_release()
+    page = ok(user.get("/api/user/reservations/history?limit=3&include_total=1"))
+    if page["next_cursor"]:
+        ok(user.get("/api/user/reservations/history",
+                    query_string={"limit": 3, "cursor": page["next_cursor"]}))
+    ok(user.get("/api/user/reports"))
+
+    export = ok(user.post("/api/user/export-csv", json={}), 202)
+    ok(user.get(f"/api/user/exports/{export['export_id']}"))
+    ok(user.get(f"/api/user/exports/{export['export_id']}/download"))
+    ok(user.post("/api/user/export-csv", json={}), 200)      # unchanged: reuse
+    reserve_and_release()
+    ok(user.post("/api/user/export-csv", json={}), 202)      # incremental
+    ok(user.post("/api/user/export-csv", json={"gzip": True}), 202)
+    ok(user.get("/api/user/export-csv/stream"))
+
+    admin = app.test_client()
+    ok(admin.post("/api/auth/login", json={"username": "admin", "password": "admin123"}))
+    ok(admin.get("/api/admin/parking-lots/summary"))
+    ok(admin.get("/api/admin/parking-lots"))
+    lot = ok(admin.post("/api/admin/parking-lots", json={
+        "prime_location_name": "QP Lot", "price_per_hour": 30, "number_of_spots": 300,
+    }), 201)
+    lot_update = {"prime_location_name": "QP Lot", "price_per_hour": 30, "is_active": 1}
+    ok(admin.put(f"/api/admin/parking-lots/{lot['id']}",
+                 json={**lot_update, "number_of_spots": 400}))
+    ok(admin.put(f"/api/admin/parking-lots/{lot['id']}",
+                 json={**lot_update, "number_of_spots": 350}))
+    spots = ok(admin.get("/api/admin/parking-lots/1/spots?limit=50&include_total=1"))
+    ok(admin.get("/api/admin/parking-lots/1/spots",
+                 query_string={"limit": 50, "cursor": spots["next_cursor"]}))
+    grid = ok(admin.get("/api/admin/parking-lots/1/spots?format=grid"))
+    ok(admin.get(f"/api/admin/parking-lots/1/spots/{grid['occupied'][0][0]}"))
+    users = ok(admin.get("/api/admin/users?limit=20&include_total=1"))
+    ok(admin.get("/api/admin/users", query_string={"limit": 20, "cursor": users["next_cursor"]}))
+    ok(admin.put("/api/admin/users/2", json={"phone": "9000000000"}))
+    ok(admin.get("/api/admin/dashboard-summary"))
+    ok(admin.get("/api/admin/cache-stats"))
+    ok(admin.get("/api/admin/queue-stats"))
+    last_month = (date.today().replace(day=1) - timedelta(days=1)).strftime("%Y-%m")
+    ok(admin.post("/api/admin/debug/monthly-report", json={"month": last_month}), 202)
+    ok(admin.post("/api/admin/debug/daily-reminder"), 202)
+    ok(admin.delete(f"/api/admin/parking-lots/{lot['id']}"))
+
+    # Model/task helpers called directly (outside a request).
+    check_occupancy_counters()
+    rebuild_occupancy_counters()
+    get_lot_summary(include_inactive=True)
+    get_lots_version()
+    get_lot_version(1)  # the ETag fallbacks when Redis has no version yet
+    get_dashboard_summary()
+    first_day = parse_month(last_month)
+    build_monthly_reports(first_day)
+    for batch in iter_report_recipients(first_day, 100):
+        mark_reports_emailed(first_day, [row[0] for row in batch])
+        break
+    next(iter_reminder_candidates(date.today(), 100), None)
+
+
+_TABLE_REF = re.compile(
+    r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(?!(?:ON|WHERE|JOIN|LEFT|INNER"
+    r"|CROSS|GROUP|ORDER|LIMIT|USING|SET|VALUES|SELECT|WINDOW)\b)(\w+))?",
+    re.IGNORECASE,
+)
+
+
+def plan_violations(conn, sql, tables):
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+    plan = [r[3] for r in rows]
+
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    limited = re.search(r"\bLIMIT\b", sql, re.IGNORECASE) is not None
+    temp_btree = any(d.startswith("USE TEMP B-TREE") for d in plan)
+
+    violations = []
+    for detail in plan:
+        if detail.startswith("USE TEMP B-TREE"):
+            violations.append(detail)
+            continue
+        m = re.match(r"SCAN (\w+)(?: USING (?:COVERING )?INDEX \w+)?", detail)
+        if not m:
+            continue
+        table = aliases.get(m.group(1), m.group(1))
+        if table not in tables or table in SMALL_TABLES:
+            continue
+        if "USING" in detail and limited and not temp_btree:
+            continue  # ordered index walk stopped by LIMIT (first page)
+        violations.append(detail)
+    return plan, violations
+
+
+def time_statement(conn, sql, repeat):
+    """Median milliseconds, or None if replaying it breaks a constraint."""
+    samples = []
+    for _ in range(repeat):
+        conn.execute("SAVEPOINT qp;")
+        try:
+            started = time.perf_counter()
+            conn.execute(sql).fetchall()
+            samples.append((time.perf_counter() - started) * 1000)
+        except sqlite3.IntegrityError:
+            return None  # e.g. the INSERT of a username that now exists
+        finally:
+            conn.execute("ROLLBACK TO qp;")
+            conn.execute("RELEASE qp;")
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def run_child(size, repeat):
+    from backend.bench.email_fanout import SmtpSink
+
+    sink = SmtpSink(0)
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+
+    db_path = use_scratch_db()
+    use_fake_redis()
+    os.environ.update({
+        "DB_COUNT_QUERIES": "1",
+        "EXPORT_DIR": tempfile.mkdtemp(prefix="parkflow-qp-exports-"),
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(sink.server_address[1]),
+        "SMTP_USER": "",
+        "SMTP_STARTTLS": "0",
+    })
+
+    import backend.db as db_module
+
+    collector = Collector(inventory())
+    # get_db() installs db._count_query on every pooled connection when
+    # DB_COUNT_QUERIES is on; thread-local connections get it from _connect.
+    db_module._count_query = collector
+    connect = db_module._connect
+
+    def traced_connect():
+        conn = connect()
+        conn.set_trace_callback(collector)
+        return conn
+
+    db_module._connect = traced_connect
+
+    from backend.celery_app import celery
+    celery.conf.update(
+        task_always_eager=True,
+        task_eager_propagates=True,
+        broker_url="memory://",
+        result_backend="cache+memory://",
+    )
+
+    collector.enabled = True  # init_db() runs on import
+    from backend.app import app
+    collector.enabled = False
+
+    seeded = seed(size)
+    collector.enabled = True
+    scenario(app, seeded)
+    collector.enabled = False
+    sink.shutdown()
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table';")}
+
+    by_site = {}
+    for (site, normalized), sql in sorted(collector.statements.items()):
+        by_site.setdefault(site, []).append((normalized, sql))
+
+    entries = {}
+    for site, variants in by_site.items():
+        for normalized, sql in variants:
+            key = site
+            if len(variants) > 1:
+                key += "[" + hashlib.sha1(normalized.encode()).hexdigest()[:6] + "]"
+            plan, violations = plan_violations(conn, sql, tables)
+            entries[key] = {
+                "sql": normalized,
+                "plan": plan,
+                "violations": violations,
+                "ms": time_statement(conn, sql, repeat),
+            }
+    conn.close()
+    return {"size": size, "seeded": seeded, "entries": entries}
+
+
+# ---------------------------------------------------------------------------
+# Parent: one child per size, then checks
+# ---------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="reservations to seed, one run per size")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-growth", type=float, default=5.0)
+    parser.add_argument("--max-slowdown", type=float, default=2.0)
+    parser.add_argument("--floor-ms", type=float, default=0.05,
+                        help="timings below this are treated as equal")
+    parser.add_argument("--baseline", help="JSON from an earlier --save to compare with")
+    parser.add_argument("--save", help="write this run's results as JSON")
+    parser.add_argument("--strict", action="store_true",
+                        help="fail on call sites the scenario never reached")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        print(json.dumps(run_child(args.child, args.repeat)))
+        return 0
+
+    runs = []
+    for size in sorted(args.sizes):
+        started = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-m", "backend.bench.query_plans",
+             "--child", str(size), "--repeat", str(args.repeat)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+        print(f"size {size}: {len(runs[-1]['entries'])} statements "
+              f"({time.perf_counter() - started:.1f}s)", file=sys.stderr)
+
+    failures = []
+    keys = sorted({key for run in runs for key in run["entries"]})
+
+    # Plans
+    for run in runs:
+        for key, entry in sorted(run["entries"].items()):
+            if entry["violations"] and function_of(key.split("[")[0]) not in ALLOWED_PLANS:
+                failures.append(
+                    f"plan  {key} @ {run['size']}: " + "; ".join(entry["violations"])
+                )
+
+    # Timing table and growth
+    sizes = [run["size"] for run in runs]
+    width = max(len(k) for k in keys)
+    print(f"{'statement':<{width}} " + " ".join(f"{s:>10}" for s in sizes) + "   (ms)")
+    for key in keys:
+        times = [run["entries"].get(key, {}).get("ms") for run in runs]
+        print(f"{key:<{width}} " + " ".join(
+            f"{t:>10.3f}" if t is not None else f"{'-':>10}" for t in times
+        ))
+        if args.verbose:
+            entry = next(run["entries"][key] for run in reversed(runs) if key in run["entries"])
+            for detail in entry["plan"]:
+                print(f"{'':<{width}}   {detail}")
+
+        first, last = times[0], times[-1]
+        if (len(runs) > 1 and first is not None and last is not None
+                and function_of(key.split("[")[0]) not in ALLOWED_GROWTH
+                and last > args.max_growth * max(first, args.floor_ms)):
+            failures.append(
+                f"growth {key}: {first:.3f} ms @ {sizes[0]} -> {last:.3f} ms @ {sizes[-1]}"
+            )
+
+    # Baseline
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {run["size"]: run["entries"] for run in json.load(f)["runs"]}
+        for run in runs:
+            old_entries = baseline.get(run["size"], {})
+            for key, entry in run["entries"].items():
+                old = old_entries.get(key)
+                if (old and old["ms"] is not None and entry["ms"] is not None
+                        and entry["ms"] > args.max_slowdown * max(old["ms"], args.floor_ms)):
+                    failures.append(
+                        f"slower {key} @ {run['size']}: {old['ms']:.3f} -> {entry['ms']:.3f} ms"
+                    )
+
+    # Coverage
+    reached = {key.split("[")[0] for key in keys}
+    missing = [
+        site_id(rel, qualname, ordinal)
+        for rel, entries in inventory().items()
+        for _, _, qualname, ordinal in entries
+        if site_id(rel, qualname, ordinal) not in reached
+    ]
+    if missing:
+        print("\ncall sites not reached by the scenario:")
+        for site in missing:
+            print(f"  {site}")
+        if args.strict:
+            failures.extend(f"unreached {site}" for site in missing)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"runs": runs}, f, indent=1)
+
+    if failures:
+        print(f"\n{len(failures)} problem(s):")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+
+    print("\nall plans and timings within limits")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Benchmark daily-reminder candidate selection.
+
+Seeds --users users and --reservations reservations spread over the last
+--days days, then times:
+  legacy  one SELECT ... DATE(parking_in) = ? per user against the
+          original schema (no reservations index, so NOT INDEXED), timed
+          on a sample of --legacy-sample users and extrapolated
+  set     iter_reminder_candidates(): batched anti-join on a sargable
+          parking_in range
+Both must agree on the candidate set for the sampled users.
+"""
+import argparse
+import sys
+import time
+from datetime import date, timedelta
+
+from backend.bench import use_scratch_db
+
+
+def seed(db, users, reservations, days):
+    c = db.cursor()
+    # Counters/version triggers are irrelevant here and would dominate
+    # seeding time at millions of rows.
+    for name in ("trg_reservation_insert", "trg_reservation_version_insert"):
+        c.execute(f"DROP TRIGGER IF EXISTS {name};")
+
+    c.execute("""
+        INSERT INTO parking_lots (prime_location_name, price_per_hour, number_of_spots)
+        VALUES ('bench', 10, 1000);
+    """)
+    c.execute("""
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+        INSERT INTO users (username, password_hash, role, email)
+        SELECT 'bench' || n, 'x', 'user', 'bench' || n || '@example.com' FROM seq;
+    """, (users,))
+    c.execute("SELECT MIN(id) FROM users WHERE role = 'user';")
+    first_user = c.fetchone()[0]
+
+    start = date.today() - timedelta(days=days - 1)
+    c.execute("""
+        WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < ? - 1)
+        INSERT INTO reservations (user_id, lot_id, spot_id, parking_in, parking_out, status)
+        SELECT ? + (n * 7919) % ?, 1, 1,
+               strftime('%Y-%m-%dT%H:%M:%S', ?, '+' || (n % ?) || ' days',
+                        '+' || (n % 86400) || ' seconds'),
+               NULL, 'completed'
+        FROM seq;
+    """, (reservations, first_user, users, start.isoformat(), days))
+    db.commit()
+    c.execute("ANALYZE;")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--reservations", type=int, default=5_000_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--legacy-sample", type=int, default=20)
+    parser.add_argument("--db", default=None, help="scratch database path")
+    args = parser.parse_args(argv)
+
+    use_scratch_db(args.db)
+
+    from backend.db import get_db
+    from backend.models import init_db
+    from backend.tasks.reminders import iter_reminder_candidates
+
+    init_db()
+    db = get_db()
+
+    t0 = time.perf_counter()
+    seed(db, args.users, args.reservations, args.days)
+    print(f"seeded {args.users:,} users / {args.reservations:,} reservations "
+          f"in {time.perf_counter() - t0:.1f}s")
+
+    today = date.today()
+    c = db.cursor()
+
+    # Legacy: per-user query with DATE() on the column, no index.
+    c.execute("SELECT id FROM users WHERE role = 'user' ORDER BY id LIMIT ?;",
+              (args.legacy_sample,))
+    sample = [r[0] for r in c.fetchall()]
+    legacy_candidates = set()
+    t0 = time.perf_counter()
+    for user_id in sample:
+        c.execute("""
+            SELECT id FROM reservations NOT INDEXED
+            WHERE user_id = ? AND DATE(parking_in) = ?
+        """, (user_id, today.isoformat()))
+        if not c.fetchone():
+            legacy_candidates.add(user_id)
+    legacy = time.perf_counter() - t0
+    legacy_full = legacy / max(len(sample), 1) * args.users
+
+    t0 = time.perf_counter()
+    candidates = set()
+    batches = 0
+    for batch in iter_reminder_candidates(today):
+        batches += 1
+        candidates.update(user_id for user_id, _, _ in batch)
+    set_based = time.perf_counter() - t0
+
+    agree = legacy_candidates == {u for u in candidates if u in set(sample)}
+    print(f"legacy N+1: {legacy:.3f}s for {len(sample)} users "
+          f"-> ~{legacy_full:.1f}s extrapolated to {args.users:,}")
+    print(f"set-based:  {set_based:.3f}s for all {args.users:,} users "
+          f"({batches} batches, {len(candidates):,} candidates)")
+    print("candidate sets agree on sample" if agree else "MISMATCH on sample")
+    return 0 if agree else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+Check that a failed Celery task does not leave SQLite locked.
+
+Runs a task (eagerly, on this thread's task connection) that updates a
+row and then raises, and afterwards registers a user through the web app.
+With the task_postrun reset in celery_app.py the registration succeeds;
+with --no-reset it fails with "database is locked", which is what every
+web write saw while a worker thread held the write lock.
+"""
+import argparse
+import os
+import sys
+
+from backend.bench import use_fake_redis, use_scratch_db
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--no-reset", action="store_true",
+                        help="disconnect the task_postrun reset to show the failure")
+    args = parser.parse_args(argv)
+
+    use_scratch_db()
+    use_fake_redis()
+    # Fail fast instead of waiting out the full busy timeout.
+    os.environ.setdefault("SQLITE_BUSY_TIMEOUT_MS", "500")
+
+    from celery.signals import task_postrun
+
+    from backend.app import app
+    from backend.celery_app import _reset_task_db, celery
+    from backend.db import get_db
+
+    if args.no_reset:
+        task_postrun.disconnect(_reset_task_db)
+
+    @celery.task(name="bench_failing_write")
+    def failing_write():
+        db = get_db()
+        db.execute("UPDATE users SET phone = 'x' WHERE role = 'admin';")
+        raise RuntimeError("task failed mid-write")
+
+    result = failing_write.apply()
+    print(f"task: {result.state}")
+
+    client = app.test_client()
+    try:
+        response = client.post("/api/auth/register",
+                               json={"username": "after_fail", "password": "benchpass"})
+        status = response.status_code
+    except Exception as e:  # test client propagates unhandled errors
+        status = f"error ({e})"
+    print(f"register after failed task: {status}")
+    return 0 if status == 201 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,524 @@
 # backend/cache.py
+import hashlib
+import importlib
 import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import NamedTuple
+
 import redis
+from flask import Response, g, request
+
 from backend.config import Config
 
 _redis = redis.Redis.from_url(Config.REDIS_URL)
 
+# Namespace for everything derived from parking lots / occupancy
+# (user lot list, admin lots summary, admin dashboard summary).
+LOTS_CACHE = "lots"
+# Namespace for resolved session users (routes/auth.py).
+USERS_CACHE = "users"
+
+class JsonCodec:
+    name = "json"
+
+    @staticmethod
+    def dumps(value):
+        return json.dumps(value).encode()
+
+    loads = staticmethod(json.loads)
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    def __init__(self):
+        self._orjson = importlib.import_module("orjson")
+        self.dumps = self._orjson.dumps
+        self.loads = self._orjson.loads
+
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    def __init__(self):
+        msgpack = importlib.import_module("msgpack")
+        self.dumps = lambda value: msgpack.packb(value, use_bin_type=True)
+        self.loads = lambda raw: msgpack.unpackb(raw, raw=False)
+
+
+_CODECS = {"json": JsonCodec, "orjson": OrjsonCodec, "msgpack": MsgpackCodec}
+
+
+def _load_codec(name):
+    """Codec for cache_get/cache_set values (Config.CACHE_CODEC)."""
+    try:
+        return _CODECS[name]()
+    except KeyError:
+        raise ValueError(f"unknown CACHE_CODEC {name!r}; expected one of {sorted(_CODECS)}")
+
+
+_codec = _load_codec(Config.CACHE_CODEC)
+
+try:
+    import orjson as _orjson
+
+    def _json_body(payload):
+        return _orjson.dumps(payload)
+except ImportError:
+    def _json_body(payload):
+        return json.dumps(payload, separators=(",", ":")).encode()
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    "near_hits": 0,
+    "near_misses": 0,
+    "near_evictions": 0,
+    "redis_hits": 0,
+    "redis_misses": 0,
+    "invalidations_received": 0,
+    "fills_discarded": 0,
+}
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+class NearCache:
+    """
+    Bounded per-process LRU with TTL, in front of Redis.
+
+    Evicts least-recently-used entries once either max_items or max_bytes
+    (measured on the encoded Redis payload) is exceeded. Values are the
+    decoded objects, shared between callers, so treat them as read-only.
+    """
+
+    def __init__(self, max_items, max_bytes):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, value, size, ttl):
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        evicted = 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while len(self._data) > self.max_items or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                evicted += 1
+        if evicted:
+            _count("near_evictions", evicted)
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def total_bytes(self):
+        return self._bytes
+
+
+_near = NearCache(Config.NEAR_CACHE_MAX_ITEMS, Config.NEAR_CACHE_MAX_BYTES)
+
+# Namespace generations: every key stored under a namespace embeds the
+# namespace's current generation, so invalidating the whole namespace is a
+# single INCR. Keys from older generations are never read again and simply
+# expire by TTL. Each process keeps the generations it has seen for up to
+# NEAR_CACHE_TTL seconds and is told about bumps over pub/sub.
+_generations = {}  # namespace -> (generation, expires_at)
+_generations_lock = threading.Lock()
+
+_listener_lock = threading.Lock()
+_listener_pid = None
+_listener_thread = None
+
+
+def _generation_key(namespace):
+    return f"cache:gen:{namespace}"
+
+
+def _set_local_generation(namespace, generation):
+    with _generations_lock:
+        _generations[namespace] = (generation, time.monotonic() + Config.NEAR_CACHE_TTL)
+
+
+def _generation(namespace):
+    now = time.monotonic()
+    with _generations_lock:
+        known = _generations.get(namespace)
+    if known is not None and known[1] > now:
+        return known[0]
+
+    generation = int(_redis.get(_generation_key(namespace)) or 0)
+    _set_local_generation(namespace, generation)
+    return generation
+
+
+def _physical_key(key, namespace):
+    if namespace is None:
+        return key
+    return f"{key}@{namespace}:{_generation(namespace)}"
+
+
+def _on_invalidate(message):
+    try:
+        event = json.loads(message["data"])
+        if "key" in event:
+            _near.discard(event["key"])
+        else:
+            _set_local_generation(event["namespace"], int(event["generation"]))
+    except (ValueError, KeyError, TypeError):
+        return
+    _count("invalidations_received")
+
 
-def cache_get(key: str):
-    """Return cached JSON data for key, or None."""
-    raw = _redis.get(key)
+def _ensure_listener():
+    """
+    Subscribe this process to the invalidation channel.
+
+    Started lazily, and again after a fork (gunicorn/celery prefork), because
+    the listener thread does not survive into child processes.
+    """
+    global _listener_pid, _listener_thread
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _listener_lock:
+        if _listener_pid == pid:
+            return
+        # Generations inherited from the parent may already have missed
+        # bumps published before we subscribed.
+        with _generations_lock:
+            _generations.clear()
+        pubsub = _redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{Config.CACHE_INVALIDATION_CHANNEL: _on_invalidate})
+        _listener_thread = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+        _listener_pid = pid
+
+
+def _read(key, decode):
+    """Near cache first, then Redis (GET + PTTL in one round trip)."""
+    entry = _near.get(key)
+    if entry is not None:
+        _count("near_hits")
+        return entry[2]
+    _count("near_misses")
+
+    pipe = _redis.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.pttl(key)
+    raw, pttl = pipe.execute()
     if raw is None:
+        _count("redis_misses")
         return None
+    _count("redis_hits")
+
     try:
-        return json.loads(raw)
-    except json.JSONDecodeError:
+        value = decode(raw)
+    except Exception:
+        # Written by another codec/version of the app: treat as a miss.
         return None
 
+    # Never keep a local copy longer than Redis would.
+    ttl = Config.NEAR_CACHE_TTL
+    if pttl is not None and pttl >= 0:
+        ttl = min(ttl, pttl / 1000.0)
+    _near.set(key, value, len(raw), ttl)
+    return value
+
+
+def _write(key, value, raw, ttl):
+    _redis.setex(key, ttl, raw)
+    _near.set(key, value, len(raw), min(ttl, Config.NEAR_CACHE_TTL))
+
+
+def cache_get(key: str, namespace: str = None):
+    """Return cached data for key (within namespace, if given), or None."""
+    _ensure_listener()
+    return _read(_physical_key(key, namespace), _codec.loads)
+
+
+def cache_set(key: str, value, ttl: int = 60, namespace: str = None):
+    """Store serializable data (see CACHE_CODEC) with TTL in seconds."""
+    _ensure_listener()
+    _write(_physical_key(key, namespace), value, _codec.dumps(value), ttl)
+
+
+# Bumped by cache_delete() so cache_fill() can tell that a key was
+# invalidated while its value was being computed. Only needs to outlive
+# a fill in flight.
+_EPOCH_TTL = 60
+
+
+def _epoch_key(physical):
+    return f"cache:epoch:{physical}"
+
+
+def cache_fill(key: str, compute, ttl: int = 60, namespace: str = None):
+    """
+    compute() and cache the result, unless cache_delete() dropped the key
+    meanwhile: then the value (possibly read before the change) is returned
+    but not stored. A namespace invalidation needs no check, because the
+    value would land under the old generation's key.
+    """
+    _ensure_listener()
+    physical = _physical_key(key, namespace)
+    with _redis.pipeline() as pipe:
+        pipe.watch(_epoch_key(physical))
+        value = compute()
+        if value is None:
+            return None
+        raw = _codec.dumps(value)
+        pipe.multi()
+        pipe.setex(physical, ttl, raw)
+        try:
+            pipe.execute()
+        except redis.WatchError:
+            _count("fills_discarded")
+            return value
+    _near.set(physical, value, len(raw), min(ttl, Config.NEAR_CACHE_TTL))
+    return value
+
+
+def cache_delete(key: str, namespace: str = None):
+    """
+    Drop one key (within namespace, if given) from Redis and from every
+    process's near cache; the rest of the namespace stays cached. A
+    cache_fill() of the key already in progress does not store its value.
+    """
+    physical = _physical_key(key, namespace)
+    pipe = _redis.pipeline()
+    pipe.delete(physical)
+    pipe.incr(_epoch_key(physical))
+    pipe.expire(_epoch_key(physical), _EPOCH_TTL)
+    pipe.execute()
+    _near.discard(physical)
+    _redis.publish(Config.CACHE_INVALIDATION_CHANNEL, json.dumps({"key": physical}))
+
+
+def cache_invalidate(namespace: str):
+    """
+    Invalidate every key cached under namespace in O(1).
+
+    Bumps the generation with one INCR and broadcasts it so other
+    processes stop using their locally known generation immediately.
+    """
+    generation = _redis.incr(_generation_key(namespace))
+    _set_local_generation(namespace, generation)
+    _redis.publish(
+        Config.CACHE_INVALIDATION_CHANNEL,
+        json.dumps({"namespace": namespace, "generation": generation}),
+    )
+
+
+def _try_lock(lock_key):
+    token = uuid.uuid4().hex
+    if _redis.set(lock_key, token, nx=True, px=int(Config.CACHE_LOCK_TIMEOUT * 1000)):
+        return token
+    return None
+
+
+def _unlock(lock_key, token):
+    # Best effort: only drop the lock if it is still ours (it may have
+    # expired and been taken by another worker during a slow compute).
+    held = _redis.get(lock_key)
+    if held is not None and held.decode() == token:
+        _redis.delete(lock_key)
+
+
+def _single_flight(key, namespace, read_entry, refresh):
+    """
+    Shared stale-while-revalidate logic for cache_aside and cache_response.
+
+    read_entry() returns (fresh_until, delta, result) or None; refresh()
+    recomputes, stores and returns a new result.
+    """
+    entry = read_entry()
+    lock_key = f"lock:{_physical_key(key, namespace)}"
+
+    if entry is not None:
+        fresh_until, delta, result = entry
+        early = delta * Config.CACHE_EARLY_EXPIRY_BETA * -math.log(1.0 - random.random())
+        if time.time() + early < fresh_until:
+            return result
+
+        token = _try_lock(lock_key)
+        if token is None:
+            return result
+        try:
+            return refresh()
+        finally:
+            _unlock(lock_key, token)
+
+    token = _try_lock(lock_key)
+    if token is not None:
+        try:
+            return refresh()
+        finally:
+            _unlock(lock_key, token)
+
+    deadline = time.monotonic() + Config.CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = read_entry()
+        if entry is not None:
+            return entry[2]
+
+    return refresh()
+
+
+def cache_aside(key: str, compute, ttl: int, namespace: str = None):
+    """
+    Return the cached value for key, calling compute() to fill it.
+
+    - The value is stored in an envelope, so falsy results such as []
+      are cached like anything else.
+    - Entries are fresh for ttl seconds and then kept for another
+      CACHE_STALE_TTL seconds; during that window one worker (holding a
+      Redis lock) recomputes while everyone else is served the stale value.
+    - Refreshes start probabilistically before expiry (XFetch), weighted
+      by how long the last compute took, so hot keys rarely expire at all.
+    - On a cold miss only the lock holder computes; others wait up to
+      CACHE_LOCK_WAIT seconds for its result before computing themselves.
+    """
+    def read_entry():
+        envelope = cache_get(key, namespace=namespace)
+        if envelope is None:
+            return None
+        return envelope["fresh_until"], envelope["delta"], envelope["value"]
+
+    def refresh():
+        start = time.time()
+        value = compute()
+        delta = time.time() - start
+        envelope = {"value": value, "fresh_until": time.time() + ttl, "delta": delta}
+        cache_set(key, envelope, ttl=ttl + Config.CACHE_STALE_TTL, namespace=namespace)
+        return value
+
+    return _single_flight(key, namespace, read_entry, refresh)
+
+
+class CachedBody(NamedTuple):
+    body: bytes
+    etag: str
+    content_type: str
+    version: int = None
+
+
+def _decode_response(raw):
+    header, body = raw.split(b"\n", 1)
+    meta = json.loads(header)
+    return meta, CachedBody(body, meta["etag"], meta["content_type"], meta.get("version"))
+
+
+def cache_response(key: str, compute, ttl: int, namespace: str = None, version: int = None):
+    """
+    Like cache_aside, but caches the final encoded JSON body.
+
+    compute() returns the payload; it is encoded once per refresh and the
+    bytes (with ETag and content type) are returned as-is on every hit, so
+    the hot path does neither a decode nor a re-encode. Stored in Redis as
+    one small JSON header line followed by the body.
+
+    With version (a data version that only grows), the entry records the
+    version it was computed for, and an entry for an older version counts
+    as expired: one worker recomputes while the others get the older body,
+    whose CachedBody.version tells them so.
+    """
+    response_key = f"{key}:response"
+
+    def read_entry():
+        _ensure_listener()
+        entry = _read(_physical_key(response_key, namespace), _decode_response)
+        if entry is None:
+            return None
+        meta, cached = entry
+        if version is not None and (cached.version is None or cached.version < version):
+            return 0, meta["delta"], cached
+        return meta["fresh_until"], meta["delta"], cached
+
+    def refresh():
+        start = time.time()
+        body = _json_body(compute())
+        delta = time.time() - start
+        cached = CachedBody(body, hashlib.sha1(body).hexdigest(), "application/json", version)
+        meta = {
+            "fresh_until": time.time() + ttl,
+            "delta": delta,
+            "etag": cached.etag,
+            "content_type": cached.content_type,
+            "version": version,
+        }
+        raw = json.dumps(meta).encode() + b"\n" + body
+        _ensure_listener()
+        _write(
+            _physical_key(response_key, namespace), (meta, cached), raw,
+            ttl + Config.CACHE_STALE_TTL,
+        )
+        return cached
+
+    return _single_flight(response_key, namespace, read_entry, refresh)
+
+
+def json_response(key: str, compute, ttl: int, namespace: str = None, version: int = None):
+    """
+    Flask response served from cache_response, honouring If-None-Match.
 
-def cache_set(key: str, value, ttl: int = 60):
-    """Store JSON-serializable data with TTL in seconds."""
-    _redis.setex(key, ttl, json.dumps(value))
+    A body older than version is flagged on g.stale_body, so version_etag()
+    leaves it with its own content ETag instead of the current version's.
+    """
+    cached = cache_response(key, compute, ttl, namespace, version)
+    if version is not None and cached.version != version:
+        g.stale_body = True
+    response = Response(cached.body, content_type=cached.content_type)
+    response.set_etag(cached.etag)
+    return response.make_conditional(request)
 
 
-def cache_delete(prefix: str):
-    """Delete all keys starting with prefix (for invalidation)."""
-    pattern = prefix + "*"
-    for k in _redis.scan_iter(match=pattern):
-        _redis.delete(k)
+def cache_stats():
+    """Hit/miss/eviction counters for both tiers in this process."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["near_items"] = len(_near)
+    stats["near_bytes"] = _near.total_bytes
+    return stats
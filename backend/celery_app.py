@@ -1,6 +1,16 @@
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import (
+    task_postrun,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_shutdown,
+)
+from kombu import Queue
+
 from backend.config import Config
+from backend.db import close_thread_db, init_worker_db, reset_thread_db
+from backend.emailer import close_mailer
 
 celery = Celery(
     "vehicle_parking_app",
@@ -11,19 +21,71 @@ celery = Celery(
 # Timezone settings
 celery.conf.timezone = "Asia/Kolkata"
 celery.conf.enable_utc = True
-celery.conf.worker_pool = "solo"
+celery.conf.worker_pool = Config.CELERY_WORKER_POOL
+celery.conf.worker_concurrency = Config.CELERY_WORKER_CONCURRENCY
+
+# Queues. Each one gets its own workers (see backend/worker.py) so a long
+# email run never sits in front of a user's CSV export.
+DEFAULT_QUEUE = "celery"
+QUEUES = ("exports", "notifications", "analytics", DEFAULT_QUEUE)
+
+# Redis transport priorities: lower numbers are consumed first.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+celery.conf.task_queues = tuple(Queue(name) for name in QUEUES)
+celery.conf.task_default_queue = DEFAULT_QUEUE
+celery.conf.task_default_priority = PRIORITY_NORMAL
+celery.conf.broker_transport_options = {
+    "priority_steps": list(range(10)),
+    "sep": ":",
+    "queue_order_strategy": "priority",
+}
+celery.conf.task_routes = {
+    "backend.tasks.export.generate_csv": {"queue": "exports", "priority": PRIORITY_HIGH},
+    "summarize_email_run": {"queue": "notifications", "priority": PRIORITY_HIGH},
+    "send_report_chunk": {"queue": "notifications", "priority": PRIORITY_NORMAL},
+    "send_reminder_chunk": {"queue": "notifications", "priority": PRIORITY_LOW},
+    "daily_user_reminder": {"queue": "analytics"},
+    "monthly_report": {"queue": "analytics"},
+}
+# Tasks here run for seconds to minutes; don't let one worker hoard them.
+celery.conf.worker_prefetch_multiplier = 1
+
+
+@worker_process_init.connect
+def _init_worker_process(**kwargs):
+    init_worker_db()
+
+
+@task_postrun.connect
+def _reset_task_db(**kwargs):
+    # Sent after success and failure alike, in the thread that ran the task.
+    reset_thread_db()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _close_worker_resources(**kwargs):
+    close_thread_db()
+    close_mailer()
+
 
 import backend.tasks.export       # noqa: F401
+import backend.tasks.monitoring   # noqa: F401
+import backend.tasks.notifications  # noqa: F401
 import backend.tasks.reminders    # if you created it  # noqa: F401
-import backend.tasks.reports
+import backend.tasks.reports      # noqa: F401
 
 celery.conf.beat_schedule = {
     "daily-reminder-job": {
-        "task": "backend.tasks.reminders.daily_user_reminder",
+        "task": "daily_user_reminder",
         "schedule": crontab(hour=18, minute=0),  # 6 PM
     },
     "monthly-report-job": {
-        "task": "backend.tasks.reports.monthly_report",
+        "task": "monthly_report",
         "schedule": crontab(day_of_month=1, hour=9, minute=0),  # 1st each month
+        "kwargs": {"month": "previous"},  # the month that just ended
     },
 }
@@ -0,0 +1,26 @@
+import click
+
+from backend.live import publish_lot_changes
+from backend.models import check_occupancy_counters, rebuild_occupancy_counters
+
+
+def register_commands(app):
+    @app.cli.command("check-occupancy")
+    @click.option("--repair", is_flag=True, help="Rewrite counters that disagree.")
+    def check_occupancy(repair):
+        """Verify parking_lots.occupied_spots against parking_spots."""
+        mismatches = check_occupancy_counters()
+
+        if not mismatches:
+            click.echo("occupancy counters are consistent")
+            return
+
+        for lot_id, stored, actual in mismatches:
+            click.echo(f"lot {lot_id}: stored={stored} actual={actual}")
+
+        if repair:
+            fixed = rebuild_occupancy_counters()
+            publish_lot_changes(*(lot_id for lot_id, _, _ in mismatches))
+            click.echo(f"rebuilt counters for {fixed} lot(s)")
+        else:
+            raise SystemExit(1)
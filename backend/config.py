@@ -8,21 +8,149 @@ class Config:
 
     REDIS_URL = "redis://localhost:6379/0"
 
-    # For email — optional
-    MAIL_SENDER = "noreply@parkingapp.com"
+    # Outgoing mail (emailer.py). Leave SMTP_USER empty for servers
+    # without authentication, e.g. a local aiosmtpd instance.
+    SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+    SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
+    SMTP_USER = os.environ.get("SMTP_USER", "")
+    SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "")
+    SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") == "1"
+    SMTP_SSL = os.environ.get("SMTP_SSL", "0") == "1"
+    SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", 30))
+    # Reconnect after this many messages on one connection (0 = no cap)
+    SMTP_MAX_MESSAGES_PER_CONNECTION = int(
+        os.environ.get("SMTP_MAX_MESSAGES_PER_CONNECTION", 100)
+    )
+    # Messages per second per worker (0 = unthrottled)
+    SMTP_RATE_LIMIT = float(os.environ.get("SMTP_RATE_LIMIT", 0))
+    MAIL_SENDER = os.environ.get("MAIL_SENDER", SMTP_USER or "noreply@parkingapp.com")
 
     # SQLite database path
     BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-    DB_PATH = os.path.join(BASE_DIR, "parking.db")
+    DB_PATH = os.environ.get("DB_PATH", os.path.join(BASE_DIR, "parking.db"))
     SQLITE_URL = f"sqlite:///{DB_PATH}"
 
+    # SQLite connection tuning (applied to every connection in db.py)
+    SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", -20000))  # negative = KiB
+    SQLITE_CACHED_STATEMENTS = int(os.environ.get("SQLITE_CACHED_STATEMENTS", 256))
+
+    # Connection pool used for Flask requests
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+    DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+
+    # Spots inserted per write transaction when provisioning lots
+    SPOT_PROVISION_CHUNK = int(os.environ.get("SPOT_PROVISION_CHUNK", 5000))
+
     # Redis (for caching & Celery)
     REDIS_URL = "redis://localhost:6379/0"
 
+    # In-process near cache in front of Redis (see cache.py)
+    NEAR_CACHE_MAX_ITEMS = int(os.environ.get("NEAR_CACHE_MAX_ITEMS", 1024))
+    NEAR_CACHE_MAX_BYTES = int(os.environ.get("NEAR_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+    NEAR_CACHE_TTL = float(os.environ.get("NEAR_CACHE_TTL", 5))
+    CACHE_INVALIDATION_CHANNEL = "cache:invalidate"
+
+    # Serializer for cache_get/cache_set values: "json", "orjson" or "msgpack"
+    CACHE_CODEC = os.environ.get("CACHE_CODEC", "json")
+
+    # cache_aside(): stale-while-revalidate and single-flight recompute
+    CACHE_STALE_TTL = int(os.environ.get("CACHE_STALE_TTL", 60))
+    CACHE_LOCK_TIMEOUT = float(os.environ.get("CACHE_LOCK_TIMEOUT", 10))
+    CACHE_LOCK_WAIT = float(os.environ.get("CACHE_LOCK_WAIT", 2))
+    CACHE_EARLY_EXPIRY_BETA = float(os.environ.get("CACHE_EARLY_EXPIRY_BETA", 1.0))
+
+
+    # CSV exports
+    EXPORT_DIR = os.environ.get("EXPORT_DIR", os.path.join(BASE_DIR, "exports"))
+    EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000))
+    # A new export request joins a pending/running one younger than this
+    EXPORT_COALESCE_SECONDS = int(os.environ.get("EXPORT_COALESCE_SECONDS", 600))
+    # GET /export-csv/stream serves histories up to this many reservations;
+    # larger ones hold a pooled connection too long and go through Celery
+    EXPORT_STREAM_MAX_ROWS = int(os.environ.get("EXPORT_STREAM_MAX_ROWS", 5000))
+
+    # Users fetched per anti-join batch by the daily reminder
+    REMINDER_BATCH_SIZE = int(os.environ.get("REMINDER_BATCH_SIZE", 1000))
 
     # Celery configuration
     CELERY_BROKER_URL = REDIS_URL
     CELERY_RESULT_BACKEND = REDIS_URL
+    CELERY_WORKER_POOL = os.environ.get("CELERY_WORKER_POOL", "prefork")
+    CELERY_WORKER_CONCURRENCY = int(
+        os.environ.get("CELERY_WORKER_CONCURRENCY", os.cpu_count() or 4)
+    )
+
+    # Worker settings per queue, used by `python -m backend.worker <queue>`.
+    # SMTP sends wait on the network, so notifications run many threads
+    # (or gevent greenlets); exports and analytics are CPU/SQLite bound.
+    CELERY_WORKER_PROFILES = {
+        "exports": {
+            "pool": os.environ.get("CELERY_EXPORTS_POOL", "prefork"),
+            "concurrency": int(os.environ.get("CELERY_EXPORTS_CONCURRENCY", 2)),
+            "prefetch": int(os.environ.get("CELERY_EXPORTS_PREFETCH", 1)),
+        },
+        "notifications": {
+            "pool": os.environ.get("CELERY_NOTIFICATIONS_POOL", "threads"),
+            "concurrency": int(os.environ.get("CELERY_NOTIFICATIONS_CONCURRENCY", 32)),
+            "prefetch": int(os.environ.get("CELERY_NOTIFICATIONS_PREFETCH", 4)),
+        },
+        "analytics": {
+            "pool": os.environ.get("CELERY_ANALYTICS_POOL", "prefork"),
+            "concurrency": int(os.environ.get("CELERY_ANALYTICS_CONCURRENCY", 1)),
+            "prefetch": int(os.environ.get("CELERY_ANALYTICS_PREFETCH", 1)),
+        },
+    }
+
+    # Recent wait/run times kept per queue for /api/admin/queue-stats
+    CELERY_STATS_SAMPLES = int(os.environ.get("CELERY_STATS_SAMPLES", 1000))
+
+    # Email fan-out: recipients per send subtask, retries of a chunk's
+    # temporarily failed recipients (exponential backoff, seconds), and a
+    # messages-per-second cap shared by all workers (0 = no cap)
+    EMAIL_CHUNK_SIZE = int(os.environ.get("EMAIL_CHUNK_SIZE", 200))
+    EMAIL_CHUNK_MAX_RETRIES = int(os.environ.get("EMAIL_CHUNK_MAX_RETRIES", 5))
+    EMAIL_RETRY_BACKOFF = int(os.environ.get("EMAIL_RETRY_BACKOFF", 10))
+    EMAIL_RETRY_BACKOFF_MAX = int(os.environ.get("EMAIL_RETRY_BACKOFF_MAX", 600))
+    EMAIL_GLOBAL_RATE_LIMIT = float(os.environ.get("EMAIL_GLOBAL_RATE_LIMIT", 0))
+
+    # Seconds a resolved session user stays cached; 0 disables the cache
+    USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 60))
+
+    # Add an X-DB-Queries header with the number of SQL statements per request
+    DB_COUNT_QUERIES = os.environ.get("DB_COUNT_QUERIES", "0") == "1"
+
+    # Request latency histograms for /api/admin/metrics (metrics.py), and the
+    # fraction of requests that also record query count and SQL time
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+    METRICS_SQL_SAMPLE_RATE = float(os.environ.get("METRICS_SQL_SAMPLE_RATE", 0))
+
+    # Log statements slower than this many milliseconds (0 = off), keeping
+    # the last SLOW_QUERY_LOG_SIZE per process for /api/admin/slow-queries
+    SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 0))
+    SLOW_QUERY_LOG_SIZE = int(os.environ.get("SLOW_QUERY_LOG_SIZE", 200))
+
+    # Request profiles (profiling.py): where dumps go and how many are kept
+    PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+    PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 50))
+
+    # Live lot events (live.py): pub/sub channel, events kept in Redis for
+    # streams that resume, per-stream queue, keepalive interval, how long a
+    # stream stays open before the client reconnects (and resumes), and the
+    # reconnect delay sent to EventSource
+    LIVE_CHANNEL = "lots:events"
+    LIVE_BACKLOG = int(os.environ.get("LIVE_BACKLOG", 1000))
+    LIVE_QUEUE_SIZE = int(os.environ.get("LIVE_QUEUE_SIZE", 256))
+    LIVE_HEARTBEAT_SECONDS = float(os.environ.get("LIVE_HEARTBEAT_SECONDS", 15))
+    LIVE_STREAM_SECONDS = float(os.environ.get("LIVE_STREAM_SECONDS", 300))
+    LIVE_RETRY_MS = int(os.environ.get("LIVE_RETRY_MS", 3000))
+
+    # Seconds a lot's cached spot grid (grid.py) is kept after its last
+    # rebuild or reserve/release update
+    LOT_GRID_TTL = int(os.environ.get("LOT_GRID_TTL", 3600))
 
     # Session settings
     SESSION_COOKIE_HTTPONLY = True
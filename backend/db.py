@@ -1,8 +1,306 @@
+import queue
 import sqlite3
+import threading
+import time
+import weakref
+
+from flask import g, has_app_context
+
+from backend import profiling
 from backend.config import Config
 
 
-def get_db():
-    conn = sqlite3.connect(Config.DB_PATH)
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within DB_POOL_TIMEOUT."""
+
+
+# Statements slower than this go to the slow-query log (0 = off).
+SLOW_QUERY_SECONDS = Config.SLOW_QUERY_MS / 1000.0
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Cursor that times each statement: its execute plus the fetches after it.
+
+    The time is added to connection.sql_seconds (requests sampled by
+    metrics.py). A statement over SLOW_QUERY_SECONDS is handed to the
+    slow-query log once it is finished, i.e. at the cursor's next execute
+    when the connection is closed or released, or when the cursor is
+    garbage collected.
+    """
+
+    _sql = None
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            conn = self.connection
+            if conn.sql_seconds is not None:
+                conn.sql_seconds += elapsed
+            if self._sql is not None:
+                self._seconds += elapsed
+                # Note where it came from while the caller is still on the stack.
+                if self._site is None and self._seconds >= SLOW_QUERY_SECONDS:
+                    self._site = profiling.call_site()
+
+    def _begin(self, sql, parameters):
+        self.finish_statement()
+        if SLOW_QUERY_SECONDS:
+            self._sql, self._parameters, self._seconds, self._site = sql, parameters, 0.0, None
+
+    def finish_statement(self):
+        if self._sql is not None and self._seconds >= SLOW_QUERY_SECONDS:
+            profiling.record_slow_query(self._sql, self._parameters, self._seconds, self._site)
+        self._sql = None
+
+    def __del__(self):
+        self.finish_statement()
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql, parameters)
+        return self._timed(sqlite3.Cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        self._begin(sql, profiling.ManyParameters(seq_of_parameters))
+        return self._timed(sqlite3.Cursor.executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        return self._timed(sqlite3.Cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(sqlite3.Cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(sqlite3.Cursor.fetchall)
+
+    def __next__(self):
+        return self._timed(sqlite3.Cursor.__next__)
+
+
+class ManagedConnection(sqlite3.Connection):
+    """
+    sqlite3 connection owned by the pool / thread, not by the caller.
+
+    Route and task code keeps calling db.close() when it is done; for a
+    managed connection that only discards uncommitted work (same as a real
+    close would) and leaves the handle open so the next get_db() call in the
+    same request or thread reuses it with its statement cache intact.
+
+    Cursors are TimedCursors while the slow-query log is on, or while
+    sql_seconds is not None (a request sampled by metrics.py).
+    """
+
+    sql_seconds = None
+
+    def cursor(self, factory=sqlite3.Cursor):
+        if factory is not sqlite3.Cursor:
+            return super().cursor(factory)
+        if SLOW_QUERY_SECONDS:
+            cursor = super().cursor(TimedCursor)
+            self.__dict__.setdefault("_timed_cursors", weakref.WeakSet()).add(cursor)
+            return cursor
+        if self.sql_seconds is not None:
+            return super().cursor(TimedCursor)
+        return super().cursor()
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def finish_statements(self):
+        """Report slow statements still open on this connection's cursors."""
+        cursors = self.__dict__.pop("_timed_cursors", None)
+        for cursor in list(cursors or ()):
+            cursor.finish_statement()
+
+    def close(self):
+        self.finish_statements()
+        if self.in_transaction:
+            self.rollback()
+
+    def dispose(self):
+        super().close()
+
+
+def _connect():
+    conn = sqlite3.connect(
+        Config.DB_PATH,
+        factory=ManagedConnection,
+        timeout=Config.SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+        cached_statements=Config.SQLITE_CACHED_STATEMENTS,
+        check_same_thread=False,
+    )
     conn.row_factory = sqlite3.Row
+
+    conn.execute(f"PRAGMA journal_mode = {Config.SQLITE_JOURNAL_MODE};")
+    conn.execute(f"PRAGMA synchronous = {Config.SQLITE_SYNCHRONOUS};")
+    conn.execute(f"PRAGMA busy_timeout = {int(Config.SQLITE_BUSY_TIMEOUT_MS)};")
+    conn.execute(f"PRAGMA mmap_size = {int(Config.SQLITE_MMAP_SIZE)};")
+    conn.execute(f"PRAGMA cache_size = {int(Config.SQLITE_CACHE_SIZE)};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
     return conn
+
+
+class ConnectionPool:
+    """
+    Bounded LIFO pool of tuned connections.
+
+    LIFO keeps the most recently used (warmest) connections in rotation.
+    At most `max_size` connections are ever open; callers block up to
+    `timeout` seconds for one to be released and then get PoolTimeout.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.max_size:
+                self._created += 1
+                try:
+                    return _connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(
+                f"no database connection available after {self.timeout}s"
+            )
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.dispose()
+            with self._lock:
+                self._created -= 1
+
+
+_pool = ConnectionPool(Config.DB_POOL_SIZE, Config.DB_POOL_TIMEOUT)
+_local = threading.local()
+
+
+def get_db():
+    """
+    Return the connection for the current unit of work.
+
+    Inside a Flask app context every call during the request shares one
+    pooled connection, handed back by close_db() on teardown. Outside one
+    (Celery tasks, scripts) each thread keeps its own long-lived connection.
+    """
+    if has_app_context():
+        conn = g.get("_db")
+        if conn is None:
+            conn = g._db = _pool.acquire()
+            sampled = g.get("sample_sql", False)
+            if Config.DB_COUNT_QUERIES or sampled:
+                conn.set_trace_callback(_count_query)
+            if sampled:
+                conn.sql_seconds = 0.0
+        return conn
+
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect()
+    return conn
+
+
+def begin(conn, immediate=False):
+    """
+    Start a transaction of the caller's own (BEGIN IMMEDIATE when it will
+    write). Pending changes on the connection raise instead of being
+    committed or rolled back on someone else's behalf.
+    """
+    if conn.in_transaction:
+        raise RuntimeError("connection has uncommitted changes; commit them first")
+    conn.execute("BEGIN IMMEDIATE;" if immediate else "BEGIN;")
+
+
+def _count_query(statement):
+    g.db_queries = g.get("db_queries", 0) + 1
+
+
+def _add_query_count_header(response):
+    response.headers["X-DB-Queries"] = str(g.get("db_queries", 0))
+    return response
+
+
+def close_db(exc=None):
+    conn = g.pop("_db", None)
+    if conn is not None:
+        conn.finish_statements()
+        conn.set_trace_callback(None)
+        conn.sql_seconds = None
+        _pool.release(conn)
+
+
+def pool_state():
+    """(open, idle) connection counts of the request pool."""
+    return _pool._created, _pool._idle.qsize()
+
+
+def reset_thread_db():
+    """
+    End the calling thread's unit of work (after each Celery task).
+
+    Rolls back whatever a failed task left uncommitted, so a worker thread
+    never sits on SQLite's write lock between tasks. The connection stays
+    open for the next task.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+
+
+def close_thread_db():
+    """Dispose of the calling thread's connection (worker shutdown)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.conn = None
+        conn.dispose()
+
+
+_inherited = []
+
+
+def init_worker_db():
+    """
+    Give a freshly forked worker process its own connection.
+
+    A handle opened before the fork is shared with the parent; closing it
+    here could release the parent's locks, so it is only set aside.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _inherited.append(conn)
+        _local.conn = None
+    get_db()
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+    if Config.DB_COUNT_QUERIES:
+        app.after_request(_add_query_count_header)
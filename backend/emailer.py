@@ -1,32 +1,195 @@
 # backend/emailer.py
+import logging
+import os
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
+from typing import NamedTuple, Optional
 
-# TODO: put your actual email + app password here
-SMTP_HOST = "smtp.gmail.com"
-SMTP_PORT = 587
-SMTP_USER = "21f3002431@ds.study.iitm.ac.in"      # your Gmail address
-SMTP_PASS = "muskan0207"   # Gmail App Password (NOT your normal password)
-EMAIL_FROM = SMTP_USER
+from backend.config import Config
 
+log = logging.getLogger(__name__)
 
-def send_email(to: str, subject: str, html: str):
+
+class SendResult(NamedTuple):
+    to: str
+    ok: bool
+    error: Optional[str] = None
+    attempts: int = 1
+    # True for failures worth retrying later (4xx, connection errors)
+    temporary: bool = False
+
+
+class Mailer:
     """
-    Send a simple HTML email.
-    'to' should be a real email address.
+    One SMTP session reused for many messages.
+
+    The connection (TLS + login) is opened on first use and kept open,
+    recycled after `max_per_connection` messages, and re-established once
+    per message when the server has dropped it. `rate_limit` spaces sends
+    out to at most that many messages per second. Settings default to
+    Config.SMTP_*.
     """
-    msg = MIMEText(html, "html")
-    msg["Subject"] = subject
-    msg["From"] = EMAIL_FROM
-    msg["To"] = to
 
-    try:
-      with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-          server.starttls()
-          server.login(SMTP_USER, SMTP_PASS)
-          server.send_message(msg)
+    def __init__(self, host=None, port=None, username=None, password=None,
+                 starttls=None, ssl=None, timeout=None, sender=None,
+                 max_per_connection=None, rate_limit=None):
+        self.host = host or Config.SMTP_HOST
+        self.port = port or Config.SMTP_PORT
+        self.username = Config.SMTP_USER if username is None else username
+        self.password = Config.SMTP_PASSWORD if password is None else password
+        self.starttls = Config.SMTP_STARTTLS if starttls is None else starttls
+        self.ssl = Config.SMTP_SSL if ssl is None else ssl
+        self.timeout = timeout or Config.SMTP_TIMEOUT
+        self.sender = sender or Config.MAIL_SENDER
+        self.max_per_connection = (
+            Config.SMTP_MAX_MESSAGES_PER_CONNECTION
+            if max_per_connection is None else max_per_connection
+        )
+        self.rate_limit = Config.SMTP_RATE_LIMIT if rate_limit is None else rate_limit
+
+        self.pid = os.getpid()
+        self.connections_opened = 0
+        self._server = None
+        self._sent_on_connection = 0
+        self._next_send_at = 0.0
+
+    def _open(self):
+        if self.ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls and not self.ssl:
+                server.starttls()
+            if self.username:
+                server.login(self.username, self.password)
+        except BaseException:
+            server.close()
+            raise
+
+        self._server = server
+        self._sent_on_connection = 0
+        self.connections_opened += 1
+
+    def _discard(self):
+        """Drop a connection that is known to be broken (no QUIT)."""
+        server, self._server = self._server, None
+        if server is not None:
+            server.close()
+
+    def close(self):
+        server, self._server = self._server, None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _connection(self):
+        cap = self.max_per_connection
+        if self._server is not None and cap and self._sent_on_connection >= cap:
+            self.close()
+        if self._server is None:
+            self._open()
+        return self._server
+
+    def _throttle(self):
+        if self.rate_limit <= 0:
+            return
+        now = time.monotonic()
+        if self._next_send_at > now:
+            time.sleep(self._next_send_at - now)
+            now = self._next_send_at
+        self._next_send_at = now + 1.0 / self.rate_limit
+
+    def build_message(self, to, subject, html):
+        msg = MIMEText(html, "html")
+        msg["Subject"] = subject
+        msg["From"] = self.sender
+        msg["To"] = to
+        return msg
+
+    def send(self, to, subject, html):
+        """
+        Send one HTML email and return a SendResult; never raises for
+        delivery errors. Refusals (bad recipient, auth, 5xx) are not
+        retried; a dropped connection or 421 is retried once on a fresh
+        connection.
+        """
+        msg = self.build_message(to, subject, html)
+        self._throttle()
+
+        for attempt in (1, 2):
+            try:
+                self._connection().send_message(msg)
+                self._sent_on_connection += 1
+                log.debug("sent %r to %s", subject, to)
+                return SendResult(to, True, attempts=attempt)
+            except smtplib.SMTPResponseException as e:
+                error = f"{e.smtp_code} {_text(e.smtp_error)}"
+                retry = e.smtp_code == 421
+                temporary = 400 <= e.smtp_code < 500
+            except smtplib.SMTPRecipientsRefused as e:
+                error = "; ".join(
+                    f"{code} {_text(text)}" for code, text in e.recipients.values()
+                )
+                retry = False
+                temporary = all(400 <= code < 500 for code, _ in e.recipients.values())
+            except smtplib.SMTPException as e:
+                error = str(e)
+                retry = temporary = isinstance(e, smtplib.SMTPServerDisconnected)
+            except OSError as e:
+                error = str(e) or type(e).__name__
+                retry = temporary = True
+
+            if retry:
+                self._discard()
+            if not retry or attempt == 2:
+                log.warning("could not send %r to %s: %s", subject, to, error)
+                return SendResult(to, False, error, attempt, temporary)
+
+    def send_batch(self, messages):
+        """Send (to, subject, html) tuples over the shared connection."""
+        return [self.send(to, subject, html) for to, subject, html in messages]
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return str(value)
+
+
+_local = threading.local()
+
+
+def get_mailer():
+    """The Mailer owned by this worker process/thread."""
+    mailer = getattr(_local, "mailer", None)
+    if mailer is None or mailer.pid != os.getpid():
+        # A mailer inherited over fork shares the parent's socket; leave it.
+        mailer = _local.mailer = Mailer()
+    return mailer
+
+
+def close_mailer():
+    """QUIT this worker's SMTP session (worker shutdown)."""
+    mailer = getattr(_local, "mailer", None)
+    if mailer is not None and mailer.pid == os.getpid():
+        mailer.close()
+    _local.mailer = None
+
+
+def send_email(to: str, subject: str, html: str) -> SendResult:
+    """
+    Send a simple HTML email over this worker's persistent SMTP session.
+    'to' should be a real email address.
+    """
+    return get_mailer().send(to, subject, html)
 
-      print(f"[EMAIL] Sent '{subject}' to {to}")
 
-    except Exception as e:
-      print(f"[EMAIL ERROR] Could not send email to {to}: {e}")
\ No newline at end of file
+def send_batch(messages):
+    """Send (to, subject, html) tuples; returns one SendResult per message."""
+    return get_mailer().send_batch(messages)
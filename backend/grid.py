@@ -0,0 +1,163 @@
+# backend/grid.py
+"""
+Compact spot grid of a lot (GET /api/admin/parking-lots/<id>/spots?format=grid).
+
+Per lot, Redis holds
+  lot:grid:<id>          bitmap; bit n set = spot n occupied (SETBIT offsets,
+                         most significant bit of each byte first)
+  lot:grid:<id>:details  hash spot_number -> [username, start_time] of the
+                         occupied spots
+  lot:grid:<id>:info     hash: the lot version the grid reflects, and
+                         number_of_spots
+Reserve and release read the lot's version before and after their change
+in their own write transaction. Their grid update (apply_spot_changes,
+from live.publish_lot_changes) flips one bit and one detail only if the
+grid is at exactly the "before" version, and moves it to "after". A
+grid's version therefore always means "every change up to it", however
+publishes interleave. A change that finds any other version (one that
+was skipped, or published out of order) drops the grid, as does any
+other lot change. A grid is only served while its version equals the
+lot's current version (versions.py). Otherwise, or when it is missing,
+it is rebuilt from the occupied spots alone (idx_spot_occupied), never by
+reading every spot. A rebuild racing an update can only leave an older
+version behind, which the next read rebuilds again.
+"""
+import base64
+import json
+import re
+
+import redis
+
+from backend.config import Config
+from backend.models import get_lot_grid
+from backend.versions import lot_version
+
+_redis = redis.Redis.from_url(Config.REDIS_URL)
+
+ENCODINGS = ("rle", "bitmap")
+
+
+def _keys(lot_id):
+    bitmap = f"lot:grid:{lot_id}"
+    return bitmap, f"{bitmap}:details", f"{bitmap}:info"
+
+
+def apply_spot_changes(lot_id, before, after, spots):
+    """
+    Move the lot's grid from version before to after: spots maps
+    spot_number to (username, start_time) when it became occupied, or None
+    when freed. A grid at any other version (or missing) is dropped.
+    """
+    bitmap_key, details_key, info_key = _keys(lot_id)
+    with _redis.pipeline() as pipe:
+        try:
+            pipe.watch(info_key)
+            stored = pipe.hget(info_key, "version")
+            pipe.multi()
+            if stored is None or int(stored) != before:
+                pipe.delete(bitmap_key, details_key, info_key)
+            else:
+                for spot_number, detail in spots.items():
+                    pipe.setbit(bitmap_key, spot_number, 1 if detail else 0)
+                    if detail:
+                        pipe.hset(details_key, spot_number, json.dumps(list(detail)))
+                    else:
+                        pipe.hdel(details_key, spot_number)
+                pipe.hset(info_key, "version", after)
+                for key in (bitmap_key, details_key, info_key):
+                    pipe.expire(key, Config.LOT_GRID_TTL)
+            pipe.execute()
+        except redis.WatchError:
+            # A rebuild or another change got there first; let reads rebuild.
+            _redis.delete(bitmap_key, details_key, info_key)
+
+
+def drop_grid(pipe, lot_id):
+    pipe.delete(*_keys(lot_id))
+
+
+def _rebuild(lot_id):
+    grid = get_lot_grid(lot_id)
+    if grid is None:
+        return None
+    version, total, occupied = grid
+
+    size = (max([total] + [row[0] for row in occupied]) >> 3) + 1
+    bitmap = bytearray(size)
+    details = {}
+    for spot_number, username, start_time in occupied:
+        bitmap[spot_number >> 3] |= 0x80 >> (spot_number & 7)
+        details[spot_number] = [username, start_time]
+
+    bitmap_key, details_key, info_key = _keys(lot_id)
+    try:
+        pipe = _redis.pipeline()
+        pipe.delete(bitmap_key, details_key, info_key)
+        pipe.set(bitmap_key, bytes(bitmap), ex=Config.LOT_GRID_TTL)
+        if details:
+            pipe.hset(details_key, mapping={n: json.dumps(d) for n, d in details.items()})
+            pipe.expire(details_key, Config.LOT_GRID_TTL)
+        pipe.hset(info_key, mapping={"version": version, "total": total})
+        pipe.expire(info_key, Config.LOT_GRID_TTL)
+        pipe.execute()
+    except redis.RedisError:
+        pass  # served uncached this time
+    return version, total, bytes(bitmap), details
+
+
+def _read(lot_id):
+    bitmap_key, details_key, info_key = _keys(lot_id)
+    pipe = _redis.pipeline()
+    pipe.hgetall(info_key)
+    pipe.get(bitmap_key)
+    pipe.hgetall(details_key)
+    info, bitmap, details = pipe.execute()
+    if b"version" not in info or b"total" not in info:
+        return None
+    details = {int(n): json.loads(d) for n, d in details.items()}
+    return int(info[b"version"]), int(info[b"total"]), bitmap or b"", details
+
+
+def _runs(bitmap, total):
+    """[[first, last], ...] of consecutive occupied spot numbers."""
+    bits = bin(int.from_bytes(bitmap, "big"))[2:].zfill(len(bitmap) * 8)[:total + 1]
+    return [[m.start(), m.end() - 1] for m in re.finditer("1+", bits)]
+
+
+def lot_grid(lot_id, encoding="rle"):
+    """
+    The lot's spot statuses plus details of the occupied spots only, or
+    None if the lot does not exist. encoding "rle" gives occupied ranges,
+    "bitmap" the base64 bitmap (bit n = spot n, bit 0 unused).
+    """
+    current = lot_version(lot_id)
+    if current is None:
+        return None
+
+    try:
+        grid = _read(lot_id)
+    except redis.RedisError:
+        grid = None
+    if grid is None or grid[0] != current:
+        grid = _rebuild(lot_id)
+        if grid is None:
+            return None
+    version, total, bitmap, details = grid
+
+    result = {
+        "lot_id": lot_id,
+        "version": version,
+        "total": total,
+        "occupied_count": len(details),
+        "encoding": encoding,
+    }
+    if encoding == "bitmap":
+        size = (total >> 3) + 1
+        result["bitmap"] = base64.b64encode(bitmap[:size].ljust(size, b"\0")).decode()
+    else:
+        result["occupied"] = _runs(bitmap, total)
+    result["details"] = [
+        {"spot_number": n, "username": details[n][0], "start_time": details[n][1]}
+        for n in sorted(details)
+    ]
+    return result
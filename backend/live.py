@@ -0,0 +1,265 @@
+# backend/live.py
+"""
+Live lot occupancy over server-sent events.
+
+Every committed change to a parking lot gives it a new version from the
+global data_versions('lots') counter (triggers, migration 4). After
+committing, the writer calls publish_lot_changes(): it reads the lots
+back and publishes one small event per lot on LIVE_CHANNEL,
+
+    {"lot_id": 3, "version": 812, "occupied": 41, "available": 59,
+     "total": 100, "active": true}
+
+(plus "lot", the full summary entry, for admin changes, or "deleted").
+The last LIVE_BACKLOG events are also kept in a Redis sorted set scored
+by version, for streams that resume.
+
+Each web process has one pub/sub listener thread that fans events out to
+its open streams, so an idle stream costs a queue and a server thread,
+and no Redis connection or SQLite reads of its own.
+
+A stream opens with
+  - the events the client missed, when it resumes (Last-Event-ID, sent
+    by EventSource on reconnect, or ?since=) from a version the backlog
+    still reaches, or otherwise
+  - a snapshot of every lot, tagged with the global version.
+Writers publish after commit, so events for different lots can arrive
+slightly out of version order. Clients keep one version per lot and
+ignore anything older; the stream already drops events its snapshot or
+replay covered. Lot changes made outside the routes and cli.py (e.g.
+bench seeding) publish nothing and show up at the next snapshot.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import redis
+from flask import Response, request
+
+from backend.config import Config
+from backend.grid import apply_spot_changes, drop_grid
+from backend.models import get_lot_snapshot
+from backend.versions import forget_versions, record_versions
+
+log = logging.getLogger(__name__)
+
+_redis = redis.Redis.from_url(Config.REDIS_URL)
+
+_BACKLOG_KEY = "lots:events:backlog"
+# Replay a little before the client's position, to cover events that
+# were published after a newer one (see above); duplicates are dropped.
+_RESUME_OVERLAP = 50
+
+
+def publish_lot_changes(*lot_ids, details=False, spots=None, versions=None):
+    """
+    Publish the current state of lot_ids, and update the version mirror
+    behind the lot ETags (versions.py) and the lots' spot grids (grid.py).
+    Call after the change is committed; details=True adds the lot's name,
+    address and price.
+
+    spots describes a reserve/release in a single lot: spot_number ->
+    (username, start_time), or None for a freed spot, with versions the
+    (before, after) lot versions read in that change's own transaction.
+    Without them the lots' grids are dropped and rebuilt when next read.
+    """
+    version, lots = get_lot_snapshot(include_inactive=True, lot_ids=lot_ids)
+    by_id = {lot["id"]: lot for lot in lots}
+
+    events = []
+    for lot_id in lot_ids:
+        lot = by_id.get(lot_id)
+        if lot is None:
+            events.append({"lot_id": lot_id, "version": version, "deleted": True})
+            continue
+        event = {
+            "lot_id": lot_id,
+            "version": lot["version"],
+            "occupied": lot["occupied_spots"],
+            "available": lot["available_spots"],
+            "total": lot["total_spots"],
+            "active": lot["is_active"],
+        }
+        if details:
+            event["lot"] = lot
+        events.append(event)
+
+    try:
+        pipe = _redis.pipeline()
+        record_versions(pipe, version, {e["lot_id"]: e["version"] for e in events})
+        for event in events:
+            if spots is None:
+                drop_grid(pipe, event["lot_id"])
+            raw = json.dumps(event)
+            pipe.zadd(_BACKLOG_KEY, {raw: event["version"]})
+            pipe.publish(Config.LIVE_CHANNEL, raw)
+        pipe.zremrangebyrank(_BACKLOG_KEY, 0, -Config.LIVE_BACKLOG - 1)
+        pipe.execute()
+        if spots is not None:
+            apply_spot_changes(lot_ids[0], *versions, spots)
+    except redis.RedisError:
+        # The change is committed; streams catch up at their next snapshot.
+        log.warning("could not publish lot events for %s", lot_ids, exc_info=True)
+        # The mirror may now be behind SQLite; without these entries the
+        # ETags (and the grids checked against them) fall back to SQLite
+        # instead of answering 304 for changed data.
+        try:
+            forget_versions(lot_ids)
+        except redis.RedisError:
+            log.warning("could not clear lot versions for %s", lot_ids, exc_info=True)
+
+
+# ---------------------------------------------------------------------------
+# Per-process fan-out
+# ---------------------------------------------------------------------------
+
+class _Subscriber:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=Config.LIVE_QUEUE_SIZE)
+        self.overflowed = False
+
+
+_subscribers = set()
+_subscribers_lock = threading.Lock()
+
+_listener_lock = threading.Lock()
+_listener_pid = None
+
+
+def _on_event(message):
+    raw = message["data"]
+    with _subscribers_lock:
+        subscribers = list(_subscribers)
+    for subscriber in subscribers:
+        try:
+            subscriber.queue.put_nowait(raw)
+        except queue.Full:
+            # A client that stopped reading; its stream ends and it resumes.
+            subscriber.overflowed = True
+
+
+def _on_listener_error(exc, pubsub, thread):
+    log.warning("lot event listener: %s; retrying", exc)
+    time.sleep(1.0)
+
+
+def _ensure_listener():
+    """One pub/sub thread per process, restarted after a fork (cf. cache.py)."""
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _listener_lock:
+        if _listener_pid == pid:
+            return
+        pubsub = _redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{Config.LIVE_CHANNEL: _on_event})
+        pubsub.run_in_thread(sleep_time=1.0, daemon=True,
+                             exception_handler=_on_listener_error)
+        _listener_pid = pid
+
+
+def _subscribe():
+    _ensure_listener()
+    subscriber = _Subscriber()
+    with _subscribers_lock:
+        _subscribers.add(subscriber)
+    return subscriber
+
+
+def _unsubscribe(subscriber):
+    with _subscribers_lock:
+        _subscribers.discard(subscriber)
+
+
+# ---------------------------------------------------------------------------
+# Streams
+# ---------------------------------------------------------------------------
+
+def resume_version():
+    """Version the client resumes from (Last-Event-ID or ?since=), or None."""
+    value = request.headers.get("Last-Event-ID") or request.args.get("since")
+    if value in (None, ""):
+        return None
+    version = int(value)
+    if version < 0:
+        raise ValueError(value)
+    return version
+
+
+def _replay(since):
+    """Backlog events after since, or None if the backlog no longer reaches it."""
+    oldest = _redis.zrange(_BACKLOG_KEY, 0, 0, withscores=True)
+    newest = _redis.zrange(_BACKLOG_KEY, -1, -1, withscores=True)
+    if not oldest or oldest[0][1] > since or newest[0][1] < since:
+        return None
+    raws = _redis.zrangebyscore(_BACKLOG_KEY, f"({since - _RESUME_OVERLAP}", "+inf")
+    return [json.loads(raw) for raw in raws]
+
+
+def _for_audience(event, include_inactive):
+    """Users only see active lots: deactivation reads as a deletion."""
+    if include_inactive or event.get("active") or event.get("deleted"):
+        return event
+    return {"lot_id": event["lot_id"], "version": event["version"], "deleted": True}
+
+
+def _format(kind, version, payload):
+    return f"id: {version}\nevent: {kind}\ndata: {json.dumps(payload)}\n\n"
+
+
+def event_stream(include_inactive=False, since=None):
+    """
+    text/event-stream Response for a view. The snapshot or replay is read
+    here, before the view returns, so the request's pooled connection is
+    released before streaming starts.
+    """
+    subscriber = _subscribe()
+    try:
+        floor, seen = 0, {}
+        events = _replay(since) if since is not None else None
+        if events is None:
+            version, lots = get_lot_snapshot(include_inactive)
+            opening = [_format("snapshot", version, {"version": version, "lots": lots})]
+            floor = version
+        else:
+            opening = []
+            for event in events:
+                seen[event["lot_id"]] = max(seen.get(event["lot_id"], 0), event["version"])
+                event = _for_audience(event, include_inactive)
+                opening.append(_format("delta", event["version"], event))
+    except Exception:
+        _unsubscribe(subscriber)
+        raise
+
+    def generate():
+        yield f"retry: {Config.LIVE_RETRY_MS}\n\n"
+        yield from opening
+
+        deadline = time.monotonic() + Config.LIVE_STREAM_SECONDS
+        while not subscriber.overflowed:
+            timeout = min(Config.LIVE_HEARTBEAT_SECONDS, deadline - time.monotonic())
+            if timeout <= 0:
+                return  # the client reconnects and resumes from its last id
+            try:
+                raw = subscriber.queue.get(timeout=timeout)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+
+            event = json.loads(raw)
+            lot_id, version = event["lot_id"], event["version"]
+            if version <= max(floor, seen.get(lot_id, 0)):
+                continue
+            seen[lot_id] = version
+            event = _for_audience(event, include_inactive)
+            yield _format("delta", version, event)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # nginx: don't buffer the stream
+    response.call_on_close(lambda: _unsubscribe(subscriber))
+    return response
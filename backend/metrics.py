@@ -0,0 +1,199 @@
+# backend/metrics.py
+"""
+Request, SQL, cache and Celery metrics in Prometheus text format,
+served by GET /api/admin/metrics.
+
+- Every request: latency histogram by method, route rule and status.
+- A METRICS_SQL_SAMPLE_RATE fraction of requests also get a trace
+  callback (statement count) and timed cursors (seconds spent in SQLite).
+  With the rate at 0 nothing is installed on the connection, so the
+  per-request cost is a perf_counter() pair and a histogram update.
+- Cache counters come from cache.cache_stats(), and the connection pool
+  state from db.py.
+- Celery task durations are recorded by the workers in Redis
+  (tasks/monitoring.py), so the numbers cover every worker process.
+
+Request and SQL figures are per web process; scrape each one.
+"""
+import bisect
+import random
+import threading
+import time
+
+from flask import g, request
+
+from backend import db
+from backend.cache import cache_stats
+from backend.config import Config
+from backend.tasks.monitoring import TASK_DURATION_BUCKETS, task_duration_series
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Prometheus histogram with a fixed label set, safe across threads."""
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}  # label values -> [[count per bucket..., +Inf], sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        with self._lock:
+            snapshot = {k: (list(v[0]), v[1]) for k, v in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in sorted(snapshot.items()):
+            lines.extend(render_histogram_series(
+                self.name, self.labels, label_values, self.buckets, counts, total
+            ))
+        return lines
+
+
+def render_histogram_series(name, label_names, label_values, buckets, counts, total):
+    """Lines for one series; counts are per bucket (not cumulative), +Inf last."""
+    lines = []
+    cumulative = 0
+    for bound, count in zip(buckets + (float("inf"),), counts):
+        cumulative += count
+        labels = _format_labels(label_names + ("le",), label_values + (_format_number(bound),))
+        lines.append(f"{name}_bucket{labels} {cumulative}")
+    labels = _format_labels(label_names, label_values)
+    lines.append(f"{name}_sum{labels} {total!r}")
+    lines.append(f"{name}_count{labels} {cumulative}")
+    return lines
+
+
+request_latency = Histogram(
+    "parkflow_http_request_duration_seconds",
+    "Time from the first before_request hook to the response, by route.",
+    LATENCY_BUCKETS, ("method", "route", "status"),
+)
+request_queries = Histogram(
+    "parkflow_http_request_db_queries",
+    "SQL statements (including trigger bodies) per sampled request.",
+    QUERY_BUCKETS, ("method", "route"),
+)
+request_sql_time = Histogram(
+    "parkflow_http_request_sql_seconds",
+    "Seconds spent in SQLite (execute and fetch) per sampled request.",
+    SQL_BUCKETS, ("method", "route"),
+)
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "<unmatched>"
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    rate = Config.METRICS_SQL_SAMPLE_RATE
+    if rate and random.random() < rate:
+        g.sample_sql = True
+
+
+def _finish_request(response):
+    _observe(response.status_code)
+    return response
+
+
+def _finish_failed_request(exc=None):
+    if exc is not None and "metrics_started" in g:
+        _observe(500)
+
+
+def _observe(status):
+    started = g.pop("metrics_started", None)
+    if started is None:
+        return
+    method, route = request.method, _route()
+    request_latency.observe(time.perf_counter() - started, method, route, str(status))
+
+    if g.get("sample_sql"):
+        request_queries.observe(g.get("db_queries", 0), method, route)
+        conn = g.get("_db")
+        seconds = conn.sql_seconds if conn is not None else None
+        request_sql_time.observe(seconds or 0.0, method, route)
+
+
+def _render_counters(name, help, kind, samples):
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return lines
+
+
+def render_metrics():
+    """The whole exposition, as text/plain; version=0.0.4."""
+    lines = []
+    for histogram in (request_latency, request_queries, request_sql_time):
+        lines.extend(histogram.render())
+
+    stats = cache_stats()
+    lines.extend(_render_counters(
+        "parkflow_cache_requests_total", "Cache lookups by tier and result.", "counter",
+        [({"tier": tier, "result": result}, stats[f"{tier}_{result}"])
+         for tier in ("near", "redis") for result in ("hits", "misses")],
+    ))
+    lines.extend(_render_counters(
+        "parkflow_cache_near_evictions_total", "Near-cache LRU evictions.", "counter",
+        [({}, stats["near_evictions"])],
+    ))
+    lines.extend(_render_counters(
+        "parkflow_cache_near_items", "Entries in this process's near cache.", "gauge",
+        [({}, stats["near_items"])],
+    ))
+
+    open_conns, idle_conns = db.pool_state()
+    lines.extend(_render_counters(
+        "parkflow_db_pool_connections", "Pooled SQLite connections by state.", "gauge",
+        [({"state": "open"}, open_conns), ({"state": "idle"}, idle_conns)],
+    ))
+
+    name = "parkflow_celery_task_duration_seconds"
+    lines += [f"# HELP {name} Celery task run time, recorded by the workers.",
+              f"# TYPE {name} histogram"]
+    for task, state, counts, total in task_duration_series():
+        lines.extend(render_histogram_series(
+            name, ("task", "state"), (task, state), TASK_DURATION_BUCKETS, counts, total
+        ))
+
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    if not Config.METRICS_ENABLED:
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_finish_failed_request)
@@ -0,0 +1,469 @@
+"""
+Schema migrations keyed on PRAGMA user_version.
+
+Each migration is a function that takes a cursor and runs inside one
+BEGIN IMMEDIATE transaction together with the user_version bump, so a
+failed migration leaves the schema untouched and concurrent app starts
+apply each one exactly once. When the database is already at the latest
+version, migrate() costs one PRAGMA read and runs no DDL.
+
+Append new migrations to MIGRATIONS; never edit one that has shipped.
+"""
+from backend.db import get_db
+
+
+class MigrationError(Exception):
+    """A migration cannot be applied to the data currently in the database."""
+
+
+def _0001_baseline(c):
+    """
+    Schema as created by init_db before versioning. Everything is
+    IF NOT EXISTS / add-if-missing, so it also brings forward databases
+    that were created by any earlier init_db (user_version 0).
+    """
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL,
+            email TEXT,
+            phone TEXT,
+            is_active INTEGER DEFAULT 1,
+            reservation_count INTEGER NOT NULL DEFAULT 0,
+            reservation_version INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+
+    reservation_counts_added = _add_column_if_missing(
+        c, "users", "reservation_count", "INTEGER NOT NULL DEFAULT 0"
+    )
+    _add_column_if_missing(c, "users", "reservation_version", "INTEGER NOT NULL DEFAULT 0")
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS parking_lots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            prime_location_name TEXT NOT NULL,
+            address TEXT,
+            pin_code TEXT,
+            price_per_hour REAL NOT NULL,
+            number_of_spots INTEGER NOT NULL,
+            is_active INTEGER DEFAULT 1,
+            occupied_spots INTEGER NOT NULL DEFAULT 0,
+            spots_per_level INTEGER
+        );
+    """)
+
+    counters_added = _add_column_if_missing(
+        c, "parking_lots", "occupied_spots", "INTEGER NOT NULL DEFAULT 0"
+    )
+    _add_column_if_missing(c, "parking_lots", "spots_per_level", "INTEGER")
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS parking_spots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lot_id INTEGER NOT NULL,
+            spot_number INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'A',
+            level TEXT,
+            remarks TEXT,
+            FOREIGN KEY (lot_id) REFERENCES parking_lots(id)
+        );
+    """)
+
+    c.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_spot_unique
+        ON parking_spots(lot_id, spot_number);
+    """)
+
+    # Free-spot index: only 'A' rows live in it, so the lowest free spot of a
+    # lot is a single B-tree seek no matter how full or large the lot is.
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_spot_free
+        ON parking_spots(lot_id, spot_number)
+        WHERE status = 'A';
+    """)
+
+    # parking_lots.occupied_spots is a denormalized count of 'O' spots.
+    # These triggers keep it correct inside whatever transaction changes
+    # parking_spots, so reserve/release/resize/delete never have to.
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_spot_status_update
+        AFTER UPDATE OF status ON parking_spots
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE parking_lots
+            SET occupied_spots = occupied_spots
+                + (NEW.status = 'O') - (OLD.status = 'O')
+            WHERE id = NEW.lot_id;
+        END;
+    """)
+
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_spot_insert
+        AFTER INSERT ON parking_spots
+        WHEN NEW.status = 'O'
+        BEGIN
+            UPDATE parking_lots SET occupied_spots = occupied_spots + 1
+            WHERE id = NEW.lot_id;
+        END;
+    """)
+
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_spot_delete
+        AFTER DELETE ON parking_spots
+        WHEN OLD.status = 'O'
+        BEGIN
+            UPDATE parking_lots SET occupied_spots = occupied_spots - 1
+            WHERE id = OLD.lot_id;
+        END;
+    """)
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS reservations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            lot_id INTEGER NOT NULL,
+            spot_id INTEGER NOT NULL,
+            parking_in TEXT NOT NULL,
+            parking_out TEXT,
+            parking_cost REAL,
+            status TEXT NOT NULL DEFAULT 'active',
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (lot_id) REFERENCES parking_lots(id),
+            FOREIGN KEY (spot_id) REFERENCES parking_spots(id)
+        );
+    """)
+
+    # Keyset pagination of a user's history: (user_id, parking_in) plus the
+    # implicit rowid gives a stable (parking_in, id) order per user.
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservations_user_parking_in
+        ON reservations(user_id, parking_in);
+    """)
+
+    # Active reservation holding a spot (lot spot grid join).
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservations_active_spot
+        ON reservations(spot_id)
+        WHERE status = 'active';
+    """)
+
+    # Monthly report month range: covers every column the aggregation
+    # reads, so a month is one index range scan with no table lookups.
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservations_month
+        ON reservations(parking_in, user_id, lot_id, parking_cost);
+    """)
+
+    if reservation_counts_added:
+        c.execute("""
+            UPDATE users SET reservation_count = (
+                SELECT COUNT(*) FROM reservations r WHERE r.user_id = users.id
+            );
+        """)
+
+    # users.reservation_count and row_counts('users') let paginated
+    # endpoints report totals without a COUNT(*) scan.
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_reservation_insert
+        AFTER INSERT ON reservations
+        BEGIN
+            UPDATE users SET reservation_count = reservation_count + 1
+            WHERE id = NEW.user_id;
+        END;
+    """)
+
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_reservation_delete
+        AFTER DELETE ON reservations
+        BEGIN
+            UPDATE users SET reservation_count = reservation_count - 1
+            WHERE id = OLD.user_id;
+        END;
+    """)
+
+    # users.reservation_version changes whenever any of the user's
+    # reservations is added, edited or removed; exports use it to skip
+    # regenerating a file when nothing changed.
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_reservation_version_{event.lower()}
+            AFTER {event} ON reservations
+            BEGIN
+                UPDATE users SET reservation_version = reservation_version + 1
+                WHERE id = {row}.user_id;
+            END;
+        """)
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS row_counts (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """)
+
+    c.execute("""
+        INSERT OR IGNORE INTO row_counts (name, value)
+        SELECT 'users', COUNT(*) FROM users;
+    """)
+
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_user_insert
+        AFTER INSERT ON users
+        BEGIN
+            UPDATE row_counts SET value = value + 1 WHERE name = 'users';
+        END;
+    """)
+
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_user_delete
+        AFTER DELETE ON users
+        BEGIN
+            UPDATE row_counts SET value = value - 1 WHERE name = 'users';
+        END;
+    """)
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS task_status (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            task_id TEXT NOT NULL,
+            task_type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            file_path TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+    """)
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS exports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            file_path TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            rows_written INTEGER NOT NULL DEFAULT 0,
+            completed_at TEXT,
+            error TEXT,
+            compressed INTEGER NOT NULL DEFAULT 0,
+            data_version INTEGER,
+            last_reservation_id INTEGER,
+            final_offset INTEGER,
+            final_rows INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+    """)
+
+    for column, ddl in (
+        ("rows_written", "INTEGER NOT NULL DEFAULT 0"),
+        ("completed_at", "TEXT"),
+        ("error", "TEXT"),
+        ("compressed", "INTEGER NOT NULL DEFAULT 0"),
+        ("data_version", "INTEGER"),
+        ("last_reservation_id", "INTEGER"),
+        ("final_offset", "INTEGER"),
+        ("final_rows", "INTEGER"),
+    ):
+        _add_column_if_missing(c, "exports", column, ddl)
+
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_exports_user
+        ON exports(user_id, compressed, status);
+    """)
+
+    # One row per user and month ('YYYY-MM'), written by the monthly_report
+    # task so resends and the UI read stored figures instead of re-aggregating.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS monthly_reports (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            visits INTEGER NOT NULL,
+            total_spent REAL NOT NULL,
+            most_used_lot_id INTEGER,
+            most_used_lot_name TEXT,
+            generated_at TEXT NOT NULL,
+            emailed_at TEXT,
+            PRIMARY KEY (user_id, month),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+    """)
+
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_monthly_reports_month
+        ON monthly_reports(month, user_id);
+    """)
+
+    if counters_added:
+        c.execute("""
+            UPDATE parking_lots
+            SET occupied_spots = (
+                SELECT COUNT(*) FROM parking_spots ps
+                WHERE ps.lot_id = parking_lots.id AND ps.status = 'O'
+            );
+        """)
+
+
+def _0002_hot_path_indexes(c):
+    """Indexes for lookups in routes/ and tasks/ that were still scans."""
+    c.execute("""
+        SELECT user_id FROM reservations
+        WHERE status = 'active'
+        GROUP BY user_id
+        HAVING COUNT(*) > 1;
+    """)
+    duplicates = [r[0] for r in c.fetchall()]
+    if duplicates:
+        raise MigrationError(
+            "users with more than one active reservation: "
+            + ", ".join(map(str, duplicates))
+            + "; release or cancel the extra reservations and restart"
+        )
+
+    # At most one active reservation per user; also serves the
+    # user_id + status = 'active' lookups (current reservation, allocation,
+    # release).
+    c.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_reservations_one_active_per_user
+        ON reservations(user_id)
+        WHERE status = 'active';
+    """)
+
+    # Occupied spots of a lot: shrink/delete checks and occupancy recounts.
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_spot_occupied
+        ON parking_spots(lot_id, spot_number)
+        WHERE status = 'O';
+    """)
+
+
+def _0003_export_order_index(c):
+    """
+    reservations(user_id): walks one user's rows in id order, so CSV
+    exports (WHERE user_id = ? AND id > ? ORDER BY id) need no sort.
+    Found by backend/bench/query_plans.py.
+    """
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservations_user_id
+        ON reservations(user_id);
+    """)
+
+
+def _0004_lot_versions(c):
+    """
+    data_versions('lots') is bumped by every committed change to a parking
+    lot (including its occupied_spots counter, so every reserve/release),
+    and the changed lot takes the new value as parking_lots.version.
+    A lot row and its version are therefore always read together; live
+    lot events (live.py) are ordered and deduplicated by it.
+    """
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """)
+    c.execute("INSERT OR IGNORE INTO data_versions (name, value) VALUES ('lots', 0);")
+
+    _add_column_if_missing(c, "parking_lots", "version", "INTEGER NOT NULL DEFAULT 0")
+
+    # The inner UPDATE of parking_lots.version does not fire the update
+    # trigger again (recursive_triggers is off); the WHEN clause would
+    # stop it anyway.
+    for event, guard in (("INSERT", ""), ("UPDATE", "WHEN NEW.version IS OLD.version")):
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_lot_version_{event.lower()}
+            AFTER {event} ON parking_lots
+            {guard}
+            BEGIN
+                UPDATE data_versions SET value = value + 1 WHERE name = 'lots';
+                UPDATE parking_lots
+                SET version = (SELECT value FROM data_versions WHERE name = 'lots')
+                WHERE id = NEW.id;
+            END;
+        """)
+
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_lot_version_delete
+        AFTER DELETE ON parking_lots
+        BEGIN
+            UPDATE data_versions SET value = value + 1 WHERE name = 'lots';
+        END;
+    """)
+
+
+def _0005_unsent_reports_index(c):
+    """
+    monthly_reports(month, user_id) for reports not yet emailed: the
+    monthly_report task only sends those, and a re-run after everything
+    went out should find nothing without walking the whole month.
+    Found by backend/bench/query_plans.py.
+    """
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_monthly_reports_unsent
+        ON monthly_reports(month, user_id) WHERE emailed_at IS NULL;
+    """)
+
+
+MIGRATIONS = [
+    _0001_baseline,
+    _0002_hot_path_indexes,
+    _0003_export_order_index,
+    _0004_lot_versions,
+    _0005_unsent_reports_index,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def schema_version(c):
+    c.execute("PRAGMA user_version;")
+    return c.fetchone()[0]
+
+
+def migrate():
+    """
+    Apply pending migrations. Returns the list of versions applied
+    (empty when the schema was already current).
+    """
+    db = get_db()
+    c = db.cursor()
+
+    if schema_version(c) >= LATEST_VERSION:
+        db.close()
+        return []
+
+    applied = []
+    try:
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            if db.in_transaction:
+                db.commit()
+            c.execute("BEGIN IMMEDIATE;")
+            # Re-read under the write lock: another process may have
+            # migrated while we waited.
+            if schema_version(c) >= version:
+                db.rollback()
+                continue
+
+            migration(c)
+            c.execute(f"PRAGMA user_version = {version};")
+            db.commit()
+            applied.append(version)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    return applied
+
+
+def _add_column_if_missing(c, table, column, ddl):
+    """ALTER an older database forward. Returns True if the column was added."""
+    c.execute(f"PRAGMA table_info({table});")
+    if column in {r[1] for r in c.fetchall()}:
+        return False
+    c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl};")
+    return True
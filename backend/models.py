@@ -1,94 +1,20 @@
-from backend.db import get_db
+import sqlite3
+
+from backend.config import Config
+from backend.db import begin, get_db
 from werkzeug.security import generate_password_hash
-from backend.cache import cache_delete
+from backend.cache import cache_invalidate, LOTS_CACHE
+from backend.migrations import migrate
 
 
 def init_db():
+    """Bring the schema up to date and make sure the default admin exists."""
+    migrate()
+
     db = get_db()
     c = db.cursor()
 
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT NOT NULL,
-            email TEXT,
-            phone TEXT,
-            is_active INTEGER DEFAULT 1
-        );
-    """)
-
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS parking_lots (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            prime_location_name TEXT NOT NULL,
-            address TEXT,
-            pin_code TEXT,
-            price_per_hour REAL NOT NULL,
-            number_of_spots INTEGER NOT NULL,
-            is_active INTEGER DEFAULT 1
-        );
-    """)
-
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS parking_spots (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            lot_id INTEGER NOT NULL,
-            spot_number INTEGER NOT NULL,
-            status TEXT NOT NULL DEFAULT 'A',
-            level TEXT,
-            remarks TEXT,
-            FOREIGN KEY (lot_id) REFERENCES parking_lots(id)
-        );
-    """)
-
-    c.execute("""
-        CREATE UNIQUE INDEX IF NOT EXISTS idx_spot_unique
-        ON parking_spots(lot_id, spot_number);
-    """)
-
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS reservations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            lot_id INTEGER NOT NULL,
-            spot_id INTEGER NOT NULL,
-            parking_in TEXT NOT NULL,
-            parking_out TEXT,
-            parking_cost REAL,
-            status TEXT NOT NULL DEFAULT 'active',
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            FOREIGN KEY (lot_id) REFERENCES parking_lots(id),
-            FOREIGN KEY (spot_id) REFERENCES parking_spots(id)
-        );
-    """)
-
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS task_status (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            task_id TEXT NOT NULL,
-            task_type TEXT NOT NULL,
-            status TEXT NOT NULL,
-            file_path TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        );
-    """)
-
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS exports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            file_path TEXT,
-            status TEXT DEFAULT 'pending',
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        );
-    """)
-
-    c.execute("SELECT id FROM users WHERE role = 'admin'")
+    c.execute("SELECT id FROM users WHERE role = 'admin' LIMIT 1;")
     admin_exists = c.fetchone()
 
     if admin_exists is None:
@@ -105,52 +31,90 @@ def init_db():
     db.close()
 
 
-def create_parking_lot(name, address, pin_code, price, spot_count):
-    db = get_db()
-    c = db.cursor()
+def provision_spots(lot_id, first, last, spots_per_level=None):
+    """
+    Insert spots first..last (inclusive) for a lot with set-based SQL.
 
-    c.execute("""
-        INSERT INTO parking_lots (prime_location_name, address, pin_code, price_per_hour, number_of_spots)
-        VALUES (?, ?, ?, ?, ?)
-    """, (name, address, pin_code, price, spot_count))
+    Each chunk of Config.SPOT_PROVISION_CHUNK spots is one recursive-CTE
+    INSERT followed by a commit, so a 20k-spot garage never holds the write
+    lock for more than one chunk and reservations interleave between them.
+    Callers must commit their own changes first; a pending transaction
+    raises rather than being committed with the first chunk.
 
-    lot_id = c.lastrowid
+    The lot's number_of_spots becomes `last` in the final chunk's
+    transaction, so lot totals never count spots that do not exist yet.
 
-    for i in range(1, spot_count + 1):
-        c.execute("""
-            INSERT INTO parking_spots (lot_id, spot_number, status)
-            VALUES (?, ?, 'A')
-        """, (lot_id, i))
+    With spots_per_level, spot n is placed on level ((n - 1) // spots_per_level) + 1.
+    """
+    db = get_db()
+    if db.in_transaction:
+        raise RuntimeError("provision_spots() commits per chunk; commit the caller's changes first")
+    c = db.cursor()
+    chunk = max(1, Config.SPOT_PROVISION_CHUNK)
 
-    db.commit()
+    for start in range(first, last + 1, chunk):
+        end = min(start + chunk - 1, last)
+        c.execute("""
+            WITH RECURSIVE seq(n) AS (
+                SELECT ?
+                UNION ALL
+                SELECT n + 1 FROM seq WHERE n < ?
+            )
+            INSERT INTO parking_spots (lot_id, spot_number, status, level)
+            SELECT ?, n, 'A',
+                   CASE WHEN ? IS NULL THEN NULL
+                        ELSE CAST((n - 1) / ? + 1 AS TEXT) END
+            FROM seq;
+        """, (start, end, lot_id, spots_per_level, spots_per_level))
+        if end == last:
+            c.execute("UPDATE parking_lots SET number_of_spots = ? WHERE id = ?;",
+                      (last, lot_id))
+        db.commit()
 
-    cache_delete("admin:dashboard_summary")
-    cache_delete("admin:lots_summary")
-    cache_delete("user:parking_lots")
     db.close()
-    return lot_id
 
 
-def get_lot_summary():
+def create_parking_lot(name, address, pin_code, price, spot_count, spots_per_level=None):
+    """
+    Create a lot and its spots. The lot stays inactive until every spot
+    exists, so users never see a half-provisioned lot between chunks, and
+    counts no spots until provision_spots() sets number_of_spots with its
+    last chunk.
+    """
     db = get_db()
     c = db.cursor()
 
     c.execute("""
-        SELECT pl.id, pl.prime_location_name, pl.address, pl.pin_code,
-               pl.price_per_hour, pl.number_of_spots,
-               SUM(CASE WHEN ps.status = 'O' THEN 1 ELSE 0 END)
-        FROM parking_lots pl
-        LEFT JOIN parking_spots ps ON pl.id = ps.lot_id
-        WHERE pl.is_active = 1
-        GROUP BY pl.id
-        ORDER BY pl.prime_location_name;
-    """)
+        INSERT INTO parking_lots (prime_location_name, address, pin_code, price_per_hour,
+                                  number_of_spots, spots_per_level, is_active)
+        VALUES (?, ?, ?, ?, 0, ?, 0)
+    """, (name, address, pin_code, price, spots_per_level))
+
+    lot_id = c.lastrowid
+    db.commit()
+
+    provision_spots(lot_id, 1, spot_count, spots_per_level)
 
-    rows = c.fetchall()
+    c.execute("UPDATE parking_lots SET is_active = 1 WHERE id = ?", (lot_id,))
+    db.commit()
+
+    cache_invalidate(LOTS_CACHE)
     db.close()
+    return lot_id
+
+
+def _select_lot_summary(c, where="", parameters=()):
+    c.execute(f"""
+        SELECT id, prime_location_name, address, pin_code, price_per_hour,
+               number_of_spots, occupied_spots, is_active, version
+        FROM parking_lots
+        {where}
+        ORDER BY prime_location_name;
+    """, parameters)
 
     result = []
-    for r in rows:
+    for r in c.fetchall():
+        total = r[5] or 0
         occupied = r[6] or 0
         result.append({
             "id": r[0],
@@ -158,36 +122,305 @@ def get_lot_summary():
             "address": r[2],
             "pin_code": r[3],
             "price_per_hour": r[4],
-            "total_spots": r[5],
+            "total_spots": total,
             "occupied_spots": occupied,
-            "available_spots": r[5] - occupied
+            "available_spots": total - occupied,
+            "is_active": bool(r[7]),
+            "version": r[8],
         })
+    return result
+
 
+def get_lot_summary(include_inactive=False):
+    """
+    Per-lot occupancy, read straight from the parking_lots counters.
+
+    Only O(lots) rows are touched; parking_spots is never scanned.
+    """
+    db = get_db()
+    c = db.cursor()
+    result = _select_lot_summary(c, "" if include_inactive else "WHERE is_active = 1")
+    db.close()
     return result
 
 
-def find_first_available_spot(lot_id):
+def get_lot_snapshot(include_inactive=False, lot_ids=None):
+    """
+    (global lots version, lot summaries) from one read transaction, so
+    every change with a higher version committed after the snapshot.
+    lot_ids limits it to those lots (missing ones are simply absent).
+    """
     db = get_db()
     c = db.cursor()
 
-    c.execute("""
-        SELECT id, lot_id, spot_number, status
-        FROM parking_spots
-        WHERE lot_id = ? AND status = 'A'
-        ORDER BY spot_number ASC
-        LIMIT 1;
-    """, (lot_id,))
+    begin(db)
+    try:
+        c.execute("SELECT value FROM data_versions WHERE name = 'lots';")
+        version = c.fetchone()[0]
+
+        conditions, parameters = [], []
+        if not include_inactive:
+            conditions.append("is_active = 1")
+        if lot_ids is not None:
+            conditions.append(f"id IN ({', '.join('?' * len(lot_ids))})")
+            parameters.extend(lot_ids)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        lots = _select_lot_summary(c, where, parameters)
+    finally:
+        db.rollback()
+        db.close()
+
+    return version, lots
 
+
+def get_lots_version():
+    """Global lots version (data_versions('lots'))."""
+    db = get_db()
+    c = db.cursor()
+    c.execute("SELECT value FROM data_versions WHERE name = 'lots';")
+    version = c.fetchone()[0]
+    db.close()
+    return version
+
+
+def get_lot_version(lot_id):
+    """A lot's version, or None if it does not exist."""
+    db = get_db()
+    c = db.cursor()
+    c.execute("SELECT version FROM parking_lots WHERE id = ?;", (lot_id,))
     row = c.fetchone()
     db.close()
-    return row
+    return row[0] if row else None
 
 
-def mark_spot_status(spot_id, status):
+def get_lot_grid(lot_id):
+    """
+    (version, number_of_spots, occupied) for a lot, from one read
+    transaction, or None if the lot does not exist. occupied lists
+    (spot_number, username, parking_in) in spot order; only occupied
+    spots are read (idx_spot_occupied), never the whole lot.
+    """
     db = get_db()
     c = db.cursor()
 
-    c.execute("UPDATE parking_spots SET status = ? WHERE id = ?", (status, spot_id))
+    begin(db)
+    try:
+        c.execute("SELECT version, number_of_spots FROM parking_lots WHERE id = ?;", (lot_id,))
+        lot = c.fetchone()
+        if lot is None:
+            return None
+
+        c.execute("""
+            SELECT ps.spot_number, u.username, r.parking_in
+            FROM parking_spots ps
+            LEFT JOIN reservations r
+                ON r.spot_id = ps.id AND r.status = 'active'
+            LEFT JOIN users u
+                ON u.id = r.user_id
+            WHERE ps.lot_id = ? AND ps.status = 'O'
+            ORDER BY ps.spot_number;
+        """, (lot_id,))
+        occupied = [(r[0], r[1], r[2]) for r in c.fetchall()]
+    finally:
+        db.rollback()
+        db.close()
+
+    return lot[0], lot[1], occupied
+
+
+def get_spot_detail(lot_id, spot_number):
+    """One spot with its active reservation (if any), or None."""
+    db = get_db()
+    c = db.cursor()
+
+    c.execute("""
+        SELECT ps.id, ps.spot_number, ps.status, ps.level, ps.remarks,
+               r.id, r.parking_in, u.id, u.username, u.email, u.phone
+        FROM parking_spots ps
+        LEFT JOIN reservations r
+            ON r.spot_id = ps.id AND r.status = 'active'
+        LEFT JOIN users u
+            ON u.id = r.user_id
+        WHERE ps.lot_id = ? AND ps.spot_number = ?;
+    """, (lot_id, spot_number))
+    r = c.fetchone()
+    db.close()
+
+    if r is None:
+        return None
+
+    reservation = None
+    if r[5] is not None:
+        reservation = {
+            "id": r[5],
+            "start_time": r[6],
+            "user_id": r[7],
+            "username": r[8],
+            "email": r[9],
+            "phone": r[10],
+        }
+    return {
+        "id": r[0],
+        "spot_number": r[1],
+        "status": r[2],
+        "level": r[3],
+        "remarks": r[4],
+        "reservation": reservation,
+    }
+
+
+def get_dashboard_summary():
+    """Totals across all lots, from the parking_lots counters."""
+    db = get_db()
+    c = db.cursor()
+
+    c.execute("""
+        SELECT COUNT(*),
+               COALESCE(SUM(number_of_spots), 0),
+               COALESCE(SUM(occupied_spots), 0)
+        FROM parking_lots;
+    """)
+    total_lots, total_spots, occupied_spots = c.fetchone()
+    db.close()
+
+    return {
+        "total_lots": total_lots,
+        "total_spots": total_spots,
+        "occupied_spots": occupied_spots,
+        "available_spots": total_spots - occupied_spots,
+    }
+
+
+def check_occupancy_counters():
+    """
+    Compare parking_lots.occupied_spots against a full recount.
+
+    Returns a list of (lot_id, stored, actual) for every lot that disagrees.
+    """
+    db = get_db()
+    c = db.cursor()
+
+    c.execute("""
+        SELECT pl.id, pl.occupied_spots,
+               (SELECT COUNT(*) FROM parking_spots ps
+                WHERE ps.lot_id = pl.id AND ps.status = 'O')
+        FROM parking_lots pl;
+    """)
+
+    mismatches = [(r[0], r[1], r[2]) for r in c.fetchall() if r[1] != r[2]]
+    db.close()
+    return mismatches
+
+
+def rebuild_occupancy_counters():
+    """Recount occupied spots for every lot. Returns the number of lots fixed."""
+    db = get_db()
+    c = db.cursor()
+
+    c.execute("""
+        UPDATE parking_lots
+        SET occupied_spots = (
+            SELECT COUNT(*) FROM parking_spots ps
+            WHERE ps.lot_id = parking_lots.id AND ps.status = 'O'
+        )
+        WHERE occupied_spots IS NOT (
+            SELECT COUNT(*) FROM parking_spots ps
+            WHERE ps.lot_id = parking_lots.id AND ps.status = 'O'
+        );
+    """)
+    fixed = c.rowcount
 
     db.commit()
     db.close()
+    return fixed
+
+
+class ReservationError(Exception):
+    """A reservation could not be made; the message is safe to show users."""
+
+
+def allocate_spot(user_id, lot_id, parking_in):
+    """
+    Atomically claim the lowest free spot in a lot for a user.
+
+    Everything runs in one BEGIN IMMEDIATE transaction, so the checks that
+    the lot is active and the user has no active reservation, the spot
+    lookup (via idx_spot_free) and the claim cannot interleave with another
+    allocation. The UPDATE is also conditional on status = 'A' as a second
+    line of defence.
+
+    The result's "lot_versions" is the lot's (before, after) version around
+    the claim, for live.publish_lot_changes(); pop it before returning the
+    reservation to a client.
+    """
+    db = get_db()
+    c = db.cursor()
+
+    begin(db, immediate=True)
+
+    try:
+        c.execute("SELECT is_active, version FROM parking_lots WHERE id = ?;", (lot_id,))
+        lot = c.fetchone()
+        if not lot or not lot[0]:
+            # Missing, deactivated, or still being provisioned.
+            raise ReservationError("parking lot is not available")
+        version_before = lot[1]
+
+        c.execute("""
+            SELECT id FROM reservations
+            WHERE user_id = ? AND status = 'active'
+            LIMIT 1;
+        """, (user_id,))
+        if c.fetchone():
+            raise ReservationError("you already have an active reservation")
+
+        c.execute("""
+            SELECT id, spot_number
+            FROM parking_spots
+            WHERE lot_id = ? AND status = 'A'
+            ORDER BY spot_number ASC
+            LIMIT 1;
+        """, (lot_id,))
+        spot = c.fetchone()
+        if not spot:
+            raise ReservationError("no available spot in this lot")
+
+        spot_id, spot_number = spot[0], spot[1]
+
+        c.execute("""
+            UPDATE parking_spots
+            SET status = 'O'
+            WHERE id = ? AND status = 'A';
+        """, (spot_id,))
+        if c.rowcount != 1:
+            raise ReservationError("no available spot in this lot")
+
+        try:
+            c.execute("""
+                INSERT INTO reservations (user_id, lot_id, spot_id, parking_in, status)
+                VALUES (?, ?, ?, ?, 'active');
+            """, (user_id, lot_id, spot_id, parking_in))
+        except sqlite3.IntegrityError:
+            # idx_reservations_one_active_per_user
+            raise ReservationError("you already have an active reservation")
+        reservation_id = c.lastrowid
+
+        c.execute("SELECT version FROM parking_lots WHERE id = ?;", (lot_id,))
+        version_after = c.fetchone()[0]
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    return {
+        "id": reservation_id,
+        "lot_id": lot_id,
+        "spot_id": spot_id,
+        "spot_number": spot_number,
+        "parking_in": parking_in,
+        "status": "active",
+        "lot_versions": (version_before, version_after),
+    }
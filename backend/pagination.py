@@ -0,0 +1,71 @@
+import base64
+import json
+
+from flask import request
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class InvalidPage(ValueError):
+    """Bad limit or cursor in the query string; message is safe to return."""
+
+
+def encode_cursor(values):
+    """Opaque cursor for the sort key of the last row on a page."""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, shape):
+    """
+    Sort-key values from a cursor. shape gives the type of each value,
+    e.g. (str, int); a cursor of any other length or types is invalid.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except ValueError:
+        raise InvalidPage("invalid cursor")
+    if not isinstance(values, list) or len(values) != len(shape):
+        raise InvalidPage("invalid cursor")
+    for value, kind in zip(values, shape):
+        # bool is an int to isinstance(), but never a valid sort key here.
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise InvalidPage("invalid cursor")
+    return values
+
+
+def page_args(shape, default_limit=DEFAULT_LIMIT, max_limit=MAX_LIMIT):
+    """
+    Read ?limit=, ?cursor= and ?include_total= from the current request.
+    shape is the cursor's value types (see decode_cursor).
+
+    Returns (limit, cursor_values or None, include_total).
+    """
+    try:
+        limit = int(request.args.get("limit", default_limit))
+    except ValueError:
+        raise InvalidPage("limit must be integer")
+    if limit <= 0:
+        raise InvalidPage("limit must be positive")
+    limit = min(limit, max_limit)
+
+    cursor = request.args.get("cursor")
+    values = decode_cursor(cursor, shape) if cursor else None
+
+    include_total = request.args.get("include_total", "0").lower() in ("1", "true", "yes")
+    return limit, values, include_total
+
+
+def split_page(rows, limit, key):
+    """
+    Trim a LIMIT limit + 1 result to one page.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    key(row) gives the sort-key values to resume after.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
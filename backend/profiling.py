@@ -0,0 +1,272 @@
+# backend/profiling.py
+"""
+Slow-query log and on-demand request profiler.
+
+Slow queries: db.TimedCursor reports every statement that took longer
+than SLOW_QUERY_MS (execute plus fetches). Each one is logged on the
+"backend.profiling" logger and kept in a per-process ring buffer
+(GET /api/admin/slow-queries) with its SQL, the types of its parameters
+(never the values), the route or Celery task, and the application frame
+that ran it.
+
+Profiler: a request is run under cProfile when
+  - an admin sends it with "X-Profile: 1", or
+  - an admin armed the profiler for the next N requests (optionally only
+    paths under a prefix) with POST /api/admin/profiles/arm. The count
+    lives in Redis, so it is shared by all web processes.
+The dump is written to PROFILE_DIR as <id>.prof (pstats format: open it
+with snakeviz, or render a flame graph with flameprof), with <id>.json
+describing the request. The response carries X-Profile-Id. Only the
+newest PROFILE_KEEP dumps are kept.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+import redis
+from flask import g, has_request_context, request
+
+from backend.config import Config
+
+log = logging.getLogger(__name__)
+
+_redis = redis.Redis.from_url(Config.REDIS_URL)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+_SKIPPED_FILES = {os.path.join(BACKEND_DIR, name) for name in ("db.py", "profiling.py")}
+
+
+# ---------------------------------------------------------------------------
+# Slow-query log
+# ---------------------------------------------------------------------------
+
+_slow_queries = deque(maxlen=Config.SLOW_QUERY_LOG_SIZE)
+
+
+class ManyParameters:
+    """Parameters of an executemany(), summarised by row count and first row."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+
+def parameter_shape(parameters):
+    """Types of the bound values, e.g. ["int", "str"] or {"id": "int"}."""
+    if isinstance(parameters, ManyParameters):
+        rows = parameters.rows
+        return {"rows": len(rows), "first": parameter_shape(rows[0]) if rows else None}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+
+def call_site():
+    """file:line function of the innermost backend frame outside db.py."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(BACKEND_DIR) and filename not in _SKIPPED_FILES:
+            return (f"{os.path.relpath(filename, BACKEND_DIR)}:{frame.f_lineno} "
+                    f"{frame.f_code.co_name}")
+        frame = frame.f_back
+    return None
+
+
+def _caller():
+    if has_request_context():
+        rule = request.url_rule
+        return f"{request.method} {rule.rule if rule is not None else request.path}"
+
+    from celery import current_task
+    if current_task and current_task.request.id:
+        return f"task {current_task.name}"
+    return None
+
+
+def record_slow_query(sql, parameters, seconds, site):
+    entry = {
+        "at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "ms": round(seconds * 1000, 2),
+        "sql": " ".join(re.sub(r"--[^\n]*", "", sql).split()),
+        "params": parameter_shape(parameters),
+        "caller": _caller(),
+        "site": site,
+    }
+    _slow_queries.append(entry)
+    log.warning("slow query %.1f ms in %s at %s: %s params=%s",
+                entry["ms"], entry["caller"], site, entry["sql"], entry["params"])
+
+
+def recent_slow_queries():
+    """Slow queries seen by this process, newest first."""
+    return list(reversed(_slow_queries))
+
+
+# ---------------------------------------------------------------------------
+# Request profiler
+# ---------------------------------------------------------------------------
+
+_ARMED_KEY = "profiler:armed"
+_PROFILE_ID = re.compile(r"^\d{8}T\d{6}-[0-9a-f]{8}$")
+# Don't spend armed profiles on the admin browsing the results.
+_NEVER_PROFILED = "/api/admin/profiles"
+
+# Per-process view of the armed state, re-read from Redis at most once a second.
+_armed = {"checked": 0.0, "active": False, "prefix": ""}
+_armed_lock = threading.Lock()
+
+
+def arm_profiler(count, path_prefix=""):
+    """Profile the next `count` requests under path_prefix (0 disarms)."""
+    if count > 0:
+        pipe = _redis.pipeline()
+        pipe.hset(_ARMED_KEY, mapping={"remaining": count, "prefix": path_prefix})
+        pipe.expire(_ARMED_KEY, 3600)
+        pipe.execute()
+    else:
+        _redis.delete(_ARMED_KEY)
+    with _armed_lock:
+        _armed["checked"] = 0.0
+
+
+def _claim_armed(path):
+    now = time.monotonic()
+    with _armed_lock:
+        if now - _armed["checked"] >= 1.0:
+            _armed["checked"] = now
+            try:
+                state = _redis.hgetall(_ARMED_KEY)
+            except redis.RedisError:
+                state = {}
+            _armed["active"] = int(state.get(b"remaining", 0)) > 0
+            _armed["prefix"] = state.get(b"prefix", b"").decode()
+        active, prefix = _armed["active"], _armed["prefix"]
+
+    if not active or not path.startswith(prefix) or path.startswith(_NEVER_PROFILED):
+        return False
+    try:
+        remaining = _redis.hincrby(_ARMED_KEY, "remaining", -1)
+    except redis.RedisError:
+        return False
+    if remaining < 0:
+        with _armed_lock:
+            _armed["active"] = False
+        return False
+    return True
+
+
+def _wants_profile():
+    if request.headers.get("X-Profile") == "1":
+        user = g.get("current_user")
+        if user and user.get("role") == "admin":
+            return True
+    return _claim_armed(request.path)
+
+
+def _start_profile():
+    if not _wants_profile():
+        return
+    g.profile_started = time.perf_counter()
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+
+def _stop_profile(response):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        response.headers["X-Profile-Id"] = _save_profile(profiler, response.status_code)
+    return response
+
+
+def _stop_failed_profile(exc=None):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        _save_profile(profiler, 500)
+
+
+def _save_profile(profiler, status):
+    os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    profile_id = f"{now:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+    base = os.path.join(Config.PROFILE_DIR, profile_id)
+
+    profiler.dump_stats(base + ".prof")
+    user = g.get("current_user") or {}
+    rule = request.url_rule
+    meta = {
+        "id": profile_id,
+        "created_at": now.isoformat(timespec="seconds"),
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "route": rule.rule if rule is not None else None,
+        "status": status,
+        "user": user.get("username"),
+        "ms": round((time.perf_counter() - g.pop("profile_started")) * 1000, 2),
+    }
+    with open(base + ".json", "w") as f:
+        json.dump(meta, f)
+
+    _prune_profiles()
+    return profile_id
+
+
+def _prune_profiles():
+    for meta in list_profiles()[Config.PROFILE_KEEP:]:
+        for ext in (".prof", ".json"):
+            try:
+                os.remove(os.path.join(Config.PROFILE_DIR, meta["id"] + ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    """Metadata of the stored dumps, newest first."""
+    try:
+        names = os.listdir(Config.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+
+    profiles = []
+    for name in sorted(names, reverse=True):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(Config.PROFILE_DIR, name)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # being written or pruned by another process
+    return profiles
+
+
+def profile_path(profile_id):
+    """Path of a dump's .prof file, or None for an unknown/invalid id."""
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(Config.PROFILE_DIR, profile_id + ".prof")
+    return path if os.path.exists(path) else None
+
+
+def profile_text(path, limit=40):
+    """pstats report of a dump, by cumulative time."""
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+def init_app(app):
+    """Register after the blueprints, so g.current_user is already loaded."""
+    app.before_request(_start_profile)
+    app.after_request(_stop_profile)
+    app.teardown_request(_stop_failed_profile)
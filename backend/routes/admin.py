@@ -1,12 +1,25 @@
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, Response, request, jsonify, g, send_file
 from functools import wraps
 
 from backend.db import get_db
-from backend.models import create_parking_lot, get_lot_summary
-from backend.cache import cache_get, cache_set, cache_delete
-
+from backend.grid import ENCODINGS, lot_grid
+from backend.models import (
+    create_parking_lot, get_dashboard_summary, get_lot_summary, get_spot_detail,
+    provision_spots,
+)
+from backend.cache import cache_invalidate, cache_stats, json_response, LOTS_CACHE
+from backend.live import event_stream, publish_lot_changes, resume_version
+from backend.metrics import render_metrics
+from backend.pagination import InvalidPage, page_args, split_page
+from backend.profiling import (
+    arm_profiler, list_profiles, profile_path, profile_text, recent_slow_queries,
+)
+
+from backend.routes.auth import invalidate_user_cache
+from backend.versions import lot_etag, lots_etag, version_etag
+from backend.tasks.monitoring import queue_stats
 from backend.tasks.reminders import daily_user_reminder
-from backend.tasks.reports import monthly_report
+from backend.tasks.reports import monthly_report, parse_month
 
 admin_bp = Blueprint("admin", __name__)
 
@@ -23,58 +36,33 @@ def admin_required(view):
 
 @admin_bp.get("/parking-lots/summary")
 @admin_required
+@version_etag(lots_etag("admin-lots-summary"))
 def lots_summary():
-    cache_key = "admin:lots_summary"
-    cached = cache_get(cache_key)
-    if cached:
-        return jsonify({"lots": cached})
-
-    db = get_db()
-    c = db.cursor()
-
-    c.execute("""
-    SELECT 
-        pl.id,
-        pl.prime_location_name,
-        pl.address,
-        pl.pin_code,
-        pl.price_per_hour,
-        pl.number_of_spots,
-        SUM(CASE WHEN ps.status = 'O' THEN 1 ELSE 0 END) AS occupied_spots
-    FROM parking_lots pl
-    LEFT JOIN parking_spots ps ON pl.id = ps.lot_id
-    GROUP BY pl.id
-    ORDER BY pl.prime_location_name;
-""")
-
-
-    rows = c.fetchall()
-    db.close()
-
-    lots = []
-    for r in rows:
-        occupied = r[6] or 0
-        total = r[5] or 0
-        lots.append({
-            "id": r[0],
-            "prime_location_name": r[1],
-            "address": r[2],
-            "pin_code": r[3],
-            "price_per_hour": r[4],
-            "total_spots": r[5],
-            "occupied_spots": r[6] or 0,
-            "available_spots": (r[5] - (r[6] or 0)),
-        })
-
-    # cache for 30 seconds
-    cache_set(cache_key, lots, ttl=30)
-
-    return jsonify({"lots": lots})
-
+    # one entry that records its lots version; fresh for 30 seconds or until
+    # the version moves, then served stale while one worker refreshes
+    return json_response(
+        "admin:lots_summary",
+        lambda: {"lots": get_lot_summary(include_inactive=True)},
+        ttl=30,
+        namespace=LOTS_CACHE,
+        version=g.lots_version,
+    )
+
+
+@admin_bp.get("/parking-lots/events")
+@admin_required
+def lot_events():
+    """Like the user stream, including inactive lots and their details."""
+    try:
+        since = resume_version()
+    except ValueError:
+        return jsonify({"error": "invalid resume version"}), 400
+    return event_stream(include_inactive=True, since=since)
 
 
 @admin_bp.get("/parking-lots")
 @admin_required
+@version_etag(lots_etag("admin-lots"))
 def list_parking_lots():
     db = get_db()
     c = db.cursor()
@@ -114,6 +102,7 @@ def create_lot():
     pin_code = payload.get("pin_code")
     price = payload.get("price_per_hour")
     spot_count = payload.get("number_of_spots")
+    spots_per_level = payload.get("spots_per_level")
 
     if not name or price is None or spot_count is None:
         return jsonify({"error": "prime_location_name, price_per_hour and number_of_spots are required"}), 400
@@ -121,13 +110,19 @@ def create_lot():
     try:
         price = float(price)
         spot_count = int(spot_count)
+        if spots_per_level is not None:
+            spots_per_level = int(spots_per_level)
     except ValueError:
         return jsonify({"error": "price_per_hour must be number and number_of_spots must be integer"}), 400
 
     if spot_count <= 0 or price < 0:
         return jsonify({"error": "invalid values for price_per_hour or number_of_spots"}), 400
 
-    lot_id = create_parking_lot(name, address, pin_code, price, spot_count)
+    if spots_per_level is not None and spots_per_level <= 0:
+        return jsonify({"error": "spots_per_level must be a positive integer"}), 400
+
+    lot_id = create_parking_lot(name, address, pin_code, price, spot_count, spots_per_level)
+    publish_lot_changes(lot_id, details=True)
 
     return jsonify({"id": lot_id, "message": "parking lot created"}), 201
 
@@ -143,11 +138,19 @@ def update_lot(lot_id):
     new_spots = data.get("number_of_spots")
     new_active = data.get("is_active")
 
+    try:
+        new_spots = int(new_spots)
+    except (TypeError, ValueError):
+        return jsonify({"error": "number_of_spots must be integer"}), 400
+
+    if new_spots <= 0:
+        return jsonify({"error": "invalid values for price_per_hour or number_of_spots"}), 400
+
     db = get_db()
     c = db.cursor()
 
     c.execute("""
-        SELECT number_of_spots FROM parking_lots
+        SELECT number_of_spots, spots_per_level FROM parking_lots
         WHERE id = ?
     """, (lot_id,))
     row = c.fetchone()
@@ -156,8 +159,10 @@ def update_lot(lot_id):
         db.close()
         return jsonify({"error": "lot not found"}), 404
 
-    current_spots = row[0]
+    current_spots, spots_per_level = row[0], row[1]
 
+    # A growing lot keeps its old total until provision_spots() has
+    # inserted the new spots; it sets the new total with the last chunk.
     c.execute("""
         UPDATE parking_lots
         SET prime_location_name = ?, address = ?, pin_code = ?, 
@@ -165,15 +170,12 @@ def update_lot(lot_id):
         WHERE id = ?
     """, (
         new_name, new_address, new_pin, new_price,
-        new_spots, new_active, lot_id
+        min(new_spots, current_spots), new_active, lot_id
     ))
 
     if new_spots > current_spots:
-        for i in range(current_spots + 1, new_spots + 1):
-            c.execute("""
-                INSERT INTO parking_spots (lot_id, spot_number, status)
-                VALUES (?, ?, 'A')
-            """, (lot_id, i))
+        db.commit()
+        provision_spots(lot_id, current_spots + 1, new_spots, spots_per_level)
 
     if new_spots < current_spots:
         c.execute("""
@@ -195,10 +197,9 @@ def update_lot(lot_id):
         """, (lot_id, new_spots))
 
     db.commit()
-    cache_delete("admin:dashboard_summary")
-    cache_delete("admin:lots_summary")
-    cache_delete("user:parking_lots")
+    cache_invalidate(LOTS_CACHE)
     db.close()
+    publish_lot_changes(lot_id, details=True)
 
     return jsonify({"message": "lot updated", "lot_id": lot_id})
 
@@ -223,17 +224,38 @@ def delete_lot(lot_id):
     c.execute("DELETE FROM parking_lots WHERE id = ?;", (lot_id,))
 
     db.commit()
-    cache_delete("admin:dashboard_summary")
-    cache_delete("admin:lots_summary")
-    cache_delete("user:parking_lots")
+    cache_invalidate(LOTS_CACHE)
     db.close()
+    publish_lot_changes(lot_id)
 
     return jsonify({"message": "parking lot removed"})
 
 
 @admin_bp.get("/parking-lots/<int:lot_id>/spots")
 @admin_required
+@version_etag(lot_etag("lot-spots"))
 def lot_spots(lot_id):
+    """
+    Spots in spot_number order, keyset-paginated on spot_number.
+
+    ?format=grid returns the whole lot compactly instead (grid.py):
+    occupied ranges (or a bitmap with &encoding=bitmap) plus details of
+    the occupied spots only.
+    """
+    if request.args.get("format") == "grid":
+        encoding = request.args.get("encoding", "rle")
+        if encoding not in ENCODINGS:
+            return jsonify({"error": "encoding must be rle or bitmap"}), 400
+        grid = lot_grid(lot_id, encoding)
+        if grid is None:
+            return jsonify({"error": "lot not found"}), 404
+        return jsonify(grid)
+
+    try:
+        limit, after, include_total = page_args((int,), default_limit=200, max_limit=2000)
+    except InvalidPage as e:
+        return jsonify({"error": str(e)}), 400
+
     db = get_db()
     c = db.cursor()
     c.execute("""
@@ -252,11 +274,19 @@ def lot_spots(lot_id):
         LEFT JOIN users u
             ON r.user_id = u.id
 
-        WHERE ps.lot_id = ?
-        ORDER BY ps.spot_number;
-    """, (lot_id,))
+        WHERE ps.lot_id = ? AND ps.spot_number > ?
+        ORDER BY ps.spot_number
+        LIMIT ?;
+    """, (lot_id, after[0] if after else 0, limit + 1))
+
+    rows, next_cursor = split_page(c.fetchall(), limit, lambda r: [r[1]])
+
+    total = None
+    if include_total:
+        c.execute("SELECT number_of_spots FROM parking_lots WHERE id = ?;", (lot_id,))
+        row = c.fetchone()
+        total = row[0] if row else 0
 
-    rows = c.fetchall()
     db.close()
 
     spots = []
@@ -269,23 +299,51 @@ def lot_spots(lot_id):
             "start_time": r[4] or None,
         })
 
-    return jsonify({"spots": spots})
+    result = {"spots": spots, "next_cursor": next_cursor}
+    if include_total:
+        result["total"] = total
+    return jsonify(result)
+
+
+@admin_bp.get("/parking-lots/<int:lot_id>/spots/<int:spot_number>")
+@admin_required
+def spot_detail(lot_id, spot_number):
+    """Full detail of one spot, including who holds it."""
+    spot = get_spot_detail(lot_id, spot_number)
+    if spot is None:
+        return jsonify({"error": "spot not found"}), 404
+    return jsonify(spot)
 
 
 
 @admin_bp.get("/users")
 @admin_required
 def list_users():
+    """Users by username, keyset-paginated on username (unique)."""
+    try:
+        limit, after, include_total = page_args((str,))
+    except InvalidPage as e:
+        return jsonify({"error": str(e)}), 400
+
     db = get_db()
     c = db.cursor()
 
-    c.execute("""
+    keyset = "WHERE username > ?" if after else ""
+    c.execute(f"""
         SELECT id, username, email, phone, role, is_active
         FROM users
-        ORDER BY username;
-    """)
+        {keyset}
+        ORDER BY username
+        LIMIT ?;
+    """, (*(after or ()), limit + 1))
+
+    rows, next_cursor = split_page(c.fetchall(), limit, lambda r: [r[1]])
+
+    total = None
+    if include_total:
+        c.execute("SELECT value FROM row_counts WHERE name = 'users';")
+        total = c.fetchone()[0]
 
-    rows = c.fetchall()
     db.close()
 
     users = []
@@ -299,43 +357,114 @@ def list_users():
             "is_active": bool(r[5]),
         })
 
-    return jsonify({"users": users})
+    result = {"users": users, "next_cursor": next_cursor}
+    if include_total:
+        result["total"] = total
+    return jsonify(result)
 
 
-@admin_bp.get("/dashboard-summary")
+@admin_bp.put("/users/<int:user_id>")
 @admin_required
-def dashboard_summary():
-    cache_key = "admin:dashboard_summary"
-    cached = cache_get(cache_key)
-    if cached:
-        return jsonify(cached)
+def update_user(user_id):
+    data = request.get_json(force=True) or {}
+
+    fields = {}
+    for name in ("email", "phone"):
+        if name in data:
+            fields[name] = (data[name] or "").strip()
+    if "is_active" in data:
+        fields["is_active"] = 1 if data["is_active"] else 0
+
+    if not fields:
+        return jsonify({"error": "nothing to update"}), 400
 
     db = get_db()
     c = db.cursor()
 
-    c.execute("SELECT COUNT(*) FROM parking_lots;")
-    total_lots = c.fetchone()[0]
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    c.execute(
+        f"UPDATE users SET {assignments} WHERE id = ?;",
+        (*fields.values(), user_id),
+    )
 
-    c.execute("SELECT COUNT(*) FROM parking_spots;")
-    total_spots = c.fetchone()[0]
+    if c.rowcount == 0:
+        db.close()
+        return jsonify({"error": "user not found"}), 404
 
-    c.execute("SELECT COUNT(*) FROM parking_spots WHERE status = 'O';")
-    occupied_spots = c.fetchone()[0]
+    db.commit()
+    db.close()
+    invalidate_user_cache(user_id)
 
-    available_spots = total_spots - occupied_spots
+    return jsonify({"message": "user updated", "user_id": user_id})
+
+
+@admin_bp.get("/dashboard-summary")
+@admin_required
+def dashboard_summary():
+    return json_response(
+        "admin:dashboard_summary", get_dashboard_summary, ttl=30, namespace=LOTS_CACHE
+    )
 
-    db.close()
 
-    summary = {
-        "total_lots": total_lots,
-        "total_spots": total_spots,
-        "occupied_spots": occupied_spots,
-        "available_spots": available_spots,
-    }
+@admin_bp.get("/cache-stats")
+@admin_required
+def get_cache_stats():
+    return jsonify(cache_stats())
+
+
+@admin_bp.get("/queue-stats")
+@admin_required
+def get_queue_stats():
+    return jsonify(queue_stats())
+
 
-    cache_set(cache_key, summary, ttl=30)
+@admin_bp.get("/metrics")
+@admin_required
+def get_metrics():
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
-    return jsonify(summary)
+
+@admin_bp.get("/slow-queries")
+@admin_required
+def get_slow_queries():
+    return jsonify(recent_slow_queries())
+
+
+@admin_bp.get("/profiles")
+@admin_required
+def get_profiles():
+    return jsonify(list_profiles())
+
+
+@admin_bp.post("/profiles/arm")
+@admin_required
+def arm_profiles():
+    """Profile the next `count` requests, optionally only under `path_prefix`."""
+    data = request.get_json(silent=True) or {}
+    try:
+        count = int(data.get("count", 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "count must be an integer"}), 400
+    if not 0 <= count <= 1000:
+        return jsonify({"error": "count must be between 0 and 1000"}), 400
+
+    path_prefix = data.get("path_prefix") or ""
+    arm_profiler(count, path_prefix)
+    return jsonify({"armed": count, "path_prefix": path_prefix})
+
+
+@admin_bp.get("/profiles/<profile_id>")
+@admin_required
+def download_profile(profile_id):
+    """The .prof dump, or ?format=text for a pstats report."""
+    path = profile_path(profile_id)
+    if path is None:
+        return jsonify({"error": "profile not found"}), 404
+
+    if request.args.get("format") == "text":
+        return Response(profile_text(path), content_type="text/plain; charset=utf-8")
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True,
+                     download_name=f"{profile_id}.prof")
 
 
 @admin_bp.post("/debug/daily-reminder")
@@ -348,5 +477,13 @@ def run_daily_reminder():
 @admin_bp.post("/debug/monthly-report")
 @admin_required
 def run_monthly_report():
-    monthly_report.delay()
-    return jsonify({"status": "queued"}), 202
+    data = request.get_json(silent=True) or {}
+    month = data.get("month")
+    if month is not None:
+        try:
+            parse_month(month)
+        except (TypeError, ValueError):
+            return jsonify({"error": "month must be YYYY-MM"}), 400
+
+    monthly_report.delay(month)
+    return jsonify({"status": "queued", "month": month}), 202
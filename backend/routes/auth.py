@@ -1,6 +1,9 @@
+import redis
 from flask import Blueprint, request, jsonify, session, g
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from backend.cache import cache_delete, cache_fill, cache_get, cache_invalidate, USERS_CACHE
+from backend.config import Config
 from backend.db import get_db
 
 auth_bp = Blueprint("auth", __name__)
@@ -32,6 +35,39 @@ def load_user(user_id):
     }
 
 
+def load_user_cached(user_id):
+    """
+    load_user() behind the two-tier cache, so the common request path
+    resolves the session user without touching SQLite. Anything that edits
+    or deactivates a user must call invalidate_user_cache(). When Redis is
+    unavailable the user is read from SQLite, as without the cache.
+    """
+    if Config.USER_CACHE_TTL <= 0:
+        return load_user(user_id)
+
+    key = f"auth:user:{user_id}"
+    try:
+        user = cache_get(key, namespace=USERS_CACHE)
+        if user is not None:
+            return user
+        # Not stored if the user is edited while it is being read.
+        return cache_fill(key, lambda: load_user(user_id),
+                          ttl=Config.USER_CACHE_TTL, namespace=USERS_CACHE)
+    except redis.RedisError:
+        return load_user(user_id)
+
+
+def invalidate_user_cache(user_id=None):
+    """
+    Forget one user's cached entry, so only that user's next request reads
+    SQLite. Without user_id (bulk changes) every cached user is dropped.
+    """
+    if user_id is None:
+        cache_invalidate(USERS_CACHE)
+    else:
+        cache_delete(f"auth:user:{user_id}", namespace=USERS_CACHE)
+
+
 @auth_bp.before_app_request
 def attach_current_user():
     user_id = session.get("user_id")
@@ -39,7 +75,7 @@ def attach_current_user():
         g.current_user = None
         return
 
-    user = load_user(user_id)
+    user = load_user_cached(user_id)
     g.current_user = user
 
 
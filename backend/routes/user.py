@@ -1,11 +1,16 @@
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, Response, request, jsonify, g, send_file, stream_with_context
 from functools import wraps
 from datetime import datetime
+import os
 
-from backend.db import get_db
-from backend.models import find_first_available_spot
-from backend.tasks.export import generate_csv
-from backend.cache import cache_get, cache_set
+from backend.config import Config
+from backend.db import begin, get_db
+from backend.models import allocate_spot, get_lot_summary, ReservationError
+from backend.tasks.export import generate_csv, iter_csv_chunks, latest_ready_export
+from backend.cache import json_response, LOTS_CACHE
+from backend.live import event_stream, publish_lot_changes, resume_version
+from backend.pagination import InvalidPage, page_args, split_page
+from backend.versions import lots_etag, version_etag
 
 user_bp = Blueprint("user", __name__)
 
@@ -21,47 +26,28 @@ def user_required(view):
 
 @user_bp.get("/parking-lots")
 @user_required
+@version_etag(lots_etag("user-lots"))
 def list_lots_for_user():
-    cache_key = "user:parking_lots"
-    cached = cache_get(cache_key)
-    if cached:
-        return jsonify({"lots": cached})
-
-    db = get_db()
-    c = db.cursor()
-
-    c.execute("""
-        SELECT pl.id, pl.prime_location_name, pl.address, pl.pin_code,
-               pl.price_per_hour, pl.number_of_spots,
-               SUM(CASE WHEN ps.status = 'O' THEN 1 ELSE 0 END)
-        FROM parking_lots pl
-        LEFT JOIN parking_spots ps ON pl.id = ps.lot_id
-        WHERE pl.is_active = 1
-        GROUP BY pl.id
-        ORDER BY pl.prime_location_name;
-    """)
-
-    rows = c.fetchall()
-    db.close()
-
-    lots = []
-    for r in rows:
-        occupied = r[6] or 0
-        total = r[5] or 0
-        lots.append({
-            "id": r[0],
-            "prime_location_name": r[1],
-            "address": r[2],
-            "pin_code": r[3],
-            "price_per_hour": r[4],
-            "total_spots": total,
-            "occupied_spots": occupied,
-            "available_spots": total - occupied,
-        })
-
-    cache_set(cache_key, lots, ttl=20)
-
-    return jsonify({"lots": lots})
+    # one entry that records its lots version; after a change one worker
+    # recomputes while the others serve the previous body (without the new ETag)
+    return json_response(
+        "user:parking_lots",
+        lambda: {"lots": get_lot_summary()},
+        ttl=20,
+        namespace=LOTS_CACHE,
+        version=g.lots_version,
+    )
+
+
+@user_bp.get("/parking-lots/events")
+@user_required
+def lot_events():
+    """Server-sent events: a snapshot (or the missed events), then deltas."""
+    try:
+        since = resume_version()
+    except ValueError:
+        return jsonify({"error": "invalid resume version"}), 400
+    return event_stream(include_inactive=False, since=since)
 
 
 @user_bp.post("/reservations")
@@ -79,51 +65,17 @@ def create_reservation():
     except ValueError:
         return jsonify({"error": "lot_id must be integer"}), 400
 
-    db = get_db()
-    c = db.cursor()
-
-    c.execute("""
-        SELECT id FROM reservations
-        WHERE user_id = ? AND status = 'active'
-        LIMIT 1;
-    """, (user["id"],))
-    existing = c.fetchone()
-    if existing:
-        db.close()
-        return jsonify({"error": "you already have an active reservation"}), 400
-
-    spot_row = find_first_available_spot(lot_id)
-    if not spot_row:
-        db.close()
-        return jsonify({"error": "no available spot in this lot"}), 400
-
-    spot_id, _, spot_number, _ = spot_row
     now = datetime.utcnow().isoformat()
 
-    c.execute("""
-        INSERT INTO reservations (user_id, lot_id, spot_id, parking_in, status)
-        VALUES (?, ?, ?, ?, 'active');
-    """, (user["id"], lot_id, spot_id, now))
-
-    reservation_id = c.lastrowid
-
-    c.execute("""
-        UPDATE parking_spots
-        SET status = 'O'
-        WHERE id = ?;
-    """, (spot_id,))
+    try:
+        reservation = allocate_spot(user["id"], lot_id, now)
+    except ReservationError as e:
+        return jsonify({"error": str(e)}), 400
 
-    db.commit()
-    db.close()
-
-    return jsonify({
-        "id": reservation_id,
-        "lot_id": lot_id,
-        "spot_id": spot_id,
-        "spot_number": spot_number,
-        "parking_in": now,
-        "status": "active",
-    }), 201
+    versions = reservation.pop("lot_versions")
+    publish_lot_changes(lot_id, spots={reservation["spot_number"]: (user["username"], now)},
+                        versions=versions)
+    return jsonify(reservation), 201
 
 
 @user_bp.put("/reservations/<int:reservation_id>/release")
@@ -133,10 +85,15 @@ def release_reservation(reservation_id):
     db = get_db()
     c = db.cursor()
 
+    # One write transaction from the lookup on, so the reservation is
+    # released once and the lot versions read here bracket this change.
+    begin(db, immediate=True)
     c.execute("""
-        SELECT r.id, r.spot_id, r.parking_in, pl.price_per_hour
+        SELECT r.id, r.spot_id, r.lot_id, r.parking_in, pl.price_per_hour, ps.spot_number,
+               pl.version
         FROM reservations r
         JOIN parking_lots pl ON r.lot_id = pl.id
+        JOIN parking_spots ps ON r.spot_id = ps.id
         WHERE r.id = ? AND r.user_id = ? AND r.status = 'active';
     """, (reservation_id, user["id"]))
 
@@ -145,7 +102,7 @@ def release_reservation(reservation_id):
         db.close()
         return jsonify({"error": "active reservation not found"}), 404
 
-    res_id, spot_id, parking_in_str, price_per_hour = row
+    res_id, spot_id, lot_id, parking_in_str, price_per_hour, spot_number, version_before = row
 
     try:
         start_time = datetime.fromisoformat(parking_in_str)
@@ -172,8 +129,13 @@ def release_reservation(reservation_id):
         WHERE id = ?;
     """, (spot_id,))
 
+    c.execute("SELECT version FROM parking_lots WHERE id = ?;", (lot_id,))
+    version_after = c.fetchone()[0]
+
     db.commit()
     db.close()
+    publish_lot_changes(lot_id, spots={spot_number: None},
+                        versions=(version_before, version_after))
 
     return jsonify({
         "id": res_id,
@@ -197,7 +159,6 @@ def current_reservation():
         JOIN parking_lots pl ON r.lot_id = pl.id
         JOIN parking_spots ps ON r.spot_id = ps.id
         WHERE r.user_id = ? AND r.status = 'active'
-        ORDER BY r.parking_in DESC
         LIMIT 1;
     """, (user["id"],))
 
@@ -223,21 +184,36 @@ def current_reservation():
 @user_bp.get("/reservations/history")
 @user_required
 def reservation_history():
+    """Newest first, keyset-paginated on (parking_in, id)."""
     user = g.current_user
+
+    try:
+        limit, after, include_total = page_args((str, int))
+    except InvalidPage as e:
+        return jsonify({"error": str(e)}), 400
+
     db = get_db()
     c = db.cursor()
 
-    c.execute("""
+    keyset = "AND (r.parking_in, r.id) < (?, ?)" if after else ""
+    c.execute(f"""
         SELECT r.id, pl.prime_location_name, ps.spot_number,
                r.parking_in, r.parking_out, r.parking_cost, r.status
         FROM reservations r
         JOIN parking_lots pl ON r.lot_id = pl.id
         JOIN parking_spots ps ON r.spot_id = ps.id
-        WHERE r.user_id = ?
-        ORDER BY r.parking_in DESC;
-    """, (user["id"],))
+        WHERE r.user_id = ? {keyset}
+        ORDER BY r.parking_in DESC, r.id DESC
+        LIMIT ?;
+    """, (user["id"], *(after or ()), limit + 1))
+
+    rows, next_cursor = split_page(c.fetchall(), limit, lambda r: [r[3], r[0]])
+
+    total = None
+    if include_total:
+        c.execute("SELECT reservation_count FROM users WHERE id = ?;", (user["id"],))
+        total = c.fetchone()[0]
 
-    rows = c.fetchall()
     db.close()
 
     items = []
@@ -252,28 +228,189 @@ def reservation_history():
             "status": r[6],
         })
 
-    return jsonify({"reservations": items})
+    result = {"reservations": items, "next_cursor": next_cursor}
+    if include_total:
+        result["total"] = total
+    return jsonify(result)
+
+
+@user_bp.get("/reports")
+@user_required
+def monthly_reports():
+    """Stored monthly report figures, newest month first."""
+    db = get_db()
+    c = db.cursor()
+    c.execute("""
+        SELECT month, visits, total_spent, most_used_lot_name, generated_at
+        FROM monthly_reports
+        WHERE user_id = ?
+        ORDER BY month DESC;
+    """, (g.current_user["id"],))
+    rows = c.fetchall()
+    db.close()
+
+    return jsonify([
+        {
+            "month": r[0],
+            "visits": r[1],
+            "total_spent": r[2],
+            "most_used_lot": r[3],
+            "generated_at": r[4],
+        }
+        for r in rows
+    ])
 
 @user_bp.post("/export-csv")
 @user_required
 def export_csv():
+    """
+    Queue a CSV export, unless an identical one makes that unnecessary:
+    - an export of the same format is already pending/running: join it;
+    - the last finished export already covers the current data version:
+      return it as-is (200, no job).
+    Otherwise the new job only appends what changed since the last export.
+    """
     user = g.current_user
+    data = request.get_json(silent=True) or {}
+    compress = bool(data.get("gzip"))
 
     db = get_db()
     c = db.cursor()
 
+    begin(db, immediate=True)
+
     c.execute("""
-        INSERT INTO exports (user_id, status, created_at)
-        VALUES (?, 'pending', datetime('now'));
-    """, (user["id"],))
+        SELECT id, status FROM exports
+        WHERE user_id = ? AND compressed = ?
+          AND status IN ('pending', 'running')
+          AND created_at >= datetime('now', ?)
+        ORDER BY id DESC
+        LIMIT 1;
+    """, (user["id"], int(compress), f"-{Config.EXPORT_COALESCE_SECONDS} seconds"))
+    in_flight = c.fetchone()
+    if in_flight:
+        db.rollback()
+        db.close()
+        return jsonify({"export_id": in_flight[0], "status": "processing"}), 202
+
+    c.execute("SELECT reservation_version FROM users WHERE id = ?;", (user["id"],))
+    data_version = c.fetchone()[0]
+    latest = latest_ready_export(c, user["id"], compress)
+    if latest and latest[2] == data_version:
+        db.rollback()
+        db.close()
+        return jsonify({"export_id": latest[0], "status": "ready"}), 200
+
+    c.execute("""
+        INSERT INTO exports (user_id, status, created_at, compressed)
+        VALUES (?, 'pending', datetime('now'), ?);
+    """, (user["id"], int(compress)))
 
     export_id = c.lastrowid
     db.commit()
     db.close()
 
-    generate_csv.delay(export_id, user["id"])
+    generate_csv.delay(export_id, user["id"], compress)
 
     return jsonify({
         "export_id": export_id,
         "status": "processing"
     }), 202
+
+
+@user_bp.get("/exports/<int:export_id>")
+@user_required
+def export_status(export_id):
+    user = g.current_user
+    db = get_db()
+    c = db.cursor()
+
+    c.execute("""
+        SELECT id, status, rows_written, created_at, completed_at, error
+        FROM exports
+        WHERE id = ? AND user_id = ?;
+    """, (export_id, user["id"]))
+
+    row = c.fetchone()
+    db.close()
+
+    if not row:
+        return jsonify({"error": "export not found"}), 404
+
+    return jsonify({
+        "export_id": row[0],
+        "status": row[1],
+        "rows_written": row[2],
+        "created_at": row[3],
+        "completed_at": row[4],
+        "error": row[5],
+    })
+
+
+@user_bp.get("/exports/<int:export_id>/download")
+@user_required
+def download_export(export_id):
+    user = g.current_user
+    db = get_db()
+    c = db.cursor()
+
+    c.execute("""
+        SELECT status, file_path FROM exports
+        WHERE id = ? AND user_id = ?;
+    """, (export_id, user["id"]))
+
+    row = c.fetchone()
+    db.close()
+
+    if not row:
+        return jsonify({"error": "export not found"}), 404
+
+    status, file_path = row
+    if status == "superseded":
+        return jsonify({"error": "export was replaced by a newer one"}), 410
+    if status != "ready" or not file_path or not os.path.exists(file_path):
+        return jsonify({"error": "export is not ready"}), 409
+
+    # send_file streams from disk in blocks; the file is never read whole.
+    return send_file(
+        file_path,
+        mimetype="application/gzip" if file_path.endswith(".gz") else "text/csv",
+        as_attachment=True,
+        download_name=os.path.basename(file_path),
+    )
+
+
+@user_bp.get("/export-csv/stream")
+@user_required
+def stream_csv():
+    """
+    Stream the CSV straight from the DB cursor, without a Celery job or a
+    file on disk. Memory stays at one fetchmany batch.
+
+    Only for small histories (EXPORT_STREAM_MAX_ROWS): the stream holds a
+    pooled connection and a read transaction until the client has it all,
+    so a few slow downloads of large histories would exhaust the pool and
+    hold back WAL checkpoints. Larger ones get 409 and use POST /export-csv.
+    """
+    user = g.current_user
+
+    db = get_db()
+    c = db.cursor()
+    c.execute("SELECT reservation_count FROM users WHERE id = ?;", (user["id"],))
+    row = c.fetchone()
+    db.close()
+    if row and row[0] > Config.EXPORT_STREAM_MAX_ROWS:
+        return jsonify({"error": "history too large to stream, use POST /api/user/export-csv"}), 409
+
+    def generate():
+        db = get_db()
+        try:
+            yield from iter_csv_chunks(db.cursor(), user["id"])
+        finally:
+            db.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=parking_history.csv"},
+    )
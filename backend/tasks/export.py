@@ -1,41 +1,233 @@
 from backend.celery_app import celery
+from backend.config import Config
 from backend.db import get_db
 import csv
+import gzip
+import io
+import logging
 import os
 
+log = logging.getLogger(__name__)
 
-@celery.task(name="backend.tasks.export.generate_csv")
-def generate_csv(export_id, user_id):
-    """
-    Celery task that generates a CSV file of all reservations
-    for a given user and returns the file path.
+EXPORT_HEADER = ["ID", "Lot", "Spot", "Start", "End", "Cost", "Status"]
+
+
+def iter_export_rows(c, user_id, after_id=0):
     """
-    db = get_db()
-    c = db.cursor()
+    Yield batches of a user's reservations (in id order) for CSV export.
 
+    Uses fetchmany so only EXPORT_BATCH_SIZE rows are in memory at once,
+    however long the user's history is. after_id skips rows that an earlier
+    export already contains.
+    """
     c.execute("""
         SELECT r.id, pl.prime_location_name, ps.spot_number,
                r.parking_in, r.parking_out, r.parking_cost, r.status
         FROM reservations r
         JOIN parking_lots pl ON r.lot_id = pl.id
         JOIN parking_spots ps ON r.spot_id = ps.id
-        WHERE r.user_id = ?
-        ORDER BY r.parking_in;
-    """, (user_id,))
+        WHERE r.user_id = ? AND r.id > ?
+        ORDER BY r.id;
+    """, (user_id, after_id))
 
-    rows = c.fetchall()
-    db.close()
+    while True:
+        rows = c.fetchmany(Config.EXPORT_BATCH_SIZE)
+        if not rows:
+            return
+        yield rows
+
+
+def iter_csv_chunks(c, user_id):
+    """CSV text for a user's export, one chunk per fetched batch."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_HEADER)
+
+    for rows in iter_export_rows(c, user_id):
+        writer.writerows(tuple(r) for r in rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def export_file_path(export_id, compress):
+    suffix = ".csv.gz" if compress else ".csv"
+    return os.path.join(Config.EXPORT_DIR, f"export_{export_id}{suffix}")
+
+
+class _CsvSink:
+    """
+    Writes CSV rows to a binary file, optionally as gzip.
+
+    boundary() ends the current gzip member and returns the file offset, so
+    a later export can copy everything before it byte-for-byte and append
+    new members after it (concatenated gzip members are a valid gzip file).
+    """
+
+    def __init__(self, raw, compress):
+        self.raw = raw
+        self.compress = compress
+        self._member = None
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf)
+
+    def write_rows(self, rows):
+        self._writer.writerows(tuple(r) for r in rows)
+        data = self._buf.getvalue().encode("utf-8")
+        self._buf.seek(0)
+        self._buf.truncate()
+
+        if not self.compress:
+            self.raw.write(data)
+            return
+        if self._member is None:
+            self._member = gzip.GzipFile(fileobj=self.raw, mode="wb")
+        self._member.write(data)
+
+    def boundary(self):
+        if self._member is not None:
+            self._member.close()
+            self._member = None
+        self.raw.flush()
+        return self.raw.tell()
+
+
+def _copy_prefix(src_path, dst, nbytes):
+    with open(src_path, "rb") as src:
+        remaining = nbytes
+        while remaining > 0:
+            chunk = src.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise IOError(f"{src_path} is shorter than its recorded offset")
+            dst.write(chunk)
+            remaining -= len(chunk)
 
-    export_dir = os.path.join(os.getcwd(), "exports")
-    os.makedirs(export_dir, exist_ok=True)
 
-    file_path = os.path.join(export_dir, f"export_{export_id}.csv")
+def latest_ready_export(c, user_id, compress):
+    """
+    The user's most recent finished export of the same format, if its file
+    still exists: (id, file_path, data_version, last_reservation_id,
+    final_offset, final_rows).
+    """
+    c.execute("""
+        SELECT id, file_path, data_version, last_reservation_id,
+               final_offset, final_rows
+        FROM exports
+        WHERE user_id = ? AND compressed = ? AND status = 'ready'
+          AND final_offset IS NOT NULL
+        ORDER BY id DESC
+        LIMIT 1;
+    """, (user_id, int(compress)))
+    row = c.fetchone()
+    if row is None or not row[1] or not os.path.exists(row[1]):
+        return None
+    return row
+
+
+def _set_export_status(db, export_id, status, **fields):
+    assignments = "".join(f", {name} = ?" for name in fields)
+    db.execute(
+        f"UPDATE exports SET status = ?{assignments} WHERE id = ?;",
+        (status, *fields.values(), export_id),
+    )
+    db.commit()
+
+
+@celery.task(name="backend.tasks.export.generate_csv")
+def generate_csv(export_id, user_id, compress=False):
+    """
+    Celery task that writes a user's reservations to a CSV file
+    (optionally gzipped) and records progress and the final status on
+    the exports row. Returns the file path.
+
+    Completed/cancelled reservations never change, so the file is split
+    into an immutable prefix (every row before the first active one) and a
+    tail. When an earlier export exists, its prefix is copied as raw bytes
+    and only reservations after its last_reservation_id are queried and
+    appended; the earlier export is then marked superseded.
+    """
+    db = get_db()
+    c = db.cursor()
+
+    c.execute("SELECT reservation_version FROM users WHERE id = ?;", (user_id,))
+    data_version = c.fetchone()[0]
+    base = latest_ready_export(c, user_id, compress)
+
+    file_path = export_file_path(export_id, compress)
+    tmp_path = file_path + ".part"
+    os.makedirs(Config.EXPORT_DIR, exist_ok=True)
+
+    _set_export_status(
+        db, export_id, "running",
+        file_path=file_path, rows_written=0,
+        compressed=int(compress), data_version=data_version,
+    )
+
+    try:
+        with open(tmp_path, "wb") as raw:
+            sink = _CsvSink(raw, compress)
+
+            if base:
+                _copy_prefix(base[1], raw, base[4])
+                last_final_id, final_rows = base[3], base[5]
+            else:
+                sink.write_rows([EXPORT_HEADER])
+                last_final_id, final_rows = 0, 0
+
+            final_offset = None
+            tail_rows = 0
+            for rows in iter_export_rows(c, user_id, after_id=last_final_id):
+                if final_offset is None:
+                    cut = next(
+                        (i for i, r in enumerate(rows) if r[6] == "active"), len(rows)
+                    )
+                    if cut:
+                        sink.write_rows(rows[:cut])
+                        final_rows += cut
+                        last_final_id = rows[cut - 1][0]
+                    if cut < len(rows):
+                        final_offset = sink.boundary()
+                        sink.write_rows(rows[cut:])
+                        tail_rows += len(rows) - cut
+                else:
+                    sink.write_rows(rows)
+                    tail_rows += len(rows)
+
+                db.execute(
+                    "UPDATE exports SET rows_written = ? WHERE id = ?;",
+                    (final_rows + tail_rows, export_id),
+                )
+                db.commit()
+
+            end_offset = sink.boundary()
+            if final_offset is None:
+                final_offset = end_offset
+
+        os.replace(tmp_path, file_path)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        _set_export_status(db, export_id, "failed", error=str(e))
+        db.close()
+        raise
+
+    db.execute("""
+        UPDATE exports
+        SET status = 'ready', rows_written = ?, completed_at = datetime('now'),
+            last_reservation_id = ?, final_offset = ?, final_rows = ?
+        WHERE id = ?;
+    """, (final_rows + tail_rows, last_final_id, final_offset, final_rows, export_id))
+
+    if base:
+        db.execute("UPDATE exports SET status = 'superseded' WHERE id = ?;", (base[0],))
+    db.commit()
+    db.close()
 
-    with open(file_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["ID", "Lot", "Spot", "Start", "End", "Cost", "Status"])
-        for r in rows:
-            writer.writerow(r)
+    if base and base[1] != file_path and os.path.exists(base[1]):
+        os.remove(base[1])
 
-    print(f"[EXPORT] CSV generated for user {user_id}: {file_path}")
+    log.info("export %s: CSV generated for user %s: %s", export_id, user_id, file_path)
     return file_path
@@ -0,0 +1,142 @@
+import bisect
+import time
+
+import redis
+from celery.signals import before_task_publish, task_postrun, task_prerun
+
+from backend.celery_app import celery, QUEUES
+from backend.config import Config
+
+_redis = redis.Redis.from_url(Config.REDIS_URL)
+
+# Upper bounds (seconds) of the per-task duration histograms.
+TASK_DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+_TASK_DURATION_PREFIX = "celery:metrics:duration:"
+
+
+def _stats_key(queue, kind):
+    return f"celery:stats:{queue}:{kind}"
+
+
+@before_task_publish.connect
+def _stamp_enqueue_time(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+
+
+def _queue_of(request):
+    return (request.delivery_info or {}).get("routing_key") or "unknown"
+
+
+def _sample(queue, kind, ms):
+    key = _stats_key(queue, kind)
+    try:
+        pipe = _redis.pipeline(transaction=False)
+        pipe.lpush(key, round(ms, 3))
+        pipe.ltrim(key, 0, Config.CELERY_STATS_SAMPLES - 1)
+        pipe.execute()
+    except redis.RedisError:
+        pass  # stats are best effort; never fail the task over them
+
+
+@task_prerun.connect
+def _record_wait(task=None, **kwargs):
+    request = task.request
+    if request.is_eager:
+        return
+    request.monitor_started = time.monotonic()
+
+    enqueued_at = request.get("enqueued_at")
+    if enqueued_at is not None:
+        _sample(_queue_of(request), "wait", (time.time() - enqueued_at) * 1000)
+
+
+def _observe_duration(task_name, state, seconds):
+    """Add one run to the task's histogram, shared by all workers."""
+    key = f"{_TASK_DURATION_PREFIX}{task_name}:{state}"
+    bucket = bisect.bisect_left(TASK_DURATION_BUCKETS, seconds)
+    try:
+        pipe = _redis.pipeline(transaction=False)
+        pipe.hincrby(key, f"b{bucket}", 1)
+        pipe.hincrbyfloat(key, "sum", seconds)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+@task_postrun.connect
+def _record_runtime(task=None, state=None, **kwargs):
+    request = task.request
+    started = getattr(request, "monitor_started", None)
+    if started is not None:
+        seconds = time.monotonic() - started
+        _sample(_queue_of(request), "run", seconds * 1000)
+        _observe_duration(task.name, state or "UNKNOWN", seconds)
+
+
+def queue_depth(queue):
+    """Messages waiting in a queue on the Redis broker, over all priority lists."""
+    options = celery.conf.broker_transport_options
+    sep = options.get("sep", "\x06\x16")
+    names = [
+        f"{queue}{sep}{step}" if step else queue
+        for step in options.get("priority_steps", [0])
+    ]
+    pipe = _redis.pipeline(transaction=False)
+    for name in names:
+        pipe.llen(name)
+    return sum(pipe.execute())
+
+
+def task_duration_series():
+    """
+    (task, state, counts per bucket with +Inf last, sum) for every task
+    that has run on a worker since the Redis keys were last cleared.
+    """
+    keys = sorted(_redis.scan_iter(match=f"{_TASK_DURATION_PREFIX}*", count=500))
+    if not keys:
+        return []
+    pipe = _redis.pipeline(transaction=False)
+    for key in keys:
+        pipe.hgetall(key)
+
+    series = []
+    for key, fields in zip(keys, pipe.execute()):
+        task, state = key.decode()[len(_TASK_DURATION_PREFIX):].rsplit(":", 1)
+        fields = {k.decode(): v for k, v in fields.items()}
+        counts = [int(fields.get(f"b{i}", 0)) for i in range(len(TASK_DURATION_BUCKETS) + 1)]
+        series.append((task, state, counts, float(fields.get("sum", 0))))
+    return series
+
+
+def _summary(samples):
+    if not samples:
+        return {"samples": 0}
+    samples = sorted(samples)
+    return {
+        "samples": len(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max": samples[-1],
+    }
+
+
+def queue_stats():
+    """
+    Per queue: current depth, and percentiles over the last
+    CELERY_STATS_SAMPLES tasks of queue wait (publish -> start) and run
+    time, in milliseconds.
+    """
+    stats = {}
+    for queue in QUEUES:
+        pipe = _redis.pipeline(transaction=False)
+        pipe.lrange(_stats_key(queue, "wait"), 0, -1)
+        pipe.lrange(_stats_key(queue, "run"), 0, -1)
+        waits, runs = pipe.execute()
+
+        stats[queue] = {
+            "depth": queue_depth(queue),
+            "wait_ms": _summary([float(v) for v in waits]),
+            "run_ms": _summary([float(v) for v in runs]),
+        }
+    return stats
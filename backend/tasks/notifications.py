@@ -0,0 +1,115 @@
+import logging
+import time
+
+import redis
+from celery import chord
+from celery.utils.time import get_exponential_backoff_interval
+
+from backend.celery_app import celery
+from backend.config import Config
+from backend.emailer import get_mailer
+
+log = logging.getLogger(__name__)
+
+_redis = redis.Redis.from_url(Config.REDIS_URL)
+
+SEND_RATE_KEY = "mail:rate"
+
+
+def wait_for_send_slot():
+    """
+    Block until the cluster-wide EMAIL_GLOBAL_RATE_LIMIT allows one more
+    message this second. Every worker increments the same per-second
+    counter in Redis, so the limit holds however many workers are running.
+    """
+    limit = Config.EMAIL_GLOBAL_RATE_LIMIT
+    if limit <= 0:
+        return
+
+    while True:
+        now = time.time()
+        key = f"{SEND_RATE_KEY}:{int(now)}"
+        pipe = _redis.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, 2)
+        count = pipe.execute()[0]
+        if count <= limit:
+            return
+        time.sleep(int(now) + 1 - now)
+
+
+def deliver_chunk(task, rows, build_message, sent=0, failed=0, on_delivered=None):
+    """
+    Body of a chunked send subtask.
+
+    build_message(row) -> (to, subject, html). Rows whose delivery failed
+    temporarily are retried with exponential backoff (only those rows, so
+    nobody gets a message twice); permanent failures are just counted.
+    on_delivered(rows) runs for the rows that went out. Returns the
+    chunk's {"sent", "failed"} totals across all attempts.
+
+    The task must be called with keyword arguments only (rows=..., ...)
+    because the retry re-sends the original kwargs with rows, sent and
+    failed replaced.
+    """
+    mailer = get_mailer()
+    delivered = []
+    again = []
+
+    for row in rows:
+        wait_for_send_slot()
+        result = mailer.send(*build_message(row))
+        if result.ok:
+            delivered.append(row)
+        elif result.temporary:
+            again.append(row)
+        else:
+            failed += 1
+
+    sent += len(delivered)
+    if delivered and on_delivered:
+        on_delivered(delivered)
+
+    if again:
+        retries = task.request.retries
+        if retries < task.max_retries:
+            countdown = get_exponential_backoff_interval(
+                factor=Config.EMAIL_RETRY_BACKOFF,
+                retries=retries,
+                maximum=Config.EMAIL_RETRY_BACKOFF_MAX,
+                full_jitter=True,
+            )
+            raise task.retry(
+                args=(),
+                kwargs={**task.request.kwargs, "rows": again, "sent": sent, "failed": failed},
+                countdown=countdown,
+            )
+        failed += len(again)
+
+    return {"sent": sent, "failed": failed}
+
+
+@celery.task(name="summarize_email_run")
+def summarize_email_run(results, job):
+    """Chord callback: add up the per-chunk counts of one fan-out run."""
+    summary = {
+        "job": job,
+        "chunks": len(results),
+        "sent": sum(r["sent"] for r in results),
+        "failed": sum(r["failed"] for r in results),
+    }
+    log.info("%(job)s: %(sent)d sent, %(failed)d failed in %(chunks)d chunks", summary)
+    return summary
+
+
+def fan_out(job, signatures):
+    """
+    Run the chunk subtasks in parallel with summarize_email_run as the
+    chord callback. Returns what the planner task reports back.
+    """
+    signatures = list(signatures)
+    if not signatures:
+        return {"job": job, "chunks": 0}
+
+    result = chord(signatures)(summarize_email_run.s(job=job))
+    return {"job": job, "chunks": len(signatures), "summary_id": result.id}
@@ -1,46 +1,94 @@
 from backend.celery_app import celery
+from backend.config import Config
 from backend.db import get_db
-from datetime import date
-from backend.emailer import send_email
+from datetime import date, timedelta
+from backend.tasks.notifications import deliver_chunk, fan_out
 
 
-@celery.task(name="daily_user_reminder")
-def daily_user_reminder():
+def day_bounds(day):
     """
-    Send an email reminder to users who have not parked today.
+    [start, end) strings for one calendar day of parking_in values.
+
+    parking_in is stored as an ISO timestamp, so a plain string range is
+    equivalent to DATE(parking_in) = day but can use
+    idx_reservations_user_parking_in.
+    """
+    return day.isoformat(), (day + timedelta(days=1)).isoformat()
+
+
+def iter_reminder_candidates(day, batch_size=None):
+    """
+    Yield batches of (user_id, username, email) for users with an email
+    address and no reservation starting on `day`.
+
+    One anti-join per batch, paged by user id, so the whole run is a single
+    ordered pass over users with an index probe each, and no read
+    transaction stays open while mail is being sent.
     """
-    today = date.today().isoformat()
+    batch_size = batch_size or Config.REMINDER_BATCH_SIZE
+    start, end = day_bounds(day)
 
     db = get_db()
     c = db.cursor()
+    after_id = 0
 
-    # id, username, email
-    c.execute("SELECT id, username, email FROM users WHERE role = 'user';")
-    users = c.fetchall()
+    while True:
+        c.execute("""
+            SELECT u.id, u.username, u.email
+            FROM users u
+            WHERE u.id > ?
+              AND u.role = 'user'
+              AND u.email IS NOT NULL AND u.email != ''
+              AND NOT EXISTS (
+                  SELECT 1 FROM reservations r
+                  WHERE r.user_id = u.id
+                    AND r.parking_in >= ? AND r.parking_in < ?
+              )
+            ORDER BY u.id
+            LIMIT ?;
+        """, (after_id, start, end, batch_size))
 
-    for user_id, username, email in users:
-        if not email:
-            continue  # skip users without email
+        rows = c.fetchall()
+        db.close()
+        if not rows:
+            return
 
-        c.execute("""
-            SELECT id FROM reservations
-            WHERE user_id = ? AND DATE(parking_in) = ?
-        """, (user_id, today))
-
-        parked_today = c.fetchone()
-
-        if parked_today:
-            continue
-
-        send_email(
-            to=email,
-            subject="Daily Parking Reminder",
-            html=f"""
-            <p>Hello <b>{username}</b>,</p>
-            <p>You haven’t used the parking lots today.</p>
-            <p>If you need parking, you can reserve a spot via the app.</p>
-            """,
-        )
-
-    db.close()
-    return "Daily reminders sent"
+        yield [tuple(r) for r in rows]
+        after_id = rows[-1][0]
+
+
+def reminder_message(row):
+    user_id, username, email = row
+    return (
+        email,
+        "Daily Parking Reminder",
+        f"""
+        <p>Hello <b>{username}</b>,</p>
+        <p>You haven’t used the parking lots today.</p>
+        <p>If you need parking, you can reserve a spot via the app.</p>
+        """,
+    )
+
+
+@celery.task(
+    name="send_reminder_chunk", bind=True, max_retries=Config.EMAIL_CHUNK_MAX_RETRIES
+)
+def send_reminder_chunk(self, rows, sent=0, failed=0):
+    return deliver_chunk(self, rows, reminder_message, sent, failed)
+
+
+@celery.task(name="daily_user_reminder")
+def daily_user_reminder():
+    """
+    Send an email reminder to users who have not parked today.
+
+    Plans the run only: recipients are split into EMAIL_CHUNK_SIZE chunks
+    that are sent by send_reminder_chunk subtasks on any worker, with
+    summarize_email_run collecting the totals.
+    """
+    today = date.today()
+
+    return fan_out("daily_user_reminder", (
+        send_reminder_chunk.s(rows=batch)
+        for batch in iter_reminder_candidates(today, Config.EMAIL_CHUNK_SIZE)
+    ))
@@ -1,61 +1,189 @@
 from backend.celery_app import celery
+from backend.config import Config
 from backend.db import get_db
-from backend.emailer import send_email
-from datetime import date
-from collections import Counter
+from backend.tasks.notifications import deliver_chunk, fan_out
+from datetime import date, datetime, timedelta
 
 
-@celery.task(name="monthly_report")
-def monthly_report():
+def parse_month(value=None):
     """
-    Sends monthly activity report to all users who had activity this month.
+    'YYYY-MM' -> date of the 1st of that month; None -> current month;
+    'previous' -> last month (what the beat schedule reports on).
     """
-    today = date.today()
-    month_str = today.strftime("%B %Y")
+    if value is None:
+        return date.today().replace(day=1)
+    if value == "previous":
+        return (date.today().replace(day=1) - timedelta(days=1)).replace(day=1)
+    return datetime.strptime(value, "%Y-%m").date()
+
+
+def month_bounds(first_day):
+    """[start, end) parking_in strings covering one calendar month."""
+    if first_day.month == 12:
+        next_month = first_day.replace(year=first_day.year + 1, month=1)
+    else:
+        next_month = first_day.replace(month=first_day.month + 1)
+    return first_day.isoformat(), next_month.isoformat()
+
+
+def build_monthly_reports(first_day):
+    """
+    Aggregate every user's activity for one month in a single query and
+    store it in monthly_reports. Returns the number of report rows.
+
+    The month is a parking_in range served by idx_reservations_month
+    (covering index), visits/spend are grouped per user and lot, and the
+    most used lot is picked with ROW_NUMBER() instead of in Python.
+    Rows left over from an earlier run of the same month for users that
+    no longer have activity are removed.
+    """
+    month = first_day.strftime("%Y-%m")
+    start, end = month_bounds(first_day)
 
     db = get_db()
     c = db.cursor()
 
-    c.execute("SELECT id, username, email FROM users WHERE role = 'user';")
-    users = c.fetchall()
+    c.execute("SELECT strftime('%Y-%m-%d %H:%M:%f', 'now');")
+    run_stamp = c.fetchone()[0]
+
+    c.execute("""
+        WITH per_lot AS (
+            SELECT r.user_id, r.lot_id,
+                   COUNT(*) AS visits,
+                   SUM(COALESCE(r.parking_cost, 0)) AS spent
+            FROM reservations r
+            WHERE r.parking_in >= ? AND r.parking_in < ?
+            GROUP BY r.user_id, r.lot_id
+        ),
+        ranked AS (
+            SELECT user_id, lot_id,
+                   SUM(visits) OVER (PARTITION BY user_id) AS total_visits,
+                   SUM(spent) OVER (PARTITION BY user_id) AS total_spent,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY user_id ORDER BY visits DESC, lot_id
+                   ) AS rank
+            FROM per_lot
+        )
+        INSERT INTO monthly_reports (user_id, month, visits, total_spent,
+                                     most_used_lot_id, most_used_lot_name, generated_at)
+        SELECT rk.user_id, ?, rk.total_visits, rk.total_spent,
+               rk.lot_id, pl.prime_location_name, ?
+        FROM ranked rk
+        LEFT JOIN parking_lots pl ON pl.id = rk.lot_id
+        WHERE rk.rank = 1
+        ON CONFLICT (user_id, month) DO UPDATE SET
+            visits = excluded.visits,
+            total_spent = excluded.total_spent,
+            most_used_lot_id = excluded.most_used_lot_id,
+            most_used_lot_name = excluded.most_used_lot_name,
+            generated_at = excluded.generated_at;
+    """, (start, end, month, run_stamp))
+    # cursor.rowcount is -1 for statements starting with WITH
+    c.execute("SELECT changes();")
+    count = c.fetchone()[0]
+
+    c.execute("""
+        DELETE FROM monthly_reports
+        WHERE month = ? AND generated_at != ?;
+    """, (month, run_stamp))
+
+    db.commit()
+    db.close()
+    return count
+
+
+def iter_report_recipients(first_day, batch_size=None):
+    """
+    Yield batches of stored reports joined with the user's contact details:
+    (user_id, username, email, visits, total_spent, most_used_lot_name).
+    Reports already emailed are skipped, so re-running a month only sends
+    the ones that have not gone out yet.
+    """
+    batch_size = batch_size or Config.REMINDER_BATCH_SIZE
+    month = first_day.strftime("%Y-%m")
 
-    for user_id, username, email in users:
-        if not email:
-            continue
+    db = get_db()
+    c = db.cursor()
+    after_id = 0
 
+    while True:
         c.execute("""
-            SELECT pl.prime_location_name, r.parking_cost
-            FROM reservations r
-            JOIN parking_lots pl ON r.lot_id = pl.id
-            WHERE r.user_id = ?
-              AND strftime('%Y-%m', r.parking_in) = strftime('%Y-%m', 'now')
-        """, (user_id,))
+            SELECT u.id, u.username, u.email,
+                   mr.visits, mr.total_spent, mr.most_used_lot_name
+            FROM monthly_reports mr
+            JOIN users u ON u.id = mr.user_id
+            WHERE mr.month = ? AND mr.user_id > ?
+              AND mr.emailed_at IS NULL
+              AND u.role = 'user'
+              AND u.email IS NOT NULL AND u.email != ''
+            ORDER BY mr.user_id
+            LIMIT ?;
+        """, (month, after_id, batch_size))
 
         rows = c.fetchall()
+        db.close()
         if not rows:
-            continue
+            return
 
-        lots = [r[0] for r in rows]
-        costs = [r[1] or 0 for r in rows]
+        yield [tuple(r) for r in rows]
+        after_id = rows[-1][0]
 
-        most_used = Counter(lots).most_common(1)[0][0]
-        total_spent = sum(costs)
-        total_rides = len(rows)
 
-        html = f"""
+def mark_reports_emailed(first_day, user_ids):
+    db = get_db()
+    db.executemany("""
+        UPDATE monthly_reports SET emailed_at = datetime('now')
+        WHERE user_id = ? AND month = ?;
+    """, [(user_id, first_day.strftime("%Y-%m")) for user_id in user_ids])
+    db.commit()
+    db.close()
+
+
+def render_monthly_report(first_day, visits, total_spent, most_used):
+    month_str = first_day.strftime("%B %Y")
+    return f"""
         <h2>Your Parking Report - {month_str}</h2>
-        <p><b>Total visits:</b> {total_rides}</p>
-        <p><b>Most used parking lot:</b> {most_used}</p>
+        <p><b>Total visits:</b> {visits}</p>
+        <p><b>Most used parking lot:</b> {most_used or "-"}</p>
         <p><b>Total amount spent:</b> ₹ {total_spent:.2f}</p>
         <hr>
         <p>Thank you for using the Vehicle Parking App!</p>
         """
 
-        send_email(
-            to=email,
-            subject=f"Monthly Parking Report - {month_str}",
-            html=html,
-        )
 
-    db.close()
-    return "Monthly reports sent"
+@celery.task(
+    name="send_report_chunk", bind=True, max_retries=Config.EMAIL_CHUNK_MAX_RETRIES
+)
+def send_report_chunk(self, month, rows, sent=0, failed=0):
+    first_day = parse_month(month)
+    subject = f"Monthly Parking Report - {first_day.strftime('%B %Y')}"
+
+    def message(row):
+        user_id, username, email, visits, total_spent, most_used = row
+        return email, subject, render_monthly_report(first_day, visits, total_spent, most_used)
+
+    return deliver_chunk(
+        self, rows, message, sent, failed,
+        on_delivered=lambda delivered: mark_reports_emailed(
+            first_day, [row[0] for row in delivered]
+        ),
+    )
+
+
+@celery.task(name="monthly_report")
+def monthly_report(month=None):
+    """
+    Sends monthly activity report to all users who had activity in the
+    given month ('YYYY-MM' or 'previous', default: this month), except
+    those already emailed. Reports are computed once into monthly_reports,
+    then emailed by send_report_chunk subtasks in EMAIL_CHUNK_SIZE chunks.
+    """
+    first_day = parse_month(month)
+    month = first_day.strftime("%Y-%m")
+
+    build_monthly_reports(first_day)
+
+    return fan_out("monthly_report", (
+        send_report_chunk.s(month=month, rows=batch)
+        for batch in iter_report_recipients(first_day, Config.EMAIL_CHUNK_SIZE)
+    ))
@@ -0,0 +1,123 @@
+# backend/versions.py
+"""
+Strong ETags from the lots data versions.
+
+data_versions('lots') and parking_lots.version (migration 4) change with
+every committed lot or occupancy change. The routes that make those
+changes mirror the new values into the Redis sorted set "lots:versions"
+after committing (live.publish_lot_changes): member "*" is the global
+version, the others are lot ids. Writes use ZADD GT, so a writer that
+publishes late can never move a version backwards.
+
+Endpoints wrapped in version_etag() derive their ETag from the mirror and
+answer a matching If-None-Match with 304 after one Redis lookup, before
+the view runs: no SQLite connection and no response-cache read. A version
+missing from the mirror (cold Redis) is read from SQLite once and added.
+
+Anything else that changes lots must publish too (cli.py does), or the
+mirror goes stale and clients get 304s for changed data. A publish that
+fails removes the lots' entries instead (forget_versions). After
+restoring an older database, delete "lots:versions".
+"""
+import hashlib
+from functools import wraps
+
+import redis
+from flask import Response, g, make_response, request
+
+from backend.config import Config
+from backend.models import get_lot_version, get_lots_version
+
+_redis = redis.Redis.from_url(Config.REDIS_URL)
+
+_VERSIONS_KEY = "lots:versions"
+_GLOBAL = "*"
+
+
+def record_versions(pipe, global_version, lot_versions):
+    """Queue a mirror update ({lot_id: version}) on a Redis pipeline."""
+    mapping = {str(lot_id): version for lot_id, version in lot_versions.items()}
+    mapping[_GLOBAL] = global_version
+    pipe.zadd(_VERSIONS_KEY, mapping, gt=True)
+
+
+def forget_versions(lot_ids):
+    """
+    Drop lot_ids and the global version from the mirror, so the next ETag
+    check reads them from SQLite. For when publishing a change failed.
+    """
+    _redis.zrem(_VERSIONS_KEY, _GLOBAL, *(str(lot_id) for lot_id in lot_ids))
+
+
+def _lookup(member, load):
+    try:
+        score = _redis.zscore(_VERSIONS_KEY, member)
+    except redis.RedisError:
+        return load()
+    if score is not None:
+        return int(score)
+
+    version = load()
+    if version is not None:
+        try:
+            _redis.zadd(_VERSIONS_KEY, {member: version}, gt=True)
+        except redis.RedisError:
+            pass
+    return version
+
+
+def lots_version():
+    """Current global lots version."""
+    return _lookup(_GLOBAL, get_lots_version)
+
+
+def lot_version(lot_id):
+    """Current version of one lot, or None if it does not exist."""
+    return _lookup(str(lot_id), lambda: get_lot_version(lot_id))
+
+
+def lots_etag(scope):
+    """ETag maker for views whose body covers every lot."""
+    def make_etag(**view_args):
+        g.lots_version = lots_version()
+        return f"{scope}-{g.lots_version}"
+    return make_etag
+
+
+def lot_etag(scope):
+    """ETag maker for views of one lot (view argument lot_id); includes the query string."""
+    def make_etag(lot_id, **view_args):
+        query = hashlib.sha1(request.query_string).hexdigest()[:12]
+        return f"{scope}-{lot_id}-{lot_version(lot_id)}-{query}"
+    return make_etag
+
+
+def version_etag(make_etag):
+    """
+    View decorator (inside the auth decorator): tag 200 responses with
+    make_etag(**view_args) and answer a matching If-None-Match with 304
+    without calling the view. A view that serves an older body sets
+    g.stale_body and keeps its own ETag.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            etag = make_etag(**kwargs)
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if g.get("stale_body"):
+                    # An older body served while another worker refreshes
+                    # keeps its own content ETag (json_response), so the
+                    # client does not store it under the current version.
+                    response.headers["Cache-Control"] = "private, no-cache"
+                    return response
+            response.set_etag(etag)
+            # Authenticated data: browsers may keep it but must revalidate.
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,47 @@
+"""
+Start a Celery worker for one queue using its profile from
+Config.CELERY_WORKER_PROFILES (pool, concurrency, prefetch):
+
+    python -m backend.worker exports
+    python -m backend.worker notifications --loglevel info
+
+Extra arguments are passed through to `celery worker`. The analytics
+worker also consumes the default queue. For a gevent pool start the
+worker through the `celery` command instead, which monkey-patches before
+anything else is imported:
+
+    celery -A backend.celery_app worker -Q notifications -P gevent -c 200
+"""
+import sys
+
+from backend.celery_app import celery, DEFAULT_QUEUE
+from backend.config import Config
+
+
+def worker_argv(queue, extra=()):
+    profile = Config.CELERY_WORKER_PROFILES[queue]
+    queues = f"{queue},{DEFAULT_QUEUE}" if queue == "analytics" else queue
+    return [
+        "worker",
+        "--queues", queues,
+        "--pool", profile["pool"],
+        "--concurrency", str(profile["concurrency"]),
+        "--prefetch-multiplier", str(profile["prefetch"]),
+        "--hostname", f"{queue}@%h",
+        *extra,
+    ]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in Config.CELERY_WORKER_PROFILES:
+        print(__doc__)
+        print("queues:", ", ".join(Config.CELERY_WORKER_PROFILES))
+        return 2
+
+    celery.worker_main(worker_argv(argv[0], argv[1:]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+// src/api/live.js
+import api from "./axios";
+
+// Subscribe to a lot event stream (/user/parking-lots/events or
+// /admin/parking-lots/events). The server sends a "snapshot" of every lot
+// first, then small "delta" events; EventSource reconnects by itself and
+// resumes from the last event id. Without EventSource support, poll() is
+// called every pollMs instead.
+//
+// Returns a function that closes the stream.
+export function subscribeLots(path, { onSnapshot, onDelta, poll, pollMs = 15000 }) {
+  if (typeof EventSource === "undefined") {
+    poll();
+    const timer = setInterval(poll, pollMs);
+    return () => clearInterval(timer);
+  }
+
+  const source = new EventSource(api.defaults.baseURL + path, {
+    withCredentials: true,
+  });
+  source.addEventListener("snapshot", (e) => onSnapshot(JSON.parse(e.data)));
+  source.addEventListener("delta", (e) => onDelta(JSON.parse(e.data)));
+  return () => source.close();
+}
+
+// Apply a delta to a list of lot summaries (as returned by the lot list
+// endpoints and snapshots). Events older than what the list already shows
+// are ignored. Returns true when the lot is not in the list and the event
+// carries no details, i.e. the caller should reload the list.
+export function applyLotDelta(lots, event) {
+  const index = lots.findIndex((l) => l.id === event.lot_id);
+  const lot = lots[index];
+  if (lot && lot.version >= event.version) return false;
+
+  if (event.deleted) {
+    if (lot) lots.splice(index, 1);
+    return false;
+  }
+  if (event.lot) {
+    if (lot) lots.splice(index, 1, event.lot);
+    else lots.push(event.lot);
+    return false;
+  }
+  if (!lot) return true;
+
+  lot.occupied_spots = event.occupied;
+  lot.available_spots = event.available;
+  lot.total_spots = event.total;
+  lot.version = event.version;
+  return false;
+}